@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+"""
+Benchmarks for the hot paths of the loader.
+
+usage: benchmark.py [options] [name ...]
+	runs the named benchmarks (all of them if none are given) on a
+	synthetic CSV file and prints the results as JSON, see --help
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+from datetime import datetime
+from StringIO import StringIO
+
+import failtype
+import fileprober
+import csvparse
+import gentable
+
+def _gen_int(rnd):
+	return str(rnd.randint(-10**6,10**9))
+
+def _gen_float(rnd):
+	return repr(rnd.uniform(-1000,1000))
+
+def _gen_date(rnd):
+	return datetime.utcfromtimestamp(rnd.randint(946684800,1735689600)).strftime("%Y-%m-%d %H:%M:%S")
+
+def _gen_date2(rnd):
+	return _gen_date(rnd)+".%06i"%rnd.randint(0,999999)
+
+_words=[u"foo",u"bar",u"\xe5\xe4\xf6",u"\u2013",u"caf\xe9",u"na\xefve",u"x"]
+
+def _gen_utf(rnd):
+	return u"".join(rnd.choice(_words) for i in range(rnd.randint(1,6))).encode("utf-8")
+
+def _gen_str(rnd):
+	return "".join(rnd.choice("abcdefghijklmnopqrstuvwxyz") for i in range(rnd.randint(1,20)))
+
+def _gen_null(rnd):
+	"""ints, with every fifth value a NULL"""
+	r=rnd.random()
+	if r<0.1:
+		return ""
+	if r<0.2:
+		return "NULL"
+	return _gen_int(rnd)
+
+def _gen_sparse(rnd,first=False):
+	"""almost always empty, but never in the first row as every probe reads the head of the file"""
+	return _gen_int(rnd) if first or rnd.random()<0.001 else ""
+
+generators={
+	"int":_gen_int,
+	"float":_gen_float,
+	"date":_gen_date,
+	"date2":_gen_date2,
+	"str":_gen_str,
+	"utf":_gen_utf,
+	"null":_gen_null,
+	"sparse":_gen_sparse,
+}
+
+def generate(fd,rows=100000,columns="int,float,date,date2,str,utf,null,sparse",width=1,error_rate=0.0,seed=0,sep=","):
+	"""
+	Write a synthetic CSV file to fd.
+
+	columns: comma separated column kinds, see generators
+	width: the column kinds are repeated this many times
+	error_rate: the fraction of rows that get an extra column
+	seed: the same seed always gives the same file
+	Files with utf columns start with a BOM, so that csvparse decodes them.
+	The first row never has an error and always has a sparse value.
+	"""
+	rnd=random.Random(seed)
+	kinds=[k.strip() for k in columns.split(",")]*width
+	gens=[generators[k] for k in kinds]
+	if "utf" in kinds:
+		fd.write("\xef\xbb\xbf")
+	fd.write(sep.join("%s_%i"%(k,i) for i,k in enumerate(kinds))+"\n")
+	for n in xrange(rows):
+		row=[g(rnd,True) if n==0 and g==_gen_sparse else g(rnd) for g in gens]
+		if error_rate and n and rnd.random()<error_rate:
+			row.append("junk")
+		fd.write(sep.join(row)+"\n")
+
+def _timed(fun,repeat=3):
+	"""the best wall time of repeat runs, and the result of the last"""
+	best=None
+	for i in range(repeat):
+		start=time.time()
+		result=fun()
+		elapsed=time.time()-start
+		best=elapsed if best==None else min(best,elapsed)
+	return best,result
+
+def _typers(path):
+	"""fresh failtypes for the columns of the file, and a probe callback feeding them"""
+	with open(path) as f:
+		head=f.readline()
+	utf=head.startswith("\xef\xbb\xbf")
+	ncols=len(head.split(","))
+	types=[failtype.failtype(utf=utf) for i in range(ncols)]
+	def callback(line):
+		cols=line.strip().split(",")
+		if len(cols)!=ncols:
+			raise ValueError("wrong number of columns")
+		for t,c in zip(types,cols):
+			t(c)
+	return types,callback
+
+def bench_probe(path,config):
+	"""every fileprober strategy, feeding the failtypes"""
+	maxrows=10000
+	def strategy(run):
+		def probe():
+			types,callback=_typers(path)
+			with open(path) as fd:
+				run(fd,callback,types)
+			return types
+		return probe
+	strategies={
+		"head_reader":lambda fd,cb,types: fileprober._head_reader(fd,cb,True,maxrows,ignore_exceptions=True),
+		"full_skipper":lambda fd,cb,types: fileprober._full_skipper(fd,cb,True,maxrows,ignore_exceptions=True),
+		"full_reader":lambda fd,cb,types: fileprober._full_reader(fd,cb,True,ignore_exceptions=True),
+		"mmap_sampler":lambda fd,cb,types: fileprober.fileprober(fd,cb,maxrows=maxrows,ignore_exceptions=True),
+		"adaptive":lambda fd,cb,types: fileprober.fileprober(fd,cb,ignore_exceptions=True,
+			converged=lambda: all(t.is_stable(1000) for t in types),window=1000),
+	}
+	result={}
+	for name,run in sorted(strategies.items()):
+		elapsed,types=_timed(strategy(run))
+		result[name]={"seconds":elapsed,"rows":max(t._observed for t in types)}
+	return result
+
+def bench_failtype(path,config):
+	"""failtype.test on the values of each column kind"""
+	with open(path) as f:
+		head=f.readline()
+		lines=[f.readline() for i in range(min(config.rows,20000))]
+	utf=head.startswith("\xef\xbb\xbf")
+	names=head.lstrip("\xef\xbb\xbf").strip().split(",")
+	columns=zip(*[l.strip().split(",")[:len(names)] for l in lines if l.count(",")==len(names)-1])
+	result={}
+	for name,values in zip(names,columns):
+		kind=name.rsplit("_",1)[0]
+		if kind in result:
+			continue
+		elapsed,t=_timed(lambda: _test_all(failtype.failtype(utf=utf),values))
+		result[kind]={"seconds":elapsed,"values":len(values),"values_per_s":len(values)/elapsed}
+	return result
+
+def _test_all(typer,values):
+	for v in values:
+		typer.test(v)
+	return typer
+
+def bench_parse(path,config):
+	"""csvparse probing and itteration, serial and parallel"""
+	log=StringIO()
+	def parse():
+		return csvparse.csvparse(open(path),continue_on_error=True,log_file=log,maxrows=10000)
+	result={}
+	result["probe"],csv=_timed(parse)
+	result["iterate"],n=_timed(lambda: sum(1 for r in csv))
+	result["rows"]=n
+	result["rows_per_s"]=n/result["iterate"]
+	result["iterate_parallel"],n=_timed(lambda: sum(1 for r in csv.iter_parallel(chunk_size=2**20)),repeat=1)
+	return result
+
+def bench_load(path,config):
+	"""load_to_table in to a sqlite file, with generic inserts and the bulk loader"""
+	tmp=tempfile.mkdtemp()
+	result={}
+	try:
+		for name,options in [("insert",{"batch_size":1000}),("bulk",{"bulk":True})]:
+			db=os.path.join(tmp,name+".sqlite")
+			def load():
+				if os.path.exists(db):
+					os.remove(db)
+				gentable.load_to_table(open(path),"sqlite:///"+db,tabname="bench",continue_on_error=True,log_file=StringIO(),**options)
+			elapsed,_=_timed(load,repeat=1)
+			result[name]={"seconds":elapsed,"rows_per_s":config.rows/elapsed}
+	finally:
+		shutil.rmtree(tmp)
+	return result
+
+def bench_dates(path,config,n=100000):
+	"""
+	failtype._gendate/_gendate2 against plain datetime.strptime on n
+	distinct timestamps spread over a year
+	"""
+	stamps=[datetime.utcfromtimestamp(1420070400+i*313).strftime("%Y-%m-%d %H:%M:%S") for i in range(n)]
+	fracs=[s+".%06i"%(i%1000000) for i,s in enumerate(stamps)]
+	def run(fun,data):
+		return min(timeit.repeat(lambda: [fun(s) for s in data],number=1,repeat=3))
+	result={
+		"rows":n,
+		"strptime":run(lambda s: datetime.strptime(s,"%Y-%m-%d %H:%M:%S"),stamps),
+		"_gendate":run(failtype._gendate,stamps),
+		"strptime_frac":run(lambda s: datetime.strptime(s,"%Y-%m-%d %H:%M:%S.%f"),fracs),
+		"_gendate2":run(failtype._gendate2,fracs),
+	}
+	result["speedup"]=result["strptime"]/result["_gendate"]
+	result["speedup_frac"]=result["strptime_frac"]/result["_gendate2"]
+	return result
+
+benchmarks={
+	"probe":bench_probe,
+	"failtype":bench_failtype,
+	"parse":bench_parse,
+	"load":bench_load,
+	"dates":bench_dates,
+}
+
+def _commit():
+	"""the checked out git commit, so results can be compared across commits"""
+	try:
+		return subprocess.check_output(["git","rev-parse","HEAD"],cwd=os.path.dirname(os.path.abspath(__file__)),stderr=open(os.devnull,"w")).strip()
+	except (OSError,subprocess.CalledProcessError):
+		return None
+
+def main(argv=None):
+	parser=argparse.ArgumentParser(description='benchmark the loader on a synthetic CSV file')
+	parser.add_argument('names', metavar='name', nargs='*', help='benchmarks to run: %s (default all)'%", ".join(sorted(benchmarks)))
+	parser.add_argument('--rows', type=int, default=100000, help='rows in the generated file')
+	parser.add_argument('--columns', type=str, default="int,float,date,date2,str,utf,null,sparse", help='column kinds: %s'%", ".join(sorted(generators)))
+	parser.add_argument('--width', type=int, default=1, help='repeat the column kinds this many times')
+	parser.add_argument('--error-rate', dest='error_rate', type=float, default=0.0, help='fraction of rows with an extra column')
+	parser.add_argument('--seed', type=int, default=0, help='random seed of the generator')
+	parser.add_argument('--output', type=str, default=None, help='write the JSON here instead of to stdout')
+	config=parser.parse_args(argv)
+	for name in config.names:
+		if name not in benchmarks:
+			parser.error("no benchmark named %s"%name)
+
+	tmp=tempfile.mkdtemp()
+	try:
+		path=os.path.join(tmp,"bench.csv")
+		with open(path,"w") as f:
+			generate(f,config.rows,config.columns,config.width,config.error_rate,config.seed)
+		results={
+			"commit":_commit(),
+			"date":datetime.now().isoformat(),
+			"config":dict((k,v) for k,v in vars(config).items() if k not in ("names","output")),
+			"file_size":os.path.getsize(path),
+			"results":{},
+		}
+		for name in config.names or sorted(benchmarks):
+			results["results"][name]=benchmarks[name](path,config)
+	finally:
+		shutil.rmtree(tmp)
+	out=json.dumps(results,indent=1,sort_keys=True)
+	if config.output:
+		with open(config.output,"w") as f:
+			f.write(out+"\n")
+	else:
+		print out
+
+def _test_generate():
+	"""
+	>>> a,b=StringIO(),StringIO()
+	>>> generate(a,rows=5,columns="int,utf,null",error_rate=0.5,seed=1)
+	>>> generate(b,rows=5,columns="int,utf,null",error_rate=0.5,seed=1)
+	>>> a.getvalue()==b.getvalue()
+	True
+	>>> lines=a.getvalue().splitlines()
+	>>> lines[0]
+	'\\xef\\xbb\\xbfint_0,utf_1,null_2'
+	>>> len(lines), sorted(set(l.count(",") for l in lines[1:]))
+	(6, [2, 3])
+	"""
+
+if __name__ == "__main__":
+	if sys.argv[1:]==["--doctest"]:
+		import doctest
+		doctest.testmod(optionflags=doctest.ELLIPSIS)
+	else:
+		main()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+import doctest
+import tempfile
+import os
+from datetime import datetime
+from StringIO import StringIO
+
+class bulkloader(object):
+	"""
+	Base class for the dialect specific fast paths used by gentable.
+
+	A loader works directly on the DBAPI-connection underlying a sqlalchemy
+	connection, so it takes part in the callers transaction. Rows are the
+	typed tuples produced by csvparse, types is the list of python types
+	that failtype deduced for each column.
+	"""
+	def __init__(self,batch_size=10000):
+		self.batch_size=batch_size
+
+	def prepare(self,dbapi_conn):
+		"""Called before the transaction is started"""
+		pass
+
+	def finish(self,dbapi_conn):
+		"""Called after the transaction has been commited or rolled back"""
+		pass
+
+	def load(self,dbapi_conn,tabname,columns,types,rows):
+		"""
+		tabname: the (already quoted) name of the target table
+		columns: a list of (already quoted) column names
+		returns the number of rows loaded
+		"""
+		raise NotImplementedError()
+
+class sqliteloader(bulkloader):
+	"""
+	Plain sqlite3 executemany, with the journal kept in memory and
+	without waiting for fsync for the duration of the load.
+	"""
+	pragmas=[("journal_mode","MEMORY"),("synchronous","OFF")]
+
+	def prepare(self,dbapi_conn):
+		self._old_pragmas=[]
+		for name,value in self.pragmas:
+			self._old_pragmas.append((name,dbapi_conn.execute("PRAGMA %s"%name).fetchone()[0]))
+			dbapi_conn.execute("PRAGMA %s=%s"%(name,value))
+
+	def finish(self,dbapi_conn):
+		for name,value in self._old_pragmas:
+			dbapi_conn.execute("PRAGMA %s=%s"%(name,value))
+
+	def load(self,dbapi_conn,tabname,columns,types,rows):
+		stmt="INSERT INTO %s (%s) VALUES (%s)"%(tabname,", ".join(columns),", ".join("?" for c in columns))
+		datecols=[n for n,t in enumerate(types) if t==datetime]
+		counter=_counter(rows)
+		if datecols:
+			rows=(_sqlite_dates(r,datecols) for r in counter)
+		else:
+			rows=counter
+		dbapi_conn.cursor().executemany(stmt,rows)
+		return counter.n
+
+class postgresloader(bulkloader):
+	"""
+	COPY ... FROM STDIN in the text format, sent in chunks of batch_size rows
+	"""
+	def load(self,dbapi_conn,tabname,columns,types,rows):
+		stmt="COPY %s (%s) FROM STDIN"%(tabname,", ".join(columns))
+		cursor=dbapi_conn.cursor()
+		n=0
+		for chunk in _tsv_chunks(rows,types,self.batch_size):
+			cursor.copy_expert(stmt,chunk)
+			n+=chunk.rows
+		return n
+
+class mysqlloader(bulkloader):
+	"""
+	LOAD DATA LOCAL INFILE via a temporary tab-separated file, the client
+	connection has to be created with local_infile enabled.
+	"""
+	def load(self,dbapi_conn,tabname,columns,types,rows):
+		tmp=tempfile.NamedTemporaryFile(suffix=".tsv",delete=False)
+		try:
+			n=0
+			for chunk in _tsv_chunks(rows,types,self.batch_size):
+				tmp.write(chunk.getvalue())
+				n+=chunk.rows
+			tmp.close()
+			stmt=("LOAD DATA LOCAL INFILE '%s' INTO TABLE %s CHARACTER SET utf8 "
+				"FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' (%s)")%(
+				tmp.name.replace("\\","\\\\").replace("'","\\'"),tabname,", ".join(columns))
+			dbapi_conn.cursor().execute(stmt)
+		finally:
+			tmp.close()
+			os.remove(tmp.name)
+		return n
+
+loaders={
+	'sqlite':sqliteloader,
+	'postgresql':postgresloader,
+	'mysql':mysqlloader
+}
+
+def get_loader(dialect_name,batch_size=10000):
+	"""
+	Get a bulkloader for the named sqlalchemy dialect, or None if
+	there is no fast path for it and the generic insert should be used.
+	"""
+	loader=loaders.get(dialect_name,None)
+	if loader==None:
+		return None
+	return loader(batch_size=batch_size)
+
+class _counter(object):
+	"""Iterator wrapper keeping track of how many rows has passed"""
+	def __init__(self,rows):
+		self.n=0
+		self._rows=iter(rows)
+	def __iter__(self):
+		return self
+	def next(self):
+		row=self._rows.next()
+		self.n+=1
+		return row
+
+def _sqlite_dates(row,datecols):
+	"""Format datetimes the same way sqlalchemy stores them in sqlite"""
+	row=list(row)
+	for n in datecols:
+		if row[n]!=None:
+			row[n]=row[n].strftime("%Y-%m-%d %H:%M:%S.%f")
+	return row
+
+def _tsv_escape(s):
+	return s.replace("\\","\\\\").replace("\t","\\t").replace("\n","\\n").replace("\r","\\r")
+
+def _tsv_formatters(types):
+	"""one function per column turning a typed cell in to its text representation"""
+	def fmt(t):
+		if t==float:
+			return repr
+		if t==datetime:
+			return lambda d: d.isoformat(" ")
+		if t==unicode:
+			return lambda s: _tsv_escape(s.encode("utf-8"))
+		if t==str:
+			return _tsv_escape
+		return str
+	return [fmt(t) for t in types]
+
+def _tsv_chunks(rows,types,batch_size):
+	"""
+	Serialize rows to the tab-separated text format understood by both
+	COPY and LOAD DATA, yields StringIO's of at most batch_size rows.
+	"""
+	formatters=_tsv_formatters(types)
+	chunk=StringIO()
+	chunk.rows=0
+	for row in rows:
+		chunk.write("\t".join("\\N" if c==None else f(c) for f,c in zip(formatters,row)))
+		chunk.write("\n")
+		chunk.rows+=1
+		if chunk.rows>=batch_size:
+			chunk.seek(0)
+			yield chunk
+			chunk=StringIO()
+			chunk.rows=0
+	if chunk.rows:
+		chunk.seek(0)
+		yield chunk
+
+class _mockconnection(object):
+	"""DBAPI look-alike recording what would have been sent to the database"""
+	def __init__(self):
+		self.sent=[]
+	def cursor(self):
+		return self
+	def execute(self,stmt,params=None):
+		if stmt.startswith("LOAD DATA"):
+			self.sent.append((stmt.split("'")[0],open(stmt.split("'")[1]).read()))
+		else:
+			self.sent.append((stmt,params))
+	def copy_expert(self,stmt,fd):
+		self.sent.append((stmt,fd.read()))
+
+def _test_tsv():
+	"""
+	>>> rows=[(1,1.5,u'a\\tb',datetime(2015,1,2,3,4,5)),(None,2.0,None,None)]
+	>>> chunks=list(_tsv_chunks(rows,[int,float,unicode,datetime],1))
+	>>> len(chunks)
+	2
+	>>> [c.getvalue() for c in chunks]
+	['1\\t1.5\\ta\\\\tb\\t2015-01-02 03:04:05\\n', '\\\\N\\t2.0\\t\\\\N\\t\\\\N\\n']
+	"""
+
+def _test_postgres_mock():
+	"""
+	>>> conn=_mockconnection()
+	>>> rows=[(i,u'\\xe5%i'%i) for i in range(5)]
+	>>> postgresloader(batch_size=3).load(conn,'tab',['a','b'],[int,unicode],rows)
+	5
+	>>> for stmt,data in conn.sent:
+	...	print stmt,repr(data)
+	COPY tab (a, b) FROM STDIN '0\\t\\xc3\\xa50\\n1\\t\\xc3\\xa51\\n2\\t\\xc3\\xa52\\n'
+	COPY tab (a, b) FROM STDIN '3\\t\\xc3\\xa53\\n4\\t\\xc3\\xa54\\n'
+	"""
+
+def _test_mysql_mock():
+	"""
+	>>> conn=_mockconnection()
+	>>> mysqlloader().load(conn,'`tab`',['`a`','`b`'],[int,float],[(1,0.5),(2,None)])
+	2
+	>>> conn.sent
+	[('LOAD DATA LOCAL INFILE ', '1\\t0.5\\n2\\t\\\\N\\n')]
+	"""
+
+def _test_sqlite():
+	"""
+	>>> import sqlite3
+	>>> db=sqlite3.connect(":memory:")
+	>>> _=db.execute("CREATE TABLE tab (a BIGINT, d DATETIME)")
+	>>> l=get_loader('sqlite')
+	>>> l.prepare(db)
+	>>> db.execute("PRAGMA synchronous").fetchone()
+	(0,)
+	>>> l.load(db,'tab',['a','d'],[int,datetime],[(1,datetime(2015,1,2,3,4,5)),(2,None)])
+	2
+	>>> l.finish(db)
+	>>> db.execute("SELECT * FROM tab").fetchall()
+	[(1, u'2015-01-02 03:04:05.000000'), (2, None)]
+	>>> get_loader('firebird') == None
+	True
+	"""
+
+if __name__ == "__main__":
+	import doctest
+	doctest.testmod(optionflags=doctest.ELLIPSIS)
@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+import doctest
+import bisect
+import bz2
+import os
+import zlib
+
+try:
+	import lzma
+except ImportError:
+	try:
+		from backports import lzma
+	except ImportError:
+		lzma=None
+
+_magic={
+	"\x1f\x8b":"gzip",
+	"BZh":"bz2",
+	"\xfd7zXZ\x00":"xz",
+}
+
+def open_fd(fd,span=4*2**20):
+	"""
+	Transparently decompress fd if it is a gzip, bz2 or xz file.
+
+	Seekable gzip files are returned as a gzipfile which can seek in the
+	uncompressed data, other compressed files and all non-seekable streams
+	are returned as read-once streams. Seekable uncompressed files are
+	returned as they are.
+	"""
+	seekable=True
+	try:
+		fd.seek(fd.tell())
+	except (AttributeError,IOError,OSError):
+		seekable=False
+
+	if seekable:
+		start=fd.tell()
+		head=fd.read(6)
+		fd.seek(start)
+		kind=_detect(head)
+		if kind==None:
+			return fd
+		if kind=="gzip":
+			return gzipfile(fd,span=span)
+		return streamreader(fd,_decompressor(kind))
+
+	head=fd.read(6)
+	kind=_detect(head)
+	if kind==None:
+		return streamreader(fd,None,prefix=head)
+	return streamreader(fd,_decompressor(kind),prefix=head)
+
+def compression(fname):
+	"""the compression of the file fname, "gzip", "bz2", "xz" or None"""
+	with open(fname,"rb") as f:
+		return _detect(f.read(6))
+
+def _detect(head):
+	for magic,kind in _magic.items():
+		if head.startswith(magic):
+			return kind
+	return None
+
+def _decompressor(kind):
+	"""a function creating a new decompressor object for one compressed member"""
+	if kind=="gzip":
+		return lambda: zlib.decompressobj(16+zlib.MAX_WBITS)
+	if kind=="bz2":
+		return bz2.BZ2Decompressor
+	if lzma==None:
+		raise IOError("reading xz-files needs the lzma module (pip install backports.lzma)")
+	return lzma.LZMADecompressor
+
+class _reader(object):
+	"""
+	Line reading on top of a _fill() method which returns the next piece
+	of data, or '' at the end.
+	"""
+	blocksize=256*1024
+
+	def read(self,n=-1):
+		while n<0 or len(self._buf)<n:
+			data=self._fill()
+			if data=='':
+				break
+			self._buf+=data
+		if n<0:
+			n=len(self._buf)
+		data=self._buf[:n]
+		self._buf=self._buf[n:]
+		self._pos+=len(data)
+		return data
+
+	def readline(self):
+		start=0
+		nl=self._buf.find("\n")
+		while nl==-1:
+			start=len(self._buf)
+			data=self._fill()
+			if data=='':
+				nl=len(self._buf)-1
+				break
+			self._buf+=data
+			nl=self._buf.find("\n",start)
+		line=self._buf[:nl+1]
+		self._buf=self._buf[nl+1:]
+		self._pos+=len(line)
+		return line
+
+	def __iter__(self):
+		return iter(self.readline,'')
+
+class streamreader(_reader):
+	"""
+	Read-once view of a (possibly compressed) stream, not seekable.
+	"""
+	def __init__(self,fd,decompressor,prefix=''):
+		"""
+		fd: the stream
+		decompressor: a function returning a new decompressor object, or None if the data is not compressed
+		prefix: data allready read from the stream
+		"""
+		self.name=getattr(fd,'name','<stream>')
+		self._fd=fd
+		self._new=decompressor
+		self._d=decompressor() if decompressor else None
+		self._pending=prefix
+		self._buf=''
+		self._pos=0
+
+	def _fill(self):
+		while True:
+			data=self._pending or self._fd.read(self.blocksize)
+			self._pending=''
+			if data=='':
+				return ''
+			if self._d==None:
+				return data
+			out=self._d.decompress(data)
+			while self._d.unused_data: #concatenated members
+				data=self._d.unused_data
+				self._d=self._new()
+				out+=self._d.decompress(data)
+			if out:
+				return out
+
+class _gzindex(object):
+	"""
+	Access points in to a gzip file, one for about every span bytes of
+	uncompressed data. Each point is the uncompressed offset, the compressed
+	offset and a copy of the inflate state at that position.
+	"""
+	def __init__(self,fd,span):
+		self.offsets=[]
+		self.points=[]
+		fd.seek(0)
+		d=zlib.decompressobj(16+zlib.MAX_WBITS)
+		uoff=0
+		coff=0
+		self._add(uoff,coff,d)
+		chunk=max(1024,min(64*1024,span/16))
+		while True:
+			data=fd.read(chunk)
+			if data=='':
+				break
+			coff+=len(data)
+			out=d.decompress(data)
+			while d.unused_data:
+				data=d.unused_data
+				d=zlib.decompressobj(16+zlib.MAX_WBITS)
+				out+=d.decompress(data)
+			uoff+=len(out)
+			if uoff-self.offsets[-1]>=span:
+				self._add(uoff,coff,d)
+		self.size=uoff
+
+	def _add(self,uoff,coff,d):
+		self.offsets.append(uoff)
+		self.points.append((uoff,coff,d.copy()))
+
+	def find(self,pos):
+		"""the last access point at or before pos"""
+		return self.points[bisect.bisect_right(self.offsets,pos)-1]
+
+#Built indexes, keyed on (name,size,mtime,span). Inflate states can not be
+#pickled so they are only kept for the lifetime of the process.
+_indexes={}
+
+def _get_index(fd,span,build=True):
+	"""the index of fd, None if it has not been built yet unless build"""
+	key=None
+	try:
+		st=os.fstat(fd.fileno())
+		key=(os.path.abspath(fd.name),st.st_size,st.st_mtime,span)
+	except (AttributeError,EnvironmentError):
+		pass
+	if key in _indexes:
+		return _indexes[key]
+	if not build:
+		return None
+	index=_gzindex(fd,span)
+	if key!=None:
+		_indexes[key]=index
+	return index
+
+class gzipfile(_reader):
+	"""
+	Seekable, read only view of the uncompressed data in a gzip file.
+
+	The first time access_points() is called (by a sparse probe) or the
+	end is sought to an index of access points is built by inflating the
+	file once, after that seeking only has to inflate from the nearest
+	access point. Until then seeking inflates from the start, so a file
+	that is only read through never gets an index. size is the
+	uncompressed size, None until the index is built.
+	"""
+	def __init__(self,fd,span=4*2**20):
+		self.name=getattr(fd,'name','<gzip>')
+		self._fd=fd
+		self._span=span
+		self.index=_get_index(fd,span,build=False)
+		self.seek(0)
+
+	@property
+	def size(self):
+		return self.index.size if self.index!=None else None
+
+	def _build_index(self):
+		if self.index==None:
+			pos=self.tell()
+			self.index=_get_index(self._fd,self._span)
+			self.seek(pos)
+
+	def access_points(self):
+		"""uncompressed offsets that can be sought to without inflating anything"""
+		self._build_index()
+		return list(self.index.offsets)
+
+	def seek(self,pos,whence=0):
+		if whence==1:
+			pos+=self._pos
+		elif whence==2:
+			self._build_index()
+			pos+=self.size
+		pos=max(pos,0)
+		if self.index!=None:
+			pos=min(pos,self.size)
+			uoff,coff,d=self.index.find(pos)
+		else:
+			uoff,coff,d=0,0,zlib.decompressobj(16+zlib.MAX_WBITS)
+		self._fd.seek(coff)
+		self._d=d.copy()
+		self._buf=''
+		self._pos=uoff
+		while self._pos<pos:
+			if self.read(min(pos-self._pos,self.blocksize))=='':
+				break
+
+	def tell(self):
+		return self._pos
+
+	def _fill(self):
+		while True:
+			data=self._fd.read(self.blocksize)
+			if data=='':
+				return ''
+			out=self._d.decompress(data)
+			while self._d.unused_data:
+				data=self._d.unused_data
+				self._d=zlib.decompressobj(16+zlib.MAX_WBITS)
+				out+=self._d.decompress(data)
+			if out:
+				return out
+
+def _gzip(data,members=1):
+	"""gzip data in to a StringIO, split in several members if asked to"""
+	import gzip
+	from StringIO import StringIO
+	out=StringIO()
+	step=len(data)/members+1
+	for i in range(0,len(data),step):
+		g=gzip.GzipFile(fileobj=out,mode="w")
+		g.write(data[i:i+step])
+		g.close()
+	out.seek(0)
+	return out
+
+def _test_gzipfile():
+	"""
+	>>> data="".join("%i,foo%i\\n"%(i,i) for i in range(100000))
+	>>> f=open_fd(_gzip(data,members=3),span=100000)
+	>>> f.index, f.size
+	(None, None)
+
+	Without an index seeking inflates from the start
+	>>> f.seek(500000)
+	>>> f.read(20)==data[500000:500020], f.tell()
+	(True, 500020)
+	>>> f.seek(10**7)
+	>>> f.tell()==len(data), f.read()
+	(True, '')
+	>>> f.seek(0)
+	>>> "".join(f)==data, f.index
+	(True, None)
+
+	A sparse probe asks for the access points, which builds the index
+	>>> len(f.access_points())>10, f.size==len(data)
+	(True, True)
+	>>> f.seek(0)
+	>>> f.readline()
+	'0,foo0\\n'
+	>>> f.seek(500000)
+	>>> f.read(20)==data[500000:500020], f.tell()
+	(True, 500020)
+	>>> f.seek(-9,2)
+	>>> f.readline()
+	'foo99999\\n'
+	>>> f.readline()
+	''
+	>>> f.seek(0)
+	>>> "".join(f)==data
+	True
+	"""
+
+def _test_streams():
+	"""
+	>>> import subprocess
+	>>> from StringIO import StringIO as sIO
+	>>> data="".join("%i,foo%i\\n"%(i,i) for i in range(1000))
+	>>> p=subprocess.Popen(["gzip","-c"],stdin=subprocess.PIPE,stdout=subprocess.PIPE)
+	>>> f=open_fd(sIO(p.communicate(data)[0]))
+	>>> f.__class__.__name__
+	'gzipfile'
+	>>> f=open_fd(sIO(bz2.compress(data)))
+	>>> f.__class__.__name__, "".join(f)==data
+	('streamreader', True)
+	>>> p=subprocess.Popen(["printf","a,b\\\\n1,2"],stdout=subprocess.PIPE)
+	>>> list(open_fd(p.stdout))
+	['a,b\\n', '1,2']
+	>>> open_fd(sIO(data)).read()==data
+	True
+	>>> import tempfile
+	>>> tmp=tempfile.NamedTemporaryFile()
+	>>> compression(tmp.name)
+	>>> tmp.write(bz2.compress(data)); tmp.flush()
+	>>> compression(tmp.name)
+	'bz2'
+	"""
+
+if __name__ == "__main__":
+	import doctest
+	doctest.testmod(optionflags=doctest.ELLIPSIS)
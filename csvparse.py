@@ -2,17 +2,28 @@
 import doctest
 import fileprober
 import failtype
+import compressed
 import sys
+import os
+import multiprocessing
+import itertools
+import pipeline
+import re
+import tokenizer
+from datetime import datetime
 class csvparse(object):
 	"""
 	Class to parse csv-file in to a series of rows with "correctly" typed cells
 
 	instantiate the class with a filedescriptor of a CSV file and then itterate over it.
 	"""
-	def __init__(self,fd,sep=',',maxrows=1000,verbose=False,continue_on_error=False,log_file=None):
+	def __init__(self,fd,sep=',',maxrows=1000,verbose=False,continue_on_error=False,log_file=None,probe_window=None,schema_cache=None,confirm_rows=100,stats=None,quoting=False,block_size=64*1024,quarantine=None,error_budget=None,sketch=False,probed=None,encoding=None,sample_size=2**20):
 		"""
 		fd: A file descriptor pointing to the CSV-file to be parsed,
-				must be seekable.
+				gzip, bz2 and xz files are decompressed on the fly.
+				If it is not seekable (a pipe or stdin) the types are
+				probed from the first rows only, see fileprober.spooledfile,
+				and the file can only be itterated over once.
 	
 		sep: (default:",") the character used to sepparate columns.
 				Can not be escaped in the document.
@@ -23,55 +34,181 @@ class csvparse(object):
 		verbose (default False): print extra debugging information
 
 		continue_on_error (default False): attempt to ignore errorous lines and just keep reading.
-				If you use this option it is neccesary to allso specify a logfile.
+				If you use this option it is neccesary to allso specify a logfile
+				or a quarantine.
 		
 		log_file: a file-like object to which any error messages supressed
 				via the continue_on_error should be logged.
+
+		quarantine (default None): a quarantine.quarantine that gets the
+				raw lines skipped via continue_on_error together with
+				their line number, byte offset and the reason.
+
+		error_budget (default None): a quarantine.budget, when more lines
+				than it allows have been skipped quarantine.ErrorBudgetExceeded
+				is raised. If budget.probe is set the lines with the wrong
+				number of columns are counted when probing as well.
+
+		probe_window (default None): probe adaptively instead of reading
+				maxrows rows, the head, middle and tail of the file are read
+				until every column has had the same candidate types for
+				probe_window rows. See fileprober.
+
+		schema_cache (default None): a schemacache.schemacache, if it has
+				types for the same headers they are only confirmed on
+				confirm_rows rows instead of probing the file. The (possibly
+				widened) types are written back to the cache, and the entry
+				is dropped if a row later fails to convert.
+
+		confirm_rows (default 100): rows to probe when the types came from schema_cache
+
+		stats (default None): a stats.stats to report probe and decode
+				timings, errors and progress to.
+
+		quoting (default False): fields may be quoted with " as in
+				RFC4180, quoted fields can hold the separator, newlines
+				and "" for a single ". sep must then be a single character.
+
+		block_size (default 64kB): the file is read and split in to rows
+				this many bytes at a time, see tokenizer.blocks
+
+		sketch (default False): keep statistics of the probed values of
+				each column in types[n].sketch, see failtype
+
+		probed (default None): {column name: failtype state} from an
+				earlier probe, such as the merged types of several files
+				from gentable.probe_files. If every column is in it the
+				file is not probed, otherwise the file is probed starting
+				from those states.
+
+		encoding (default None): the encoding of the file, the lines are
+				then decoded a block at a time and strings become unicode.
+				"auto" picks UTF-8, CP1252 or Latin-1 from the first
+				sample_size bytes, see tokenizer.detect_encoding. Files
+				starting with a UTF-8 BOM are always decoded, as UTF-8
+				unless another encoding is given, other files are left
+				undecoded if encoding is None.
 		"""
 		self.types=[]
-		assert hasattr(fd,'seek'), "provided file descriptor must be seekable"
-		assert (continue_on_error and log_file) or (not continue_on_error), "You must specify a log target if continuing on errors"
+		fd=compressed.open_fd(fd)
+		if not fileprober.seekable(fd):
+			fd=fileprober.spooledfile(fd,rows=maxrows or 10000)
+		assert (continue_on_error and (log_file or quarantine)) or (not continue_on_error), "You must specify a log target if continuing on errors"
 		self.fd=fd
 		self.maxrows=maxrows
+		self.probe_window=probe_window
 		self.sep=sep
+		self.quoting=quoting
+		self.block_size=block_size
 		self.verbose=verbose
 		self._continue_on_error=continue_on_error
 		self._log_file=log_file
+		self._quarantine=quarantine
+		self.error_budget=error_budget
+		self.errors=0
+		self._schema_cache=schema_cache
+		self.schema_cached=False
+		self._resume=None
+		self.stats=stats
+		self.offset=0
+		self.rows_read=0
+		self.lines_read=0
+		self.probe_rows=0
+		self.probe_errors=0
 
 		self.utf=False
 		if fd.read(3)=="\xef\xbb\xbf":
 			self.utf=True
-
 		self.fd.seek(3 if self.utf else 0)
+
+		if encoding=="auto":
+			encoding="utf-8" if self.utf else tokenizer.detect_encoding(fd.read(sample_size))
+			self.fd.seek(3 if self.utf else 0)
+			if self.verbose:
+				print "Detected encoding %s"%encoding
+		elif encoding:
+			encoding=tokenizer.check_encoding(encoding)
+		elif self.utf:
+			encoding="utf-8"
+		self.encoding=encoding
+
 		self.headers=[]
-		self.headers=[i.strip() for i in self.splitrow(fd.readline(),nocheck=True) if i.strip()!='']
+		self.headers=[i.strip() for i in self.splitrow(self._decode_line(fd.readline()),nocheck=True) if i.strip()!='']
 		self.fd.seek(3 if self.utf else 0)
 
-		self.types=[failtype.failtype(utf=self.utf) for i in self.headers]
+		self.types=[failtype.failtype(sketch=sketch,decoded=encoding!=None) for i in self.headers]
+		if probed:
+			for name,typer in zip(self.headers,self.types):
+				if name in probed:
+					typer.set_state(probed[name])
+			if all(name in probed for name in self.headers):
+				if self.verbose:
+					print "Using the probed types, not probing"
+				return
+		cached=schema_cache.get(self.headers,sep,self.utf) if schema_cache and not probed else None
+		if cached:
+			for typer,state in zip(self.types,cached):
+				typer.set_state(state)
+			self.schema_cached=True
 		if self.verbose:
-			print "Starting file probe"
-		self.probe(fd)
+			print "Starting file probe"+(" (confirming cached types)" if cached else "")
+		if stats:
+			with stats.stage("probe"):
+				self.probe(fd,maxrows=confirm_rows if cached else None)
+		else:
+			self.probe(fd,maxrows=confirm_rows if cached else None)
+		if schema_cache:
+			schema_cache.put(self.headers,sep,[t.get_state() for t in self.types],self.utf)
+		if error_budget and error_budget.probe:
+			error_budget.check(self.probe_errors,self.probe_rows-self.probe_errors,what="rows probed")
 
-	def probe(self,fd):
+	def probe(self,fd,maxrows=None):
 		"""
 		Probes the document with a series of classifiers.
 		
 		Headers: (default:None) a list of colum-headers to use, if none is provided the first row of the document will be used
+		maxrows: (default:None) rows to sample instead of self.maxrows
 		"""
 
 		def lineparser(line):
-			for typer,col in zip(self.types, self.splitrow(line)):
+			self.probe_rows+=1
+			try:
+				cols=self.splitrow(self._decode_line(line))
+			except ValueError: #UnicodeDecodeError as well
+				self.probe_errors+=1
+				raise
+			for typer,col in zip(self.types,cols):
 				typer(col)
 
-		fileprober.fileprober(self.fd,
+		converged=None
+		if self.probe_window:
+			converged=lambda: all(t.is_stable(self.probe_window) for t in self.types)
+
+		probed=self.fd
+		if isinstance(self.fd,fileprober.spooledfile):
+			probed=self.fd.window #stay within the spool
+
+		fileprober.fileprober(probed,
 				lineparser,
 				skiphead=True,
-				maxrows=self.maxrows,
+				maxrows=maxrows or self.maxrows,
 				ignore_exceptions=True,
-				verbose=self.verbose
+				verbose=self.verbose,
+				converged=converged,
+				window=self.probe_window or 1000
 		)
 
 
+	def _decode_line(self,line):
+		"""
+		Decode a single line (when probing), lines that are plain ASCII
+		are left as they are, their cells then do not have to be encoded
+		again to get their length in bytes.
+		"""
+		if self.encoding and not tokenizer.is_ascii(line):
+			return line.decode(self.encoding)
+		return line
+
 	def splitrow(self,row,nocheck=False):
 		"""Naivly splits a row.
 		
@@ -80,43 +217,539 @@ class csvparse(object):
 			the row "foo\\,bar" will do nothing more than create
 				bar
 		"""
-		row=row.strip()
-		newrow=row.split(self.sep)
+		newrow=tokenizer.split_line(row,self.sep,self.quoting)
 		if (len(newrow) != len(self.headers)) and not nocheck:
 			raise ValueError('The row "%s" has a different number of columns %i than the header %i'%(row,len(newrow), len(self.headers)))
 		return newrow
 
+	def resume(self,offset,rows):
+		"""
+		Make the next iter() start at the byte offset instead of after
+		the header, rows is the number of rows before it. offset and rows
+		are the values of self.offset and self.rows_read at some point
+		during an earlier itteration over the same file.
+		"""
+		assert fileprober.seekable(self.fd) and not isinstance(self.fd,fileprober.spooledfile), "only files can be resumed, not streams"
+		self._resume=(offset,rows)
+
 	def __iter__(self):
-		self.fd.seek(3 if self.utf else 0)
-		self.fd.readline()
+		"""
+		While itterating self.offset is the position in fd right after the
+		last yielded row, self.rows_read the number of rows yielded and
+		self.lines_read the number of lines read, including the bad ones.
+		A quoted value spanning several lines counts as one line.
+		"""
+		self._rewind()
+		rows=self._decode_blocks(tokenizer.blocks(self.fd,self.block_size,self.quoting,self.sep),self)
+		if self.stats:
+			return self.stats.timed_rows(rows,"decode",self.position)
+		return rows
+
+	def iter_pipelined(self,batch_size=1000,queue_size=8):
+		"""
+		Itterate over the typed rows like iter(), but read the file in one
+		thread and decode the lines in another, so that both can go on
+		while the consumer is busy (waiting for the database). The reader
+		passes blocks of lines and the decoder batch_size rows at a time
+		through queues holding at most queue_size of them, see
+		pipeline.threaded. Errors in either
+		thread are raised in the consumer, offset and rows_read follow the
+		rows as they are yielded.
+		"""
+		self._rewind()
+		pos=_position(self.offset,self.rows_read,self.lines_read)
+		lines=pipeline.threaded(tokenizer.blocks(self.fd,self.block_size,self.quoting,self.sep),queue_size,"csvparse-reader")
+		def convert():
+			try:
+				for row in self._decode_blocks(lines,pos):
+					yield row,pos.offset
+			finally:
+				lines.close()
+		batches=pipeline.threaded(pipeline.chunked(convert(),batch_size),queue_size,"csvparse-converter")
 		def rowitterator():
-			failed=False
-			for l in self.fd:
+			try:
+				for batch in batches:
+					for row,offset in batch:
+						self.offset=offset
+						self.rows_read+=1
+						yield row
+			finally:
+				batches.close()
+		if self.stats:
+			return self.stats.timed_rows(rowitterator(),"decode_wait",self.position)
+		return rowitterator()
+
+	def _rewind(self):
+		"""
+		seek to the first row to read and reset offset, rows_read and
+		lines_read. After a resume the bad lines before the resume point
+		are not known, so the line numbers start from the rows read.
+		"""
+		if self._resume:
+			self.offset,self.rows_read=self._resume
+			self.fd.seek(self.offset)
+		else:
+			self.fd.seek(3 if self.utf else 0)
+			self.fd.readline()
+			self.offset,self.rows_read=self.fd.tell(),0
+		self.lines_read=self.rows_read
+		if self.stats:
+			self._size=self.size()
+
+	def _decode_blocks(self,blocks,pos):
+		"""
+		Decode the (lines,sizes) blocks of tokenizer.blocks to rows, errors
+		are logged or raised depending on continue_on_error. pos.offset,
+		pos.rows_read and pos.lines_read are kept up to date.
+
+		Each block is split and converted as a whole, only if that fails
+		the rows are gone through one by one. Lines with the wrong number
+		of columns are counted as mismatches and only get an error message
+		if it is logged or raised.
+		"""
+		convert,convert_all=_compile_converters(self.types)
+		ncols=len(self.headers)
+		encoding=self.encoding
+		failed=False
+		for raw,sizes in blocks:
+			lines,undecoded=tokenizer.decode(raw,encoding) if encoding else (raw,None)
+			unsplit={}
+			fields=tokenizer.split(lines,self.sep,self.quoting,unsplit)
+			if unsplit:
+				undecoded=dict(unsplit.items()+(undecoded or {}).items())
+			bad=[n for n,f in enumerate(fields) if len(f)!=ncols and n not in unsplit]
+			if not bad and not undecoded:
 				try:
-					yield tuple(conv.converter(col) for conv,col in zip(self.types,self.splitrow(l)))
+					rows=convert_all(fields)
+				except Exception:
+					rows=None
+				if rows!=None:
+					if failed!=False and rows:
+						raise failed
+					pos.lines_read+=len(rows)
+					for row,size in itertools.izip(rows,sizes):
+						pos.offset+=size
+						pos.rows_read+=1
+						yield row
+					continue
+			if self.stats and bad:
+				self.stats.count("mismatches",len(bad))
+			bad=set(bad)
+			for n,f in enumerate(fields):
+				offset=pos.offset
+				pos.offset+=sizes[n]
+				pos.lines_read+=1
+				if n in bad:
+					message=_mismatch(raw[n],len(f),ncols)
+					if self._continue_on_error:
+						self.reject("ValueError(%r,)"%message,raw[n],pos.lines_read+1,offset,
+							"%i columns, expected %i"%(len(f),ncols),pos.rows_read)
+					else:
+						failed=ValueError(message) #hope that we are on the last line,delay raising of error
+					continue
+				if undecoded and n in undecoded:
+					e=undecoded[n]
+					if self._continue_on_error:
+						self.reject(repr(e),raw[n],pos.lines_read+1,offset,_reason(e),pos.rows_read)
+					else:
+						failed=e
+					continue
+				try:
+					row=convert(f)
 				except ValueError as e:
+					self._cache_failed()
 					if self._continue_on_error:
-						self._log_file.write(repr(e)+"\n----------\n")
+						self.reject(repr(e),raw[n],pos.lines_read+1,offset,_reason(e),pos.rows_read)
 					else:
 						failed=sys.exc_info()[1] #hope that we are on the last line,delay raising of error
 				except Exception as e:
 					if self._continue_on_error:
-						self._log_file.write(repr(e)+"\n----------\n")
+						self.reject(repr(e),raw[n],pos.lines_read+1,offset,_reason(e),pos.rows_read)
 					else:
 						raise
 				else:
 					if failed!=False:
 						raise failed
-					
-	
+					pos.rows_read+=1
+					yield row
+		if self.error_budget:
+			self.error_budget.check(self.errors,pos.rows_read,final=True)
 
-		return rowitterator()
+	def reject(self,message,line=None,lineno=None,offset=None,reason=None,rows=None,counter="errors"):
+		"""
+		Skip a bad line (or row): message goes to the log file and line to
+		the quarantine with lineno, offset and reason (default message).
+		If there is an error budget it is checked against rows good rows
+		(default rows_read), raising quarantine.ErrorBudgetExceeded if the
+		bad ones are too many. counter is the stats counter to increase.
+		"""
+		if self._log_file:
+			self._log_file.write(message+"\n----------\n")
+		if self._quarantine:
+			self._quarantine.reject(line,lineno,offset,reason or message)
+		if self.stats:
+			self.stats.count(counter)
+		self.errors+=1
+		if self.error_budget:
+			self.error_budget.check(self.errors,self.rows_read if rows==None else rows)
+
+	def size(self):
+		"""the size of the (uncompressed) file, or None if it is not known"""
+		if hasattr(self.fd,'size'):
+			return self.fd.size
+		try:
+			return os.fstat(self.fd.fileno()).st_size
+		except (AttributeError,EnvironmentError):
+			return None
+
+	def position(self):
+		"""(rows read, bytes read, file size) while itterating"""
+		return self.rows_read,self.offset,self._size
+
+	def _cache_failed(self):
+		"""
+		Drop the cached schema when a row with the right number of columns
+		failed to convert, the cached types where too narrow for this file.
+		"""
+		if self.schema_cached:
+			self._schema_cache.invalidate(self.headers,self.sep,self.utf)
+			self.schema_cached=False
+
+	def compile_decoder(self):
+		"""
+		Freeze the current column types in to a single function taking a raw
+		line and returning the typed tuple, splitting, null-checks, converters
+		and the column count check are generated as one piece of python code.
+		Should be called after the typers are done, iter() does it for you.
+		"""
+		return _compile_decoder(self.types,self.sep,self.quoting)
+
+	def iter_parallel(self,jobs=None,ordered=True,chunk_size=8*2**20):
+		"""
+		Itterate over the typed rows like iter(), but let a pool of worker
+		processes parse and convert the file in chunks of about chunk_size
+		bytes split on line boundaries. Only works on real files, and any
+		extra_converters of the typers must be picklable.
+
+		jobs (default None): the number of worker processes, defaults to the number of cpus
+		ordered (default True): yield the rows in the same order as in the file,
+				if False chunks are yielded as soon as any worker is done with them.
+		"""
+		assert hasattr(self.fd,'fileno') and hasattr(self.fd,'name'), "parallel parsing needs a real file"
+		assert not self.quoting, "quoted fields can span lines, they can not be parsed in parallel"
+		self.fd.seek(3 if self.utf else 0)
+		self.fd.readline()
+		start=self.fd.tell()
+		size=os.fstat(self.fd.fileno()).st_size
+		work=[(n,self.fd.name,s,min(s+chunk_size,size),self.sep,self.types,self._continue_on_error,self.encoding)
+			for n,s in enumerate(range(start,size,chunk_size))]
+
+		ends=dict((w[0],w[3]) for w in work)
+		self.offset,self.rows_read,self._size=start,0,size
+		rows=self._iter_parallel(jobs,ordered,work,ends)
+		if self.stats:
+			return self.stats.timed_rows(rows,"decode",self.position)
+		return rows
+
+	def _iter_parallel(self,jobs,ordered,work,ends):
+		pool=multiprocessing.Pool(jobs)
+		try:
+			if ordered:
+				results=pool.imap(_parse_range,work)
+			else:
+				results=pool.imap_unordered(_parse_range,work)
+			pending={}
+			last_with_rows=-1
+			for n,rows,errors,failed in results:
+				for offset,line,message,reason in errors:
+					self.reject(message,line,None,offset,reason,self.rows_read+len(rows))
+				if failed!=None:
+					pending[n]=failed
+				if rows:
+					last_with_rows=max(n,last_with_rows)
+				#same as iter(), only raise on errors that are not on the last lines
+				if pending and min(pending)<last_with_rows:
+					raise ValueError(pending[min(pending)])
+				self.offset=max(self.offset,ends[n])
+				for r in rows:
+					self.rows_read+=1
+					yield r
+			if self.error_budget:
+				self.error_budget.check(self.errors,self.rows_read,final=True)
+		finally:
+			pool.terminate()
+
+	def iter_batches(self,n=10000):
+		"""
+		Itterate over the file in batches of up to n rows, each batch is a
+		list with one numpy.ma.MaskedArray per column where NULL's are masked.
+		ints, floats and dates are converted for the whole column at once to
+		int64, float64 and datetime64[us] arrays, strings end up in object arrays.
+		Requires numpy.
+		"""
+		import numpy
+		assert not self.quoting, "iter_batches does not support quoting"
+		decode=self.compile_decoder()
+		ncols=len(self.types)
+		self.fd.seek(3 if self.utf else 0)
+		self.fd.readline()
+		failed=False
+		batch=[]
+		offset=self.fd.tell()
+		lineno=1
+		self.rows_read=0
+		for raw in self.fd:
+			offset+=len(raw)
+			lineno+=1
+			try:
+				l=raw.decode(self.encoding) if self.encoding else raw
+			except UnicodeDecodeError as e:
+				if self._continue_on_error:
+					self.reject(repr(e),raw.rstrip("\n"),lineno,offset-len(raw),_reason(e))
+				else:
+					failed=e
+				continue
+			row=l.strip().split(self.sep)
+			if len(row)!=ncols:
+				try:
+					decode(l) #for the error message
+				except ValueError as e:
+					if self._continue_on_error:
+						self.reject(repr(e),raw.rstrip("\n"),lineno,offset-len(raw),"%i columns, expected %i"%(len(row),ncols))
+					else:
+						failed=sys.exc_info()[1] #hope that we are on the last line,delay raising of error
+				continue
+			if failed!=False:
+				raise failed
+			batch.append(row)
+			if len(batch)>=n:
+				yield self._to_columns(numpy,batch,decode)
+				batch=[]
+		if batch:
+			yield self._to_columns(numpy,batch,decode)
+		if self.error_budget:
+			self.error_budget.check(self.errors,self.rows_read,final=True)
+
+	def _to_columns(self,numpy,batch,decode):
+		"""
+		Convert a list of splitted rows to masked column arrays, if any of
+		the vectorized conversions fail the rows are checked one by one and
+		the bad ones are logged (or raised) and dropped.
+		"""
+		try:
+			columns=[_to_column(numpy,t,col,self.sep) for t,col in zip(self.types,zip(*batch))]
+			self.rows_read+=len(batch)
+			return columns
+		except ValueError:
+			pass
+		good=[]
+		for row in batch:
+			try:
+				decode(self.sep.join(row))
+			except Exception as e:
+				if self._continue_on_error:
+					line=self.sep.join(row)
+					self.reject(repr(e),line.encode(self.encoding) if self.encoding else line,reason=_reason(e))
+				else:
+					raise
+			else:
+				good.append(row)
+		self.rows_read+=len(good)
+		if not good:
+			return [numpy.ma.array([],dtype=object) for t in self.types]
+		#converting cell by cell with the same converters as decode can not fail
+		return [_to_column(numpy,t,col,self.sep,vectorize=False) for t,col in zip(self.types,zip(*good))]
 
 	def __str__(self):
 		return "csvparser:\n"+"\n".join(
 			"  %s: %s"%(h,t.get_best_type()[0]) for h,t in zip(self.headers,self.types)
 		)
 
+class _position(object):
+	"""offset and rows_read of a decoding thread, see csvparse.iter_pipelined"""
+	def __init__(self,offset,rows_read,lines_read):
+		self.offset=offset
+		self.rows_read=rows_read
+		self.lines_read=lines_read
+
+def _mismatch(line,n,ncols):
+	"""the error message for a line with n columns instead of ncols"""
+	return 'The row "%s" has a different number of columns %i than the header %i'%(line.strip(),n,ncols)
+
+def _reason(e):
+	"""the reason a line was skipped, for the quarantine"""
+	return "%s: %s"%(e.__class__.__name__,e)
+
+def _cells(types,namespace):
+	"""
+	The names and the converting expressions of the cells of a row for
+	the generated code of _compile_decoder and _compile_converters, the
+	converters are added to namespace.
+	"""
+	names=[]
+	cells=[]
+	for n,t in enumerate(types):
+		base=t.get_base_type().converter
+		c="c%i"%n
+		names.append(c)
+		if base==str or base==unicode:
+			cell=c
+		else:
+			namespace["conv%i"%n]=base
+			cell="conv%i(%s)"%(n,c)
+		if t.sanitize:
+			cell="None if %s=='' or %s.lower()=='null' else %s"%(c,c,cell)
+		cells.append(cell)
+	return names,cells
+
+def _compile_decoder(types,sep,quoting=False):
+	"""
+	Generates the decoder used by csvparse.compile_decoder, for a float and
+	a string column the generated code looks like:
+
+	def decode(line):
+		row=line.strip().split(sep)
+		if len(row)!=2:
+			raise ValueError(...)
+		c0,c1=row
+		return (None if c0=='' or c0.lower()=='null' else conv0(c0), c1)
+
+	with quoting the line is split with tokenizer.split_line instead.
+	"""
+	namespace={'sep':sep,'ValueError':ValueError,'mismatch':_mismatch,'split_line':tokenizer.split_line}
+	names,cells=_cells(types,namespace)
+	if quoting:
+		split="split_line(line,sep,True)"
+	else:
+		split="line.strip().split(sep)"
+	source="\n".join([
+		"def decode(line):",
+		"	row=%s"%split,
+		"	if len(row)!=%i:"%len(types),
+		"		raise ValueError(mismatch(line,len(row),%i))"%len(types),
+		"	%s,=row"%",".join(names),
+		"	return (%s,)"%", ".join(cells),
+	])
+	exec compile(source,"<csvparse decoder>","exec") in namespace
+	return namespace["decode"]
+
+def _compile_converters(types):
+	"""
+	Generates the converters used by csvparse._decode_blocks, convert(fields)
+	converts the fields of one row and convert_all(rows) a whole list of
+	them with a single list comprehension:
+
+	def convert_all(rows):
+		return [(None if c0=='' or c0.lower()=='null' else conv0(c0), c1) for c0,c1 in rows]
+
+	Neither of them checks the number of fields.
+	"""
+	namespace={}
+	names,cells=_cells(types,namespace)
+	source="\n".join([
+		"def convert(fields):",
+		"	%s,=fields"%",".join(names),
+		"	return (%s,)"%", ".join(cells),
+		"def convert_all(rows):",
+		"	return [(%s,) for %s, in rows]"%(", ".join(cells),",".join(names)),
+	])
+	exec compile(source,"<csvparse converters>","exec") in namespace
+	return namespace["convert"],namespace["convert_all"]
+
+_numpy_types={int:'int64',float:'float64',datetime:'datetime64[us]'}
+_numpy_fill={int:0,float:0.0,datetime:datetime(2000,1,1)}
+#numpy parses many more date layouts than the failtype converters, only these are left to it
+_strict_dates={
+	failtype._gendate:re.compile(r"\d{4}-\d\d-\d\d \d\d:\d\d:\d\d\Z"),
+	failtype._gendate2:re.compile(r"\d{4}-\d\d-\d\d \d\d:\d\d:\d\d\.\d{1,6}\Z"),
+}
+
+def _to_column(numpy,typer,col,sep,vectorize=True):
+	"""
+	Vectorized version of the typers converter for a tuple of strings,
+	raises ValueError if any of the cells does not convert.
+
+	vectorize (default True): if False, or if a date column has dates in
+		another layout than the converter would read, the cells are
+		converted one by one with the typers converter instead, so that
+		exactly the same values are accepted as when decoding a row.
+	"""
+	base=typer.get_base_type()
+	raw=numpy.array(col)
+	if typer.sanitize:
+		mask=(raw=='')|(numpy.char.lower(raw)=='null')
+	else:
+		mask=numpy.zeros(len(col),dtype=bool)
+	numeric=base.type in _numpy_types and base.converter in (int,float,failtype._gendate,failtype._gendate2)
+	if numeric and vectorize and base.type==datetime:
+		strict=_strict_dates[base.converter]
+		vectorize=all(strict.match(c) for c,m in zip(col,mask) if not m)
+	if numeric and not vectorize:
+		fill=_numpy_fill[base.type]
+		data=numpy.array([fill if m else base.converter(c) for m,c in zip(mask,col)],dtype=_numpy_types[base.type])
+	elif numeric:
+		if mask.any():
+			raw[mask]='0' if base.type!=datetime else '2000-01-01'
+		if base.type!=datetime and not sep.isspace() and (base.type==float or raw.dtype.itemsize<19):
+			#numpys own text parser, it stops at the first bad value so a short result means failure.
+			#The csv-separator can not be part of any cell, and ints are short enough not to overflow
+			data=numpy.fromstring(sep.join(raw),dtype=_numpy_types[base.type],sep=sep)
+			if len(data)!=len(raw):
+				raise ValueError("column does not convert to %s"%_numpy_types[base.type])
+		else:
+			try:
+				data=raw.astype(_numpy_types[base.type])
+			except (TypeError,OverflowError) as e:
+				raise ValueError(str(e))
+		if base.type==datetime:
+			data[data<numpy.datetime64('1999-01-01')]=numpy.datetime64(failtype._date_sentinel)
+	elif base.converter==str or base.converter==unicode:
+		data=numpy.array(col,dtype=object)
+	elif base.converter==failtype._decode_utf8 and vectorize:
+		data=numpy.char.decode(raw,'utf-8').astype(object)
+	else:
+		data=numpy.array([None if m else base.converter(c) for m,c in zip(mask,col)],dtype=object)
+	return numpy.ma.array(data,mask=mask)
+
+def _parse_range(work):
+	"""
+	Worker for csvparse.iter_parallel, parses the lines starting within
+	[start,end) of the file.
+	returns (chunk number, rows, errors, delayed error or None) where errors
+	are (offset, line, message, reason) of the skipped lines
+	"""
+	n,fname,start,end,sep,types,continue_on_error,encoding=work
+	decode=_compile_decoder(types,sep)
+	rows=[]
+	errors=[]
+	failed=None
+	fd=open(fname,'r')
+	try:
+		fd.seek(start-1)
+		pos=start-1+len(fd.readline()) #align to the first line starting at or after start
+		while pos<end:
+			l=fd.readline()
+			if l=='':
+				break
+			pos+=len(l)
+			try:
+				rows.append(decode(l.decode(encoding) if encoding else l))
+			except Exception as e:
+				if continue_on_error:
+					fields=len(l.strip().split(sep))
+					reason=_reason(e) if fields==len(types) or isinstance(e,UnicodeDecodeError) else "%i columns, expected %i"%(fields,len(types))
+					errors.append((pos-len(l),l.rstrip("\n"),repr(e),reason))
+				elif isinstance(e,ValueError):
+					failed=str(e) #hope that we are on the last line,delay raising of error
+				else:
+					raise
+			else:
+				if failed!=None:
+					raise ValueError(failed)
+	finally:
+		fd.close()
+	return n,rows,errors,failed
+
 def _test_rowsplit():
 	"""
    >>> from StringIO import StringIO as sIO
@@ -190,6 +823,334 @@ def test_continuation():
 	>>> len([i for i in log.readlines() if "different number" in i ])
 	29
 	"""
+def _test_adaptive_probe():
+	"""
+	>>> testfile="/tmp/csvparse_adaptivetest"
+	>>> f=open(testfile,"w")
+	>>> f.write("isint,isfloat,isstr"+chr(10)+chr(10).join("%i,%i,%s"%(i,i,"x"*(i%10)) for i in range(20000)))
+	>>> f.write(chr(10)+"1,1.5,foobarfoobar"+chr(10))
+	>>> f.close()
+	>>> t=csvparse(open(testfile),probe_window=100)
+	>>> [i.type for i in t.types], t.types[2].extras["strsize"]
+	([<type 'int'>, <type 'float'>, <type 'str'>], 12)
+	>>> t.types[0]._observed<1000
+	True
+	>>> os.remove(testfile)
+	"""
+
+def _test_schema_cache():
+	"""
+	>>> import shutil, tempfile, schemacache
+	>>> from StringIO import StringIO as sIO
+	>>> cache=schemacache.schemacache(tempfile.mkdtemp())
+	>>> data="a,b,c"+chr(10)+"1,1.5,x"+chr(10)+chr(10).join("%i,%i,x%i"%(i,i,i) for i in range(1000))
+	>>> t=csvparse(sIO(data),schema_cache=cache)
+	>>> t.schema_cached, [i.type for i in t.types]
+	(False, [<type 'int'>, <type 'float'>, <type 'str'>])
+
+	The second time only the first rows are probed, but the types are kept
+	>>> t=csvparse(sIO("a,b,c"+chr(10)+"1,2,xyz"+chr(10)),schema_cache=cache)
+	>>> t.schema_cached, [i.type for i in t.types], t.types[2].extras["strsize"]
+	(True, [<type 'int'>, <type 'float'>, <type 'str'>], 4)
+
+	A conversion failure after the confirmed rows drops the entry, a bad line does not
+	>>> t=csvparse(sIO("a,b,c"+chr(10)+chr(10).join(["1,2,x","bad","x,2,x","1,2,x"])+chr(10)),schema_cache=cache,confirm_rows=2,continue_on_error=True,log_file=sIO())
+	>>> len(list(t)), t.schema_cached
+	(2, False)
+	>>> cache.get(["a","b","c"],",") == None
+	True
+	>>> shutil.rmtree(cache.path)
+	"""
+
+def _test_resume():
+	"""
+	>>> from StringIO import StringIO as sIO
+	>>> t=csvparse(sIO("a,b"+chr(10)+chr(10).join("%i,x%i"%(i,i) for i in range(10))))
+	>>> rows=iter(t)
+	>>> [rows.next() for i in range(4)][-1], t.offset, t.rows_read
+	((3, 'x3'), 24, 4)
+	>>> t.resume(t.offset,t.rows_read)
+	>>> rest=list(t)
+	>>> rest[0], len(rest), t.rows_read
+	((4, 'x4'), 6, 10)
+	"""
+
+def _test_pipelined():
+	"""
+	>>> from StringIO import StringIO as sIO
+	>>> data="a,b"+chr(10)+chr(10).join("%i,x%i"%(i,i) for i in range(1000))
+	>>> t=csvparse(sIO(data))
+	>>> list(t.iter_pipelined(batch_size=7,queue_size=2))==list(t), t.rows_read, t.offset==len(data)
+	(True, 1000, True)
+	>>> rows=t.iter_pipelined(batch_size=7)
+	>>> [rows.next() for i in range(10)][-1], t.offset, t.rows_read
+	((9, 'x9'), 54, 10)
+	>>> rows.close()
+	>>> t=csvparse(sIO(data+chr(10)+"1,x,y"+chr(10)+"1,x"))
+	>>> len(list(t.iter_pipelined()))
+	Traceback (most recent call last):
+	...
+	ValueError: The row "1,x,y" has a different number of columns 3 than the header 2
+	"""
+
+def _test_blocks():
+	"""
+	>>> from StringIO import StringIO as sIO
+	>>> import stats
+	>>> lines=["%i,x%i"%(i,i) for i in range(100)]
+	>>> data="a,b"+chr(10)+chr(10).join(lines[:50]+["x,1"]+lines[50:]+["bad","1,2,3","7,x"])
+	>>> log=sIO()
+	>>> s=stats.stats()
+	>>> t=csvparse(sIO(data),maxrows=20,continue_on_error=True,log_file=log,block_size=64,stats=s)
+	>>> rows=list(t)
+	>>> len(rows), rows[-1], t.offset==len(data), t.rows_read
+	(101, (7, 'x'), True, 101)
+	>>> print log.getvalue()
+	ValueError("invalid literal for int() with base 10: 'x'",)
+	----------
+	ValueError('The row "bad" has a different number of columns 1 than the header 2',)
+	----------
+	ValueError('The row "1,2,3" has a different number of columns 3 than the header 2',)
+	----------
+	<BLANKLINE>
+	>>> s.counters["mismatches"], s.counters["errors"]
+	(2, 3)
+
+	Without continue_on_error only bad lines at the very end are accepted
+	>>> list(csvparse(sIO(data),maxrows=20,block_size=64))
+	Traceback (most recent call last):
+	...
+	ValueError: invalid literal for int() with base 10: 'x'
+	>>> len(list(csvparse(sIO("a,b"+chr(10)+chr(10).join(lines+["bad","1,2,3",""])),block_size=64)))
+	100
+	"""
+
+def _test_quoting():
+	'''
+	>>> from StringIO import StringIO as sIO
+	>>> data='"id","text"'+chr(10)+'1,"a, b"'+chr(10)+'2,"say ""hi"""'+chr(10)+'3,"two'+chr(10)+'lines"'+chr(10)+'4,plain'+chr(10)
+	>>> t=csvparse(sIO(data),quoting=True)
+	>>> t.headers, [i.type for i in t.types]
+	(['id', 'text'], [<type 'int'>, <type 'str'>])
+	>>> list(t)
+	[(1, 'a, b'), (2, 'say "hi"'), (3, 'two\\nlines'), (4, 'plain')]
+	>>> t.compile_decoder()('5,"x,y"')
+	(5, 'x,y')
+
+	A quote inside an unquoted value does not start a quoted field, and a
+	line the csv module can not split is a bad line like any other
+	>>> log=sIO()
+	>>> data='id,text'+chr(10)+'1,12" pipe'+chr(10)+'2,x'+chr(13)+'y'+chr(10)+'3,"a""b"'+chr(10)
+	>>> t=csvparse(sIO(data+"".join("%i,z%s"%(i,chr(10)) for i in range(4,1000))),quoting=True,maxrows=10,continue_on_error=True,log_file=log,block_size=64)
+	>>> rows=list(t)
+	>>> rows[:3], len(rows), t.errors, t.offset==len(data)+sum(len("%i,z "%i) for i in range(4,1000))
+	([(1, '12" pipe'), (3, 'a"b'), (4, 'z')], 998, 1, True)
+	>>> print log.getvalue()
+	ValueError("the row '2,x\\\\ry' can not be split: new-line character seen in unquoted field...
+	'''
+
+def _test_quarantine():
+	"""
+	>>> from StringIO import StringIO as sIO
+	>>> import quarantine
+	>>> lines=["%i,x"%i for i in range(200)]
+	>>> lines[3]="3,x,extra"
+	>>> lines[150]="y,x"
+	>>> data="a,b"+chr(10)+chr(10).join(lines)+chr(10)
+	>>> out=sIO()
+	>>> q=quarantine.quarantine(out)
+	>>> t=csvparse(sIO(data),maxrows=10,continue_on_error=True,quarantine=q,block_size=256)
+	>>> len(list(t)), t.errors, t.lines_read
+	(198, 2, 200)
+	>>> q.flush()
+	>>> print out.getvalue()
+	line,offset,reason,raw
+	5,16,"3 columns, expected 2","3,x,extra"
+	152,...,ValueError: invalid literal for int() with base 10: 'y',"y,x"
+	<BLANKLINE>
+	>>> data[16:25]
+	'3,x,extra'
+
+	With an error budget the load is given up on once it is exceeded
+	>>> t=csvparse(sIO(data),maxrows=10,continue_on_error=True,quarantine=q,error_budget=quarantine.budget(max_errors=1))
+	>>> len(list(t))
+	Traceback (most recent call last):
+	...
+	ErrorBudgetExceeded: 2 of 151 rows were bad, the error budget is 1
+	>>> t=csvparse(sIO(data),maxrows=10,continue_on_error=True,quarantine=q,error_budget=quarantine.parse_budget("2%"))
+	>>> len(list(t))
+	198
+
+	or already when probing the file
+	>>> data="a,b"+chr(10)+chr(10).join("%i;x"%i if i%3 else "%i,x"%i for i in range(300))
+	>>> t=csvparse(sIO(data),continue_on_error=True,quarantine=q,error_budget=quarantine.parse_budget("10%",probe=True))
+	Traceback (most recent call last):
+	...
+	ErrorBudgetExceeded: 200 of 300 rows probed were bad, the error budget is 10%
+	"""
+
+def _test_encoding():
+	'''
+	>>> from StringIO import StringIO as sIO
+	>>> import quarantine
+	>>> text=u"id,name"+chr(10)+chr(10).join(u"%i,caf\\xe9 \\u20ac%i"%(i,i) for i in range(300))+chr(10)
+	>>> t=csvparse(sIO(text.encode("cp1252")),encoding="auto",block_size=256)
+	>>> t.encoding, t.types[1].type, t.types[1].extras["strsize"]
+	('cp1252', <type 'unicode'>, 12)
+	>>> rows=list(t)
+	>>> rows[5], t.offset==len(text.encode("cp1252"))
+	((5, u'caf\\xe9 \\u20ac5'), True)
+
+	The same file read as Latin-1 has another character in place of the euro sign
+	>>> list(csvparse(sIO(text.encode("cp1252")),encoding="latin-1"))[5]
+	(5, u'caf\\xe9 \\x805')
+
+	A UTF-8 file with a Latin-1 line, the line goes to the quarantine as it was
+	>>> data=text.encode("utf-8").replace(chr(10)+"7,caf\\xc3\\xa9",chr(10)+"7,caf\\xe9")
+	>>> out=sIO()
+	>>> q=quarantine.quarantine(out,header=False)
+	>>> t=csvparse(sIO(data),encoding="utf-8",continue_on_error=True,quarantine=q,block_size=256)
+	>>> len(list(t)), q.flush(), out.getvalue()
+	(299, None, '9,99,UnicodeDecodeError: ... invalid continuation byte,"7,caf\\xe9 \\xe2\\x82\\xac7"\\n')
+	>>> t=csvparse(sIO(data),encoding="utf-8")
+	>>> len(list(t))
+	Traceback (most recent call last):
+	...
+	UnicodeDecodeError: 'utf8' codec can't decode byte 0xe9 in position 5: invalid continuation byte
+
+	Without an encoding only files with a BOM are decoded
+	>>> list(csvparse(sIO(text.encode("utf-8"))))[1]
+	(1, 'caf\\xc3\\xa9 \\xe2\\x82\\xac1')
+	>>> t=csvparse(sIO("\\xef\\xbb\\xbf"+text.encode("utf-8")))
+	>>> t.encoding, t.headers, list(t)[1]
+	('utf-8', ['id', 'name'], (1, u'caf\\xe9 \\u20ac1'))
+	'''
+
+def _test_stream():
+	"""
+	>>> import subprocess
+	>>> testfile="/tmp/csvparse_streamtest"
+	>>> f=open(testfile,"w")
+	>>> f.write("isint,isstr"+chr(10)+chr(10).join("%i,foo%i"%(i,i) for i in range(5000)))
+	>>> f.close()
+	>>> p=subprocess.Popen(["cat",testfile],stdout=subprocess.PIPE)
+	>>> t=csvparse(p.stdout,maxrows=100)
+	>>> [i.type for i in t.types], t.types[1].extras["strsize"]
+	([<type 'int'>, <type 'str'>], 5)
+	>>> rows=list(t)
+	>>> len(rows), rows[0], rows[-1]
+	(5000, (0, 'foo0'), (4999, 'foo4999'))
+	>>> os.remove(testfile)
+	"""
+
+def _test_decoder():
+	"""
+	>>> from StringIO import StringIO as sIO
+	>>> t=csvparse(sIO("isint,isstr,isdate"+chr(10)+"1,foo,2015-01-01 10:10:10"+chr(10)))
+	>>> decode=t.compile_decoder()
+	>>> decode("2,bar,NULL"+chr(10))
+	(2, 'bar', None)
+	>>> decode(",,2015-01-02 10:10:10")
+	(None, None, datetime.datetime(2015, 1, 2, 10, 10, 10))
+	>>> decode("2,bar")
+	Traceback (most recent call last):
+	...
+	ValueError: The row "2,bar" has a different number of columns 2 than the header 3
+	"""
+
+def _test_batches():
+	"""
+	>>> from StringIO import StringIO as sIO
+	>>> heads="isint,isfloat,isstr,isdate"
+	>>> lines=["%i,%i.%i,foo%i,2015-01-%02i 10:10:10"%(i,i,i,i,i+1) for i in range(25)]+["NULL,,,1915-01-01 10:10:10"]
+	>>> t=csvparse(sIO(heads+chr(10)+chr(10).join(lines)))
+	>>> batches=list(t.iter_batches(10))
+	>>> [len(b[0]) for b in batches]
+	[10, 10, 6]
+	>>> [c.dtype for c in batches[0]]
+	[dtype('int64'), dtype('float64'), dtype('O'), dtype('<M8[us]')]
+	>>> ints,floats,strs,dates=batches[-1]
+	>>> ints
+	masked_array(data=[20, 21, 22, 23, 24, --],
+	             mask=[False, False, False, False, False,  True],
+	       fill_value=999999)
+	>>> strs.mask.tolist(), floats.sum()
+	([False, False, False, False, False, True], 111.1)
+	>>> dates[-1]==dates.dtype.type(failtype._gendate("1915-01-01 10:10:10"))
+	True
+	"""
+
+def _test_batches_errors():
+	"""
+	>>> from StringIO import StringIO as sIO
+	>>> lines=[str(i)+","+str(i) for i in range(10)]
+	>>> lines[3]="3,oops"
+	>>> lines[5]="5,5,5"
+	>>> log=sIO()
+	>>> t=csvparse(sIO("colA,colB"+chr(10)+chr(10).join(lines)),maxrows=3,continue_on_error=True,log_file=log)
+	>>> [list(c) for c in next(t.iter_batches())]
+	[[0, 1, 2, 4, 6, 7, 8, 9], [0, 1, 2, 4, 6, 7, 8, 9]]
+	>>> len(log.getvalue().split("----------"))
+	3
+	"""
+
+def _test_batches_dates():
+	"""
+	iter_batches takes the same dates as iter(), even if numpy reads more
+	>>> from StringIO import StringIO as sIO
+	>>> lines=["%i,2015-01-%02i 10:10:10"%(i,i+1) for i in range(10)]
+	>>> lines[2]="2,2015-1-5 3:4:5"
+	>>> data="n,d"+chr(10)+chr(10).join(lines)
+	>>> t=csvparse(sIO(data),maxrows=3)
+	>>> rows=list(t)
+	>>> [[d.astype(datetime) for d in c] for c in next(t.iter_batches())][1]==[r[1] for r in rows]
+	True
+	>>> for n,bad in [(4,"2015-01-01"),(5,"NaT"),(6,"2015-01-01T10:10")]:
+	...	lines[n]="%i,%s"%(n,bad)
+	>>> data="n,d"+chr(10)+chr(10).join(lines)
+	>>> t=csvparse(sIO(data),maxrows=3,continue_on_error=True,log_file=sIO())
+	>>> [r[0] for r in t]
+	[0, 1, 2, 3, 7, 8, 9]
+	>>> list(next(t.iter_batches())[0]), t.errors
+	([0, 1, 2, 3, 7, 8, 9], 6)
+	"""
+
+def _test_parallel():
+	"""
+	>>> testfile="/tmp/csvparse_paralleltest"
+	>>> f=open(testfile,"w")
+	>>> f.write("isint,isfloat,isdate"+chr(10)+chr(10).join("%i,%i.%i,2015-01-%02i 10:10:10"%(i,i,i,i%28+1) for i in range(5000)))
+	>>> f.close()
+	>>> t=csvparse(open(testfile))
+	>>> rows=list(t)
+	>>> list(t.iter_parallel(jobs=3,chunk_size=1000))==rows
+	True
+	>>> sorted(t.iter_parallel(jobs=3,ordered=False,chunk_size=1000))==rows
+	True
+	>>> os.remove(testfile)
+	"""
+
+def _test_parallel_errors():
+	"""
+	>>> from StringIO import StringIO as sIO
+	>>> testfile="/tmp/csvparse_paralleltest"
+	>>> f=open(testfile,"w")
+	>>> f.write("colA,colB"+chr(10)+chr(10).join(str(i)+","+str(i) for i in range(1000))+chr(10)+"1,2,3"+chr(10)+"1,2"+chr(10)*3)
+	>>> f.close()
+	>>> log=sIO()
+	>>> t=csvparse(open(testfile),continue_on_error=True,log_file=log)
+	>>> len(list(t.iter_parallel(jobs=2,chunk_size=500)))
+	1001
+	>>> len([i for i in log.getvalue().split(chr(10)) if "different number" in i])
+	3
+	>>> t=csvparse(open(testfile))
+	>>> _=list(t.iter_parallel(jobs=2,chunk_size=500))
+	Traceback (most recent call last):
+	...
+	ValueError: The row "1,2,3" has a different number of columns 3 than the header 2
+	>>> os.remove(testfile)
+	"""
+
 def _test_col_nummer_fail():
    """
    >>> from StringIO import StringIO as sIO
@@ -0,0 +1,363 @@
+#!/usr/bin/env python
+import doctest
+import cPickle
+import hashlib
+import heapq
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+
+_magic="CSVHIDX1"
+_header=struct.Struct("<8sQQ") #magic, records, directory bits
+_record_size=12 #8 bytes key hash, 4 bytes row hash
+_no_row="\0\0\0\0"
+
+def _text(values):
+	"""
+	values as text, so that a column getting another type from one load
+	to the next (1.5, Decimal("1.5") or u"1.5") hashes the same
+	"""
+	return "\x1f".join("\0" if v==None else v if isinstance(v,str) else unicode(v).encode('utf-8') for v in values)
+
+def key_hash(values):
+	"""the 8 byte hash of a key (or a whole row), sorts like a big endian number"""
+	return hashlib.md5(_text(values)).digest()[:8]
+
+def row_hash(row):
+	"""the 4 byte hash of a row, telling if the row of a key has changed"""
+	return struct.pack(">I",zlib.crc32(_text(row))&0xffffffff)
+
+def snapshot_path(directory,table,source):
+	"""
+	The path prefix of the snapshot of loading the file source in to
+	table, kept in directory. Several files loaded in to the same table
+	each get their own snapshot, named after the table, the file name and
+	a hash of the full path. Reading from stdin (source "-" or None) has
+	one snapshot per table.
+	"""
+	if source in (None,"-"):
+		return os.path.join(directory,"%s.stdin"%table)
+	return os.path.join(directory,"%s.%s.%s"%(table,os.path.basename(source),hashlib.md5(os.path.abspath(source)).hexdigest()[:8]))
+
+class hashindex(object):
+	"""
+	A sorted file of (key hash, row hash) records read through mmap. A
+	directory of where each range of key hashes starts is kept in the
+	head of the file, so a lookup is a binary search among some 64
+	records. Only the pages that are looked at are read in to memory.
+	"""
+	def __init__(self,path):
+		self.path=path
+		self._fd=open(path,'rb')
+		self._mm=None
+		magic,self.n,bits=_header.unpack(self._fd.read(_header.size))
+		assert magic==_magic, "%s is not a hash index"%path
+		self._shift=64-bits
+		self._dir=_header.size
+		self._base=self._dir+8*((1<<bits)+1)
+		if self.n:
+			self._mm=mmap.mmap(self._fd.fileno(),0,access=mmap.ACCESS_READ)
+
+	def __len__(self):
+		return self.n
+
+	def find(self,key):
+		"""the row hash of key, or None if it is not in the index"""
+		if not self.n:
+			return None
+		mm=self._mm
+		base=self._base
+		lo,hi=struct.unpack_from("<QQ",mm,self._dir+8*(struct.unpack(">Q",key)[0]>>self._shift))
+		while lo<hi:
+			mid=(lo+hi)//2
+			o=base+_record_size*mid
+			if mm[o:o+8]<key:
+				lo=mid+1
+			else:
+				hi=mid
+		o=base+_record_size*lo
+		if lo<self.n and mm[o:o+8]==key:
+			return mm[o+8:o+_record_size]
+		return None
+
+	def __iter__(self):
+		"""the records in key order"""
+		return _read_records(self._fd,self._base)
+
+	def close(self):
+		if self._mm:
+			self._mm.close()
+		self._fd.close()
+
+class indexwriter(object):
+	"""
+	Collects (key hash, row hash) records and writes them to a hashindex
+	file when closed. At most chunk_records records are kept in memory,
+	sorted runs of them are spilled to temporary files next to path and
+	merged in the end.
+	"""
+	def __init__(self,path,chunk_records=500000):
+		self.path=path
+		self.chunk_records=chunk_records
+		self.n=0
+		self._chunk=[]
+		self._runs=[]
+
+	def add(self,record):
+		self._chunk.append(record)
+		self.n+=1
+		if len(self._chunk)>=self.chunk_records:
+			self._spill()
+
+	def _spill(self):
+		self._chunk.sort()
+		run=tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(self.path)))
+		run.write("".join(self._chunk))
+		run.seek(0)
+		self._runs.append(run)
+		self._chunk=[]
+
+	def close(self,drop=None):
+		"""write the index, leaving out the records in the set drop"""
+		self._chunk.sort()
+		records=heapq.merge(iter(self._chunk),*[_read_records(run,0) for run in self._runs])
+		bits=min(20,(self.n//64).bit_length())
+		shift=64-bits
+		directory=[0]*((1<<bits)+1)
+		n=0
+		with open(self.path,'wb') as out:
+			out.seek(_header.size+8*len(directory))
+			for r in records:
+				if drop and r in drop:
+					continue
+				directory[(struct.unpack(">Q",r[:8])[0]>>shift)+1]+=1
+				out.write(r)
+				n+=1
+			for b in range(1,len(directory)):
+				directory[b]+=directory[b-1]
+			out.seek(0)
+			out.write(_header.pack(_magic,n,bits))
+			for i in range(0,len(directory),4096):
+				part=directory[i:i+4096]
+				out.write(struct.pack("<%iQ"%len(part),*part))
+		self.n=n
+		for run in self._runs:
+			run.close()
+		self._chunk=[]
+		self._runs=[]
+
+def _read_records(fd,start,block=_record_size*8192):
+	fd.seek(start)
+	while True:
+		data=fd.read(block)
+		if not data:
+			return
+		for o in xrange(0,len(data),_record_size):
+			yield data[o:o+_record_size]
+
+class differ(object):
+	"""
+	Compare the rows of a load with the snapshot of the previous load of
+	the same table, kept in path.idx (and the keys in path.keys).
+
+	key_columns: the positions of the key columns in the rows, or None to
+		compare whole rows, a changed row is then a new row and the old one
+		can not be found to be deleted.
+	While filtering the snapshot of this load is written next to the old
+	one, call commit() to replace the old one with it once the rows are
+	in the database, or abort() to keep the old one. Rows the database
+	did not take should be passed to reject(), they are then left out of
+	the snapshot and tried again by the next load.
+	"""
+	def __init__(self,path,key_columns=None,batch_size=1000):
+		self.path=path
+		self.key_columns=key_columns
+		self.batch_size=batch_size
+		self.new=self.changed=self.unchanged=self.deleted=self.rejected=0
+		self.old=hashindex(path+".idx") if os.path.exists(path+".idx") else None
+		self._writer=indexwriter(path+".idx.tmp")
+		self._rejected=set()
+		self._keys=open(path+".keys.tmp",'wb') if key_columns!=None else None
+
+	def filter(self,rows,delete=None):
+		"""
+		Yield the rows that are new or changed since the previous load,
+		before the changed rows are yielded delete(keys) is called with a
+		list of their keys so that the old versions can be deleted.
+		"""
+		old=self.old
+		changed=[]
+		for row in rows:
+			key=self._key(row)
+			kh,rh=self._record(row,key)
+			if self._keys:
+				self._keys.write(cPickle.dumps(key,2))
+			self._writer.add(kh+rh)
+			prev=old.find(kh) if old else None
+			if prev==None:
+				self.new+=1
+				yield row
+			elif prev!=rh:
+				self.changed+=1
+				changed.append((key,row))
+				if len(changed)>=self.batch_size:
+					delete([k for k,r in changed])
+					for k,r in changed:
+						yield r
+					changed=[]
+			else:
+				self.unchanged+=1
+		if changed:
+			delete([k for k,r in changed])
+			for k,r in changed:
+				yield r
+		if self._keys:
+			self._keys.close()
+
+	def _key(self,row):
+		return tuple(row[i] for i in self.key_columns) if self.key_columns!=None else None
+
+	def _record(self,row,key):
+		"""the (key hash,row hash) of a row"""
+		if self.key_columns!=None:
+			return key_hash(key),row_hash(row)
+		return key_hash(row),_no_row
+
+	def reject(self,row):
+		"""leave a filtered row that could not be loaded out of the snapshot"""
+		kh,rh=self._record(row,self._key(row))
+		self._rejected.add(kh+rh)
+		self.rejected+=1
+
+	def _finish(self):
+		"""write the snapshot of this load, once all rows are loaded or rejected"""
+		if self._writer:
+			self._writer.close(drop=self._rejected)
+			self._writer=None
+
+	def removed(self):
+		"""
+		The keys of the previous load that are not in this one, once all
+		rows have been filtered. Found by merging the old and new indexes,
+		and then reading the keys of the old load.
+		"""
+		assert self.key_columns!=None, "removed rows can only be found by key"
+		self._finish()
+		if not self.old or not os.path.exists(self.path+".keys"):
+			return
+		new=hashindex(self.path+".idx.tmp")
+		try:
+			gone=set(_missing((r[:8] for r in self.old),(r[:8] for r in new)))
+		finally:
+			new.close()
+		gone-=set(r[:8] for r in self._rejected) #still in the file, just not loaded
+		if not gone:
+			return
+		with open(self.path+".keys",'rb') as f:
+			keys=cPickle.Unpickler(f)
+			while True:
+				try:
+					key=keys.load()
+				except EOFError:
+					break
+				if key_hash(key) in gone:
+					self.deleted+=1
+					yield key
+
+	def commit(self):
+		self._finish()
+		if self.old:
+			self.old.close()
+		os.rename(self.path+".idx.tmp",self.path+".idx")
+		if self.key_columns!=None:
+			os.rename(self.path+".keys.tmp",self.path+".keys")
+		elif os.path.exists(self.path+".keys"):
+			os.remove(self.path+".keys")
+
+	def abort(self):
+		if self.old:
+			self.old.close()
+		if self._keys:
+			self._keys.close()
+		for tmp in (self.path+".idx.tmp",self.path+".keys.tmp"):
+			if os.path.exists(tmp):
+				os.remove(tmp)
+
+def _missing(old,new):
+	"""the keys of the sorted old that are not in the sorted new"""
+	n=next(new,None)
+	last=None
+	for k in old:
+		while n!=None and n<k:
+			n=next(new,None)
+		if k!=n and k!=last:
+			yield k
+		last=k
+
+def _test_hashindex():
+	"""
+	>>> tmp=tempfile.mkdtemp()
+	>>> w=indexwriter(os.path.join(tmp,"t.idx"),chunk_records=1000)
+	>>> for i in range(5000):
+	...	w.add(key_hash([i])+row_hash([i*2]))
+	>>> w.close()
+	>>> idx=hashindex(os.path.join(tmp,"t.idx"))
+	>>> len(idx), idx.find(key_hash([1234]))==row_hash([2468]), idx.find(key_hash([5000]))
+	(5000, True, None)
+	>>> records=list(idx)
+	>>> records==sorted(records), all(idx.find(r[:8])==r[8:] for r in records)
+	(True, True)
+	>>> idx.close()
+	>>> indexwriter(os.path.join(tmp,"empty.idx")).close()
+	>>> hashindex(os.path.join(tmp,"empty.idx")).find(key_hash([1]))
+	>>> import shutil; shutil.rmtree(tmp)
+	"""
+
+def _test_differ():
+	"""
+	>>> tmp=tempfile.mkdtemp()
+	>>> path=os.path.join(tmp,"snap")
+	>>> def load(rows,keys=[0]):
+	...	d=differ(path,keys,batch_size=2)
+	...	deleted=[]
+	...	out=list(d.filter(rows,deleted.extend))
+	...	for r in out:
+	...		if r[1]=="bad":
+	...			d.reject(r)
+	...	removed=list(d.removed()) if keys else []
+	...	d.commit()
+	...	return out,deleted,removed
+	>>> load([(1,"a"),(2,"b"),(3,"c")])
+	([(1, 'a'), (2, 'b'), (3, 'c')], [], [])
+	>>> load([(1,"a"),(2,"B"),(4,"d"),(3,"C")])
+	([(4, 'd'), (2, 'B'), (3, 'C')], [(2,), (3,)], [])
+	>>> load([(2,"B"),(3,"c")])
+	([(3, 'c')], [(3,)], [(1,), (4,)])
+
+	Rows that the database rejected are tried again the next time
+	>>> load([(2,"bad"),(3,"c"),(5,"bad")])
+	([(5, 'bad'), (2, 'bad')], [(2,)], [])
+	>>> load([(2,"bad"),(3,"c"),(5,"bad")])
+	([(2, 'bad'), (5, 'bad')], [], [])
+
+	Without keys whole rows are compared
+	>>> load([(2,"B"),(3,"c")],None)
+	([(2, 'B'), (3, 'c')], [], [])
+	>>> load([(2,"B"),(3,"d"),(5,"e")],None)
+	([(3, 'd'), (5, 'e')], [], [])
+	>>> key_hash([1,None,u"\\xe5"])==key_hash([u"1",None,"\\xc3\\xa5"]), key_hash([None])==key_hash([u""])
+	(True, False)
+	>>> sorted(os.listdir(tmp))
+	['snap.idx']
+	>>> [os.path.basename(snapshot_path(tmp,"t",f))[:8] for f in ["a.csv","in/a.csv","-"]]
+	['t.a.csv.', 't.a.csv.', 't.stdin']
+	>>> snapshot_path(tmp,"t","a.csv")==snapshot_path(tmp,"t","./a.csv")!=snapshot_path(tmp,"t","in/a.csv")
+	True
+	>>> import shutil; shutil.rmtree(tmp)
+	"""
+
+if __name__ == "__main__":
+	import doctest
+	doctest.testmod(optionflags=doctest.ELLIPSIS)
@@ -3,18 +3,24 @@ from datetime import datetime
 import doctest
 import sys
 import collections 
+import re
+import sketch as sketchmod
 
 class failtype(object):
 	"""
 	Attempts to deduce the most general shared type of a series of strings.
 	"""
 	typeinfo=collections.namedtuple("typeinfo",["converter","type"])
-	def __init__(self,extra_converters=[],sanitize=True, utf=False):
+	def __init__(self,extra_converters=[],sanitize=True, utf=False, sketch=False, decoded=False):
 		"""
 		extra_converters: should be a list of functions to convert a string to a given object type. The last converter in the list is considdered the most specific.
 		sanitize (default True): if true the data will be .strip()ed and any empty values or
 				values called NULL (regardless of case) will be ignored.
 		utf (default False): Will return a lambda .decode('utf-8') instead of the naive string converter. Yeah that is all... and yes, that is ugly
+		sketch (default False): keep a sketch.columnsketch of the examples in .sketch, with their
+				range, precision, lengths, null fraction and number of distinct values.
+		decoded (default False): the examples are already unicode (the file was decoded a block
+				at a time, see csvparse), strings are kept as they are instead of being decoded.
 		"""
 		self._converters=[float,int,_gendate,_gendate2]+extra_converters
 		self._converter_result=[]
@@ -22,8 +28,13 @@ class failtype(object):
 		self._extras={}
 		self._sanitize=sanitize
 		self.utf=utf
+		self.decoded=decoded
+		self._observed=0
+		self._last_change=0
+		self._maxlen=0
+		self.sketch=sketchmod.columnsketch() if sketch else None
 		for i in self._converters:
-			self._converter_result.append({'converter':i,'lasttype':None})
+			self._converter_result.append({'converter':i,'lasttype':None,'classify':_classifier(i)})
 		
 		#print "I AM ALIVE " + str(id(self))
 
@@ -44,26 +55,135 @@ class failtype(object):
 
 		example=example.strip()
 		if(self._sanitize and (example=="" or example.upper()=="NULL")):
+			if self.sketch:
+				self.sketch.add_null()
 			return
-		for c in self._converter_result[:]:
-			try:
-				c['lasttype']=type(c['converter'](example))
-			except:
+		self._observed+=1
+		if self.sketch:
+			self.sketch.add(example)
+		if not self._converter_result: #allready a string, only the length is interesting
+			self._update_strsize(example)
+			self._test_performed=True
+			return
+		self._update_maxlen(example)
+		kept=None
+		for n,c in enumerate(self._converter_result):
+			t=c['classify'](example)
+			if t==None:
 				#print "removing %s from %s"%(c,id(self))
-				self._converter_result.remove(c)
-				#print sys.exc_info()
-		if len(self._converter_result)==0: #Yes there is a possible bug when the first lines are long, valid numbers, but this is slow enough as it is
-			if type(example) == unicode:
-				newlen=len(example.encode("utf-8"))
+				if kept==None:
+					kept=self._converter_result[:n]
 			else:
-				newlen=len(example)
-
-			if newlen>self._extras.get("strsize",-1):
-				self._extras["strsize"]=newlen
+				c['lasttype']=t
+				if kept!=None:
+					kept.append(c)
+		if kept!=None:
+			self._converter_result=kept
+			self._last_change=self._observed
+		if len(self._converter_result)==0: #the earlier examples were numbers or dates, but they have to fit too
+			self._extras["strsize"]=max(self._extras.get("strsize",-1),self._maxlen)
 		self._test_performed=True
 		#print "FEEED MEEEE "+str(id(self))
 
+	def _update_strsize(self,example):
+		newlen=_byte_length(example,self._extras.get("strsize",-1))
+		if newlen>self._extras.get("strsize",-1):
+			self._extras["strsize"]=newlen
+
+	def _update_maxlen(self,example):
+		"""the longest example so far, in case they all turn out to be strings"""
+		newlen=_byte_length(example,self._maxlen)
+		if newlen>self._maxlen:
+			self._maxlen=newlen
+
+	@property
+	def stable_for(self):
+		"""The number of non-null examples tested since the set of candidate types last changed"""
+		return self._observed-self._last_change
+
+	def is_stable(self,window):
+		"""True if the candidate types has not changed for the last window non-null examples"""
+		return self._observed>0 and self.stable_for>=window
+
 				
+	def get_state(self):
+		"""
+		A json-serializable snapshot of what the typer has learnt so far,
+		it can be loaded in to a new typer with set_state.
+		"""
+		return {
+			'candidates':[c['converter'].__name__ for c in self._converter_result],
+			'types':[c['lasttype'].__name__ if c['lasttype'] else None for c in self._converter_result],
+			'extras':dict(self._extras),
+			'tested':self._test_performed,
+			'observed':self._observed,
+			'last_change':self._last_change,
+			'maxlen':self._maxlen,
+			'sketch':self.sketch.get_state() if self.sketch else None,
+		}
+
+	def set_state(self,state):
+		"""
+		Restore a state from get_state, candidates naming converters this
+		typer does not have are dropped. Testing more examples afterwards
+		narrows the candidates and grows strsize from where it was.
+		"""
+		types=dict(zip(state['candidates'],state['types']))
+		self._converter_result=[]
+		for i in self._converters:
+			if i.__name__ in types:
+				self._converter_result.append({'converter':i,'lasttype':_known_types.get(types[i.__name__]),'classify':_classifier(i)})
+		self._extras=dict(state['extras'])
+		self._test_performed=state['tested']
+		self._observed=state['observed']
+		self._last_change=state['last_change']
+		self._maxlen=state.get('maxlen',0)
+		if self.sketch and state.get('sketch'):
+			self.sketch.set_state(state['sketch'])
+
+	def merge(self,other):
+		"""
+		Add what another typer of the same column (in another file or
+		another part of the file) has learnt, as if its examples had been
+		tested by this one. Only the candidates both typers have are kept,
+		so an int column merged with a float column is a float column, and
+		strsize covers the longest example of either. Merging is
+		associative, so the typers of many parts can be merged in any
+		grouping. The sketches are merged if both typers have one.
+		"""
+		if not other._test_performed:
+			return
+		if not self._test_performed:
+			self.set_state(other.get_state())
+			if self.sketch and not other.sketch:
+				self.sketch=None
+			return
+		names=set(c['converter'].__name__ for c in other._converter_result)
+		theirs=dict((c['converter'].__name__,c['lasttype']) for c in other._converter_result)
+		kept=[c for c in self._converter_result if c['converter'].__name__ in names]
+		for c in kept:
+			c['lasttype']=c['lasttype'] or theirs[c['converter'].__name__]
+		stable=0
+		if len(kept)==len(self._converter_result):
+			stable+=self.stable_for
+		if len(kept)==len(other._converter_result):
+			stable+=other.stable_for
+		strsize=max(self._extras.get("strsize",-1),other._extras.get("strsize",-1))
+		extras=dict(other._extras,**self._extras)
+		if not kept:
+			strsize=max(strsize,self._maxlen,other._maxlen)
+		if strsize>=0:
+			extras["strsize"]=strsize
+		self._converter_result=kept
+		self._extras=extras
+		self._observed+=other._observed
+		self._last_change=self._observed-stable
+		self._maxlen=max(self._maxlen,other._maxlen)
+		if self.sketch and other.sketch:
+			self.sketch.merge(other.sketch)
+		else:
+			self.sketch=None
+
 	@property
 	def extras(self):
 		return self.get_extras()
@@ -77,15 +197,7 @@ class failtype(object):
 		returns: a named tupple consistiong of (type=type,converter=converter)
 		returns a tupple consisting of the most specific type and its converter-function. 
 		"""
-		if not self._test_performed:
-			raise LookupError("typer hasnt been fed with data. meditation:"+str(id(self)))
-		if len(self._converter_result)==0:
-			if not self.utf:
-				best={'converter':str,'lasttype':str}
-			else:
-				best={'converter':lambda s: s.decode('utf-8'),'lasttype':unicode}
-		else:
-			best=self._converter_result[-1]
+		best=self.get_base_type()
 
 		def nulldecorator(fun):
 			def nulldecorated(s):
@@ -96,12 +208,34 @@ class failtype(object):
 			return nulldecorated
 
 		if self._sanitize:
-			conv=nulldecorator(best['converter'])
-			conv.__name__="nullsafe_"+best['converter'].__name__
+			conv=nulldecorator(best.converter)
+			conv.__name__="nullsafe_"+best.converter.__name__
 		else:
-			conv=best['converter']
-		#print "I CROWN "+str(self.typeinfo(conv,best['lasttype']))
-		return self.typeinfo(conv,best['lasttype'])
+			conv=best.converter
+		#print "I CROWN "+str(self.typeinfo(conv,best.type))
+		return self.typeinfo(conv,best.type)
+
+	def get_base_type(self):
+		"""
+		Like get_best_type but the converter is not wrapped in the null-check
+		even if sanitize is set, see the sanitize property.
+		"""
+		if not self._test_performed:
+			raise LookupError("typer hasnt been fed with data. meditation:"+str(id(self)))
+		if len(self._converter_result)==0:
+			if self.decoded:
+				return self.typeinfo(unicode,unicode)
+			elif not self.utf:
+				return self.typeinfo(str,str)
+			else:
+				return self.typeinfo(_decode_utf8,unicode)
+		best=self._converter_result[-1]
+		return self.typeinfo(best['converter'],best['lasttype'])
+
+	@property
+	def sanitize(self):
+		"""True if empty strings and NULL should be converted to None"""
+		return self._sanitize
 
 	@property
 	def converter(self):
@@ -116,6 +250,81 @@ class failtype(object):
 	def __repr__(self):
 		return "failtype:"+self.__str__()
 
+_known_types=dict((t.__name__,t) for t in [int,long,float,str,unicode,bool,datetime])
+
+_int_re=re.compile(r"[+-]?\d+\Z",re.UNICODE)
+_float_re=re.compile(r"[+-]?(?:\d+\.?\d*(?:e[+-]?\d+)?|\.\d+(?:e[+-]?\d+)?|inf|infinity|nan)\Z",re.UNICODE|re.IGNORECASE)
+#a superset of what strptime accepts for the two date formats
+_date_re=re.compile(r"\d{4}-\d\d?- ?\d\d?\s+\d\d?:\d\d?:\d\d?\Z",re.UNICODE)
+_date2_re=re.compile(r"\d{4}-\d\d?- ?\d\d?\s+\d\d?:\d\d?:\d\d?\.\d{1,6}\Z",re.UNICODE)
+
+def _classify_float(s):
+	if _float_re.match(s):
+		return float
+	return None
+
+def _classify_int(s):
+	if not _int_re.match(s):
+		return None
+	if len(s)>=19: #only now is there any risk of not fitting in a long
+		try:
+			_limited_int(s)
+		except ValueError:
+			return None
+	return int
+
+class _trying(object):
+	"""Fallback for converters we know nothing about, just try them"""
+	def __init__(self,converter):
+		self.converter=converter
+
+	def __call__(self,s):
+		try:
+			return type(self.converter(s))
+		except Exception:
+			return None
+
+class _gated(_trying):
+	"""Only try the converter for strings that have the right shape"""
+	def __init__(self,regex,converter):
+		self.regex=regex
+		self.converter=converter
+
+	def __call__(self,s):
+		if not self.regex.match(s):
+			return None
+		return _trying.__call__(self,s)
+
+def _classifier(converter):
+	"""
+	Get the function used by failtype.test to decide if a string fits a
+	converter, it returns the type the converter would produce or None.
+	"""
+	if converter==float:
+		return _classify_float
+	if converter==int:
+		return _classify_int
+	if converter==_gendate:
+		return _gated(_date_re,_gendate)
+	if converter==_gendate2:
+		return _gated(_date2_re,_gendate2)
+	return _trying(converter)
+
+def _byte_length(s,longest=-1):
+	"""
+	The UTF-8 length of s, a character is at most 4 bytes so a string of at
+	most longest/4 characters is not encoded, it can not be longer than
+	longest and longest is returned instead.
+	"""
+	if type(s)!=unicode:
+		return len(s)
+	if 4*len(s)<=longest:
+		return longest
+	return len(s.encode("utf-8"))
+
+def _decode_utf8(s):
+	return s.decode('utf-8')
+
 def _limited_int(s):
 		i=int(s)
 		if (abs(i)>(2**63-2)): #if the numbers mangitude is greater than a longs max positive value...
@@ -123,17 +332,57 @@ def _limited_int(s):
 		else:
 			return i
 
+_date_sentinel=datetime.fromtimestamp(-2208992399)
+_date_prefixes={}
+
+def _fixed_datetime(s):
+	"""
+	Parse "YYYY-MM-DD HH:MM:SS" with an optional ".ffffff" by slicing out the
+	digits at their fixed positions, the parsed "YYYY-MM-DD" part is cached
+	as most files only contain a limited number of distinct days.
+	returns None if s is not in exactly that layout, raises ValueError
+	if it is but the date is invalid.
+	"""
+	n=len(s)
+	if n<19 or s[4]!='-' or s[7]!='-' or s[10]!=' ' or s[13]!=':' or s[16]!=':':
+		return None
+	day=_date_prefixes.get(s[:10])
+	if day==None:
+		if not (s[0:4].isdigit() and s[5:7].isdigit() and s[8:10].isdigit()):
+			return None
+		day=(int(s[0:4]),int(s[5:7]),int(s[8:10]))
+		if len(_date_prefixes)>=10000:
+			_date_prefixes.clear()
+		_date_prefixes[s[:10]]=day
+	if not (s[11:13].isdigit() and s[14:16].isdigit() and s[17:19].isdigit()):
+		return None
+	if n==19:
+		us=0
+	elif n<=26 and s[19]=='.' and s[20:].isdigit():
+		us=int(s[20:].ljust(6,'0'))
+	else:
+		return None
+	return datetime(day[0],day[1],day[2],int(s[11:13]),int(s[14:16]),int(s[17:19]),us)
+
 def _gendate(s):
-		d=datetime.strptime(s,"%Y-%m-%d %H:%M:%S")
+		d=None
+		if len(s)==19:
+			d=_fixed_datetime(s)
+		if d==None: #not zero padded or just not a date, let strptime sort it out
+			d=datetime.strptime(s,"%Y-%m-%d %H:%M:%S")
 		if (d.year<1999):
-			return datetime.fromtimestamp(-2208992399)
+			return _date_sentinel
 		else:
 			return d
 
 def _gendate2(s):
-		d=datetime.strptime(s,"%Y-%m-%d %H:%M:%S.%f")
+		d=None
+		if len(s)>19:
+			d=_fixed_datetime(s)
+		if d==None:
+			d=datetime.strptime(s,"%Y-%m-%d %H:%M:%S.%f")
 		if (d.year<1999):
-			return datetime.fromtimestamp(-2208992399)
+			return _date_sentinel
 		else:
 			return d
 
@@ -254,6 +503,122 @@ def __test_sanitizer():
 	typeinfo(converter=<function nullsafe_float at ...>, type=<type 'float'>)
 	"""
 
+def __test_classifier():
+	"""
+	>>> cases=["4","-4","+4","4.","-.5","1e5","1E-05","inf","-Infinity","nan","1,5","0x10","1 000","e5",".",
+	...	"2015-03-12 10:10:10","2015-3-2 1:1:1","2015-13-12 10:10:10","2015-02-30 10:10:10","2015-03-12 10:10:10.123",
+	...	"2015-03-12 10:10:10.1234567","2015-03-12T10:10:10",u"\\u0663",u"\\xe5"]
+	>>> def tried(c,s):
+	...	try:
+	...		return type(c(s))
+	...	except:
+	...		return None
+	>>> [s for s in cases for c in [float,int,_gendate,_gendate2] if _classifier(c)(s)!=tried(c,s)]
+	[]
+	>>> _classify_int(str(2**63-2)),_classify_int(str(2**63)),_classify_int("-00000000000000000000001")
+	(<type 'int'>, None, <type 'int'>)
+	>>> f=failtype()
+	>>> f.test(str(2**64))
+	>>> f.type
+	<type 'float'>
+	"""
+
+def __test_stable():
+	"""
+	>>> f=failtype()
+	>>> f.is_stable(1)
+	False
+	>>> f.test(["1","2","NULL","3"])
+	>>> f.stable_for, f.is_stable(2), f.is_stable(3)
+	(2, True, False)
+	>>> f.test("3.5")
+	>>> f.stable_for
+	0
+	>>> f.test(["foo","barbaz","4"])
+	>>> f.stable_for, f.type, f.extras["strsize"]
+	(2, <type 'str'>, 6)
+	"""
+
+def __test_state():
+	"""
+	>>> import json
+	>>> f=failtype()
+	>>> f.test(["1","2","3"])
+	>>> state=json.loads(json.dumps(f.get_state()))
+	>>> g=failtype()
+	>>> g.set_state(state)
+	>>> g.get_best_type()
+	typeinfo(converter=<function nullsafe_int at ...>, type=<type 'int'>)
+	>>> g.test("3.5")
+	>>> g.type
+	<type 'float'>
+	>>> f.test(["foo","barbaz"])
+	>>> g.set_state(f.get_state())
+	>>> g.test("foobar12")
+	>>> g.type, g.extras["strsize"]
+	(<type 'str'>, 8)
+	"""
+
+def __test_sketch():
+	"""
+	>>> f=failtype(sketch=True)
+	>>> f.test(["12","NULL","-7","300",""])
+	>>> f.type, f.sketch.min, f.sketch.max, f.sketch.null_fraction
+	(<type 'int'>, -7, 300, 0.4)
+	>>> g=failtype(sketch=True)
+	>>> g.set_state(f.get_state())
+	>>> g.sketch.max, g.sketch.distinct()
+	(300, 3)
+	>>> failtype().get_state()['sketch']
+	"""
+
+def __test_merge():
+	"""
+	>>> a,b,c=failtype(),failtype(),failtype()
+	>>> a.test(["1","20000","3"])
+	>>> b.test(["2.5","-1"])
+	>>> c.test(["x","NULL"])
+	>>> a.merge(b)
+	>>> a.type, a.stable_for
+	(<type 'float'>, 1)
+	>>> a.merge(c)
+	>>> a.type, a.extras["strsize"], a._observed
+	(<type 'str'>, 5, 6)
+
+	The same in another grouping, through json
+	>>> import json
+	>>> x,y,z=failtype(),failtype(),failtype()
+	>>> x.test(["1","20000","3"]); y.test(["2.5","-1"]); z.test(["x","NULL"])
+	>>> y.merge(z)
+	>>> w=failtype()
+	>>> w.set_state(json.loads(json.dumps(y.get_state())))
+	>>> x.merge(w)
+	>>> x.get_state()==a.get_state()
+	True
+	>>> empty=failtype()
+	>>> empty.merge(a); a.merge(failtype())
+	>>> empty.get_state()==a.get_state()
+	True
+
+	Numbers seen before the first string are counted in strsize as well
+	>>> f=failtype()
+	>>> f.test(["123456789","abc"])
+	>>> f.extras["strsize"]
+	9
+	"""
+
+def __test_decoded():
+	"""
+	>>> f=failtype(decoded=True)
+	>>> f.test([u"12",u"\\xe5\\xe4\\xf6",u"a"])
+	>>> f.get_best_type(), f.extras["strsize"]
+	(typeinfo(converter=<function nullsafe_unicode at ...>, type=<type 'unicode'>), 6)
+	>>> f.converter(u"NULL"), f.converter(u"x")
+	(None, u'x')
+	>>> _byte_length(u"\\u20ac"), _byte_length(u"\\u20ac",4), _byte_length(u"\\u20ac",3), _byte_length("\\xe2\\x82\\xac")
+	(3, 4, 3, 3)
+	"""
+
 def __test_gendate():
 	"""
 	>>> _gendate("2015-03-12 10:10:10")
@@ -264,6 +629,22 @@ def __test_gendate():
 	datetime.datetime(2015, 3, 12, 10, 10, 10)
 	>>> _gendate2("1015-03-12 10:10:10.0")
 	datetime.datetime(1900, 1, 1, 0, 0, 1)
+	>>> _gendate2("2015-03-12 10:10:10.25")
+	datetime.datetime(2015, 3, 12, 10, 10, 10, 250000)
+	>>> _gendate("2015-3-2 10:10:10")
+	datetime.datetime(2015, 3, 2, 10, 10, 10)
+	>>> _gendate("2015-02-30 10:10:10")
+	Traceback (most recent call last):
+	...
+	ValueError: day is out of range for month
+	>>> _gendate("2015-03-12 10:10:10.0")
+	Traceback (most recent call last):
+	...
+	ValueError: unconverted data remains: .0
+	>>> _gendate2("2015-03-12 10:10:10")
+	Traceback (most recent call last):
+	...
+	ValueError: time data '2015-03-12 10:10:10' does not match format '%Y-%m-%d %H:%M:%S.%f'
 	"""
 
 def __test_utflen():
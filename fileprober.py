@@ -2,8 +2,11 @@
 import doctest
 import sys
 import os
+import mmap
+import random
+import tempfile
 
-def fileprober(fd,callback,skiphead=True,ignore_exceptions=False,maxrows=10000,verbose=False):
+def fileprober(fd,callback,skiphead=True,ignore_exceptions=False,maxrows=10000,verbose=False,spread='uniform',converged=None,window=1000):
 	"""
 	Helper function to probe rows of large files.
 
@@ -14,24 +17,58 @@ def fileprober(fd,callback,skiphead=True,ignore_exceptions=False,maxrows=10000,v
 		It read the first 1% or 4 rows, which ever is the larger of the
 		specified maxrows of a file and then attempt to spread the reads
 		evenly through out the file. The number is somewhat aproximate and
-		might be +- "a few"
+		might be +- "a few", except for real files which are memory mapped
+		and get exactly maxrows rows (if the file has that many).
 	verbose (default False): print extra debugging information
+	spread (default 'uniform'): how the rows between the head and the last
+		row are picked from memory mapped files, 'uniform' or 'random' offsets.
+	converged (default None): a function returning True once the callback
+		has seen enough, makes the probe adaptive and maxrows is ignored.
+		Memory mapped files are read in the head, the middle and the tail,
+		each part until at least window rows has been read and converged()
+		is True. Other files are read in full.
+	window (default 1000): see converged
 	"""
 	#to be implemented ,sparse=True
 	## sparse (default True): If set to false the entire file will be read to determine the type. This will lead to each file being read in full twice. Once for typing once for insersion in to the database
 
 	fsize=0
 	try:
-		fsize=os.fstat(fd.fileno())
+		if not _in_memory(fd):
+			fsize=os.fstat(fd.fileno()).st_size
 	except:
 		pass
 	#if filesize >= 0:  #Might be implemented in the future
 	#	_naive_skipper(fd,callback,maxrows)
 	#	return
-	if maxrows==False:
+	buf=None
+	if (maxrows!=False or converged!=None) and fsize!=0:
+		try:
+			buf=mmap.mmap(fd.fileno(),0,access=mmap.ACCESS_READ)
+		except (mmap.error,ValueError,EnvironmentError):
+			pass
+	if converged!=None and buf!=None:
+		if verbose:
+			print "Probing using adaptive probe with a window of %i lines"%window
+		try:
+			_adaptive_sampler(buf,fd.tell(),callback,skiphead,converged,window,ignore_exceptions=ignore_exceptions,verbose=verbose)
+		finally:
+			buf.close()
+	elif maxrows==False or converged!=None:
 		if verbose:
 			print "Probing using full reader probe"
 		_full_reader(fd,callback,skiphead,ignore_exceptions=ignore_exceptions)
+	elif hasattr(fd,'access_points'):
+		if verbose:
+			print "Probing using access point sampling of %i lines"%maxrows
+		_indexed_sampler(fd,callback,skiphead,maxrows,ignore_exceptions=ignore_exceptions,verbose=verbose)
+	elif buf!=None:
+		if verbose:
+			print "Probing using memory mapped %s sampling of %i lines"%(spread,maxrows)
+		try:
+			_mmap_sampler(buf,fd.tell(),callback,skiphead,maxrows,ignore_exceptions=ignore_exceptions,verbose=verbose,spread=spread)
+		finally:
+			buf.close()
 	elif (hasattr(fd,'seek') and hasattr(fd,'tell') and fsize != 0):
 		if verbose:
 			print "Probing using 'smart'-skipping file probe of %s lines"%maxrows
@@ -41,6 +78,77 @@ def fileprober(fd,callback,skiphead=True,ignore_exceptions=False,maxrows=10000,v
 			print "Probing using naive head-reader probe of %i lines"%maxrows
 		_head_reader(fd,callback,skiphead,maxrows,ignore_exceptions=ignore_exceptions)
 
+class spooledfile(object):
+	"""
+	Wraps a non-seekable stream (a pipe, stdin...) so it can be probed and then
+	read once: the first rows are kept in a spool, in memory or in a temporary
+	file once it grows past max_size bytes. The spool can be sought in and is
+	available as .window for probing, reading past it continues with the rest
+	of the stream after which seeking is no longer possible. complete is
+	True if the whole stream fitted in the spool.
+	"""
+	def __init__(self,fd,rows=10000,max_size=16*2**20):
+		"""
+		fd: the stream to wrap
+		rows (default 10000): the number of rows (after the first one) to keep in the spool
+		max_size (default 16MB): spill the spool to disk when it gets larger than this
+		"""
+		self.name=getattr(fd,'name','<stream>')
+		self._stream=fd
+		self._streaming=False
+		self.window=tempfile.SpooledTemporaryFile(max_size=max_size)
+		self.complete=False
+		for i in range(rows+1):
+			line=fd.readline()
+			if line=='':
+				self.complete=True
+				break
+			self.window.write(line)
+		self.window.seek(0)
+
+	def seek(self,pos,whence=0):
+		if self._streaming:
+			raise IOError("can not seek in a stream that has been read past its spool")
+		self.window.seek(pos,whence)
+
+	def tell(self):
+		if self._streaming:
+			raise IOError("can not tell the position in a stream that has been read past its spool")
+		return self.window.tell()
+
+	def read(self,n=-1):
+		data=self.window.read(n)
+		if n<0 or len(data)<n:
+			self._streaming=True
+			data+=self._stream.read(*([n-len(data)] if n>=0 else []))
+		return data
+
+	def readline(self):
+		line=self.window.readline()
+		if line=='':
+			self._streaming=True
+			line=self._stream.readline()
+		return line
+
+	def __iter__(self):
+		for line in iter(self.window.readline,''):
+			yield line
+		self._streaming=True
+		for line in self._stream:
+			yield line
+
+def _in_memory(fd):
+	"""True for a SpooledTemporaryFile still held in memory, fileno() would write it to disk"""
+	return isinstance(fd,tempfile.SpooledTemporaryFile) and not getattr(fd,'_rolled',True)
+
+def seekable(fd):
+	"""True if fd can be sought in, pipes and stdin has seek methods that fails"""
+	try:
+		fd.seek(fd.tell())
+		return True
+	except (AttributeError,IOError,OSError):
+		return False
+
 def _run_callback(callback,line,ignore_exceptions=False,verbose=False):
 	try:
 		callback(line)
@@ -97,7 +205,7 @@ def _full_skipper(fd,callback,skiphead,maxrows,ignore_exceptions=False,verbose=F
 			break
 		n+=1
 		consumed+=len(line)
-		_run_callback(callback,line,ignore_exception,verbose=verbose)
+		_run_callback(callback,line,ignore_exceptions,verbose=verbose)
 	remaining_size=fsize-consumed
 	remaining_rows=maxrows-n
 	avg_rowlen=(consumed/n)
@@ -127,6 +235,165 @@ def _full_skipper(fd,callback,skiphead,maxrows,ignore_exceptions=False,verbose=F
 	line=fd.readline()[:-1]
 	_run_callback(callback,line,ignore_exceptions,verbose=verbose)
 
+def _mmap_sampler(buf,start,callback,skiphead,maxrows,ignore_exceptions=False,verbose=False,spread='uniform'):
+	"""
+	Sample exactly maxrows rows from a memory mapped file, starting at byte start:
+	the first 1% (at least 4) rows, the last row and the rest spread by offset
+	in between. Line boundaries are found with find/rfind on the map, only
+	the selected lines are ever copied.
+	"""
+	size=len(buf)
+	pos=start
+	if skiphead==True:
+		pos=_next_line(buf,pos)
+
+	end=size
+	while end>pos and buf[end-1] in "\r\n":
+		end-=1
+	tail=max(buf.rfind("\n",pos,end)+1,pos)
+
+	headread=min(max(4,maxrows/100),maxrows)
+	n=0
+	while n<headread and pos<tail:
+		nl=buf.find("\n",pos,tail)
+		if nl==-1:
+			nl=tail
+		line=buf[pos:nl]
+		pos=nl+1
+		if line.strip()!='':
+			n+=1
+			_run_callback(callback,line,ignore_exceptions,verbose=verbose)
+
+	middle=maxrows-n-1
+	first=pos
+	taken=[]
+	if middle>0 and pos<tail:
+		if spread=='random':
+			offsets=sorted(random.randint(pos,tail-1) for i in range(middle))
+		else:
+			offsets=[pos+(tail-pos)*(i+1)/(middle+1) for i in range(middle)]
+		for o in offsets:
+			if o<pos: #landed in a line we allready have, take the next one
+				o=pos
+			elif o>0 and buf[o-1]!="\n":
+				o=_next_line(buf,o)
+			while o<tail and buf[o:_next_line(buf,o)].strip()=='':
+				o=_next_line(buf,o)
+			if o>=tail:
+				break
+			pos=_next_line(buf,o)
+			taken.append(o)
+	if len(taken)<middle:
+		#the offsets bunched up at the end, fill up with the first rows not yet taken
+		seen=set(taken)
+		o=first
+		while len(taken)<middle and o<tail:
+			if o not in seen and buf[o:_next_line(buf,o)].strip()!='':
+				taken.append(o)
+			o=_next_line(buf,o)
+		taken.sort()
+	for o in taken:
+		_run_callback(callback,buf[o:min(_next_line(buf,o)-1,tail)],ignore_exceptions,verbose=verbose)
+
+	if tail<end and maxrows>0:
+		_run_callback(callback,buf[tail:end],ignore_exceptions,verbose=verbose)
+
+def _indexed_sampler(fd,callback,skiphead,maxrows,ignore_exceptions=False,verbose=False):
+	"""
+	Sampling for files where seeking is only cheap to certain offsets, like
+	compressed.gzipfile: read the head rows, a few rows after each of the
+	fd.access_points() and the last row after the last point.
+	"""
+	if skiphead==True:
+		fd.readline()
+	headread=min(max(4,maxrows/100),maxrows)
+	n=_read_lines(fd,callback,headread,ignore_exceptions,verbose)
+	points=[p for p in fd.access_points() if p>fd.tell()]
+	if len(points)<2:
+		_read_lines(fd,callback,maxrows-n,ignore_exceptions,verbose)
+		return
+
+	middle=maxrows-n-1
+	points,last=points[:-1],points[-1]
+	for i,p in enumerate(points):
+		fd.seek(p)
+		fd.readline() #probably in the middle of a line
+		_read_lines(fd,callback,middle/len(points)+(1 if i<middle%len(points) else 0),ignore_exceptions,verbose)
+
+	fd.seek(last)
+	fd.readline()
+	line=''
+	for l in fd:
+		if l.strip()!='':
+			line=l
+	if line!='':
+		_run_callback(callback,line,ignore_exceptions,verbose=verbose)
+
+def _read_lines(fd,callback,rows,ignore_exceptions=False,verbose=False):
+	"""feed the next rows non-empty lines to the callback, returns how many there were"""
+	n=0
+	while n<rows:
+		line=fd.readline()
+		if line=='':
+			break
+		if line.strip()!='':
+			n+=1
+			_run_callback(callback,line,ignore_exceptions,verbose=verbose)
+	return n
+
+def _adaptive_sampler(buf,start,callback,skiphead,converged,window,ignore_exceptions=False,verbose=False):
+	"""
+	Read rows from the head, the middle and the tail of a memory mapped file,
+	moving on to the next part once window rows of the current part has been
+	read and converged() is True. If it never converges the whole file is read.
+	"""
+	size=len(buf)
+	pos=start
+	if skiphead==True:
+		pos=_next_line(buf,pos)
+	first=pos
+	mid=_line_start(buf,first+(size-first)/2)
+
+	pos,n=_read_until(buf,pos,mid,callback,converged,window,ignore_exceptions,verbose)
+	avg_rowlen=max((pos-first)/max(n,1),1)
+	tail=max(mid,_line_start(buf,size-2*window*avg_rowlen))
+	pos=max(pos,mid)
+	pos,n=_read_until(buf,pos,tail,callback,converged,window,ignore_exceptions,verbose)
+	pos=max(pos,tail)
+	_read_until(buf,pos,size,callback,None,window,ignore_exceptions,verbose)
+
+def _read_until(buf,pos,stop,callback,converged,window,ignore_exceptions=False,verbose=False):
+	"""
+	Feed the lines starting before stop to the callback until at least window
+	lines are read and converged() is True.
+	returns the offset of the next line and the number of lines read
+	"""
+	n=0
+	while pos<stop:
+		nl=_next_line(buf,pos)
+		line=buf[pos:nl].rstrip("\r\n")
+		pos=nl
+		if line.strip()=='':
+			continue
+		n+=1
+		_run_callback(callback,line,ignore_exceptions,verbose=verbose)
+		if converged!=None and n>=window and converged():
+			break
+	return pos,n
+
+def _line_start(buf,pos):
+	"""offset of the first line starting at or after pos"""
+	if pos<=0 or buf[pos-1]=="\n":
+		return max(pos,0)
+	return _next_line(buf,pos)
+
+def _next_line(buf,pos):
+	"""offset of the first line starting after pos"""
+	nl=buf.find("\n",pos)
+	if nl==-1:
+		return len(buf)
+	return nl+1
+
 def _test_head_reader():
 	"""
 	>>> from StringIO import StringIO as sIO
@@ -184,10 +451,78 @@ def _test_seek_reader():
 	>>> def foo(x):
 	...      print x.strip(),
 	>>> fileprober(f,foo,skiphead=False,maxrows=10)
+	0 1 2 3 22 37 53 68 84 99
+	>>> f.seek(0)
+	>>> _full_skipper(f,foo,skiphead=False,maxrows=10)
 	0 1 2 3 82 99
 	>>> os.remove(testfile)
 	"""
 
+def _test_mmap_sampler():
+	"""
+	>>> testfile="/tmp/seektest"
+	>>> f=open(testfile,"w")
+	>>> f.write("header"+chr(10)+chr(10).join("x"*(i%97) for i in range(20000)))
+	>>> f=open(testfile,"r")
+	>>> rows=[]
+	>>> fileprober(f,rows.append,maxrows=1000)
+	>>> len(rows), len(set(rows))>90, rows[-1]==("x"*(19999%97))
+	(1000, True, True)
+	>>> rows=[]
+	>>> fileprober(f,rows.append,maxrows=1000,spread='random')
+	>>> len(rows)
+	1000
+	>>> rows=[]
+	>>> fileprober(open(testfile),rows.append,maxrows=30000)
+	>>> rows==[l for l in open(testfile).read().split(chr(10))[1:] if l!='']
+	True
+	>>> os.remove(testfile)
+	"""
+
+def _test_spooledfile():
+	"""
+	>>> import subprocess
+	>>> p=subprocess.Popen(["seq","0","99"],stdout=subprocess.PIPE)
+	>>> seekable(p.stdout)
+	False
+	>>> f=spooledfile(p.stdout,rows=10)
+	>>> seekable(f)
+	True
+	>>> f.complete
+	False
+	>>> rows=[]
+	>>> fileprober(f.window,rows.append,skiphead=True,maxrows=1000)
+	>>> [r.strip() for r in rows]
+	['1', '2', '3', '4', '5', '6', '7', '8', '9', '10']
+	>>> f.window._rolled #probing does not write the spool to disk
+	False
+	>>> f.seek(0)
+	>>> f.readline()
+	'0\\n'
+	>>> [int(l) for l in f][::20]
+	[1, 21, 41, 61, 81]
+	>>> f.seek(0)
+	Traceback (most recent call last):
+	...
+	IOError: can not seek in a stream that has been read past its spool
+	>>> p=subprocess.Popen(["seq","0","9"],stdout=subprocess.PIPE)
+	>>> spooledfile(p.stdout,rows=10).complete
+	True
+	"""
+
+def _test_indexed_sampler():
+	"""
+	>>> import compressed
+	>>> data="header"+chr(10)+"".join("%i"%i+chr(10) for i in range(100000))
+	>>> f=compressed.open_fd(compressed._gzip(data),span=50000)
+	>>> rows=[]
+	>>> fileprober(f,rows.append,maxrows=100)
+	>>> len(rows), rows[:4], rows[-1]
+	(100, ['0\\n', '1\\n', '2\\n', '3\\n'], '99999\\n')
+	>>> max(int(r) for r in rows[4:-1])>90000
+	True
+	"""
+
 def _test_with_typer():
 	"""
 	>>> from failtype import failtype
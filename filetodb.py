@@ -1,26 +1,152 @@
 #!/usr/bin/python2
 
 import gentable
+import schemacache
+import stats
 import argparse
+import collections
+import compressed
+import datetime
+import delta as deltamod
+import itertools
+import json
+import multiprocessing
+import os
+import quarantine
+import sys
+import tokenizer
+import traceback
+import watcher
 
 def main():
 	parser=argparse.ArgumentParser(description='load one or more files to a database-')
 
-	parser.add_argument('CSVfiles', metavar='filenames', type=str, nargs='+', help='list of CSV-files to parse')
+	parser.add_argument('CSVfiles', metavar='filenames', type=str, nargs='*', help='list of CSV-files to parse, - reads from stdin (and needs a --map=-:TABLENAME)')
 
 	parser.add_argument('--database', type=str, required=True,  help='The database to uppload the table to, for example sqlite:///mydb.sqlite')
 
 	parser.add_argument('--separator',  nargs='?', default=',',  help='Field separator')
 
+	parser.add_argument('--encoding', dest='encoding', type=str, default=None, help='The encoding of the files, or auto to pick UTF-8, CP1252 or Latin-1 from the first MB of each file. Files with a UTF-8 BOM are always read as UTF-8, other files are not decoded without it')
+
+	parser.add_argument('--quoted', dest='quoting',action='store_true', help='Fields may be quoted with " (RFC4180), quoted fields can contain the separator and newlines')
+
 	parser.add_argument('--map', action='append', help='Load a file to antother table name than its file-name')
 
 	parser.add_argument('-v','--verbose', dest='verbose',action='store_true', help='Produce more information about the tables being generated')
 
 	parser.add_argument('--ignore-invalid', dest='continue_on_error',action='store_true', help='Continue parsing despite errors on individual lines, write the exception info to TABLENAME_errors.log')
 
+	parser.add_argument('--quarantine', dest='quarantine',action='store_true', help='Continue parsing despite errors on individual lines, write the rejected lines with their line number, byte offset and the reason to TABLENAME_rejected.csv')
+
+	parser.add_argument('--max-errors', dest='max_errors', type=str, default=None, help='Abort and roll back the load of a file once more than this many lines (or percent of the lines, as in 0.5%%) have been rejected, needs --ignore-invalid or --quarantine')
+
+	parser.add_argument('--probe-errors', dest='probe_errors',action='store_true', help='Check --max-errors on the lines read when probing the file as well, so broken files are rejected before anything is loaded')
+
 	parser.add_argument('--full-file', dest='read_full_file',action='store_true', help='Do not use sparse column type-probing  run typer on every single row in the entire file')
 
+	parser.add_argument('--tight-types', dest='sketch',action='store_true', help='Keep statistics of the probed values and use the smallest column types that hold them (SMALLINT, INTEGER, sized VARCHARs, and NUMERIC with --full-file) instead of BIGINT, FLOAT and TEXT, with -v columns with few distinct values are listed')
+
+	parser.add_argument('--merge-types', dest='merge_types',action='store_true', help='Probe all the files mapped to the same table first, --jobs at a time, and create the table with column types that fit every one of them')
+
+	parser.add_argument('--enums', dest='enums',action='store_true', help='With --tight-types and --full-file, make columns with few distinct values ENUMs')
+
+	parser.add_argument('--index', dest='indexes', action='append', default=None, help='Create an index on these comma separated columns once the rows are loaded, can be given several times')
+
+	parser.add_argument('--primary-key', dest='primary_key', type=str, default=None, help='Add a primary key on these comma separated columns once the rows are loaded (a unique index on sqlite)')
+
+	parser.add_argument('--suggest-keys', dest='suggest_keys',action='store_true', help='Print the columns that look unique in the probed rows')
+
+	parser.add_argument('--delta', dest='delta', type=str, default=None, help='Directory to keep a hash index of each loaded table in, only rows that are new or changed since the previous load are then inserted')
+
+	parser.add_argument('--key', dest='key_columns', type=str, default=None, help='With --delta, the comma separated columns that identify a row, a changed row then replaces the old one')
+
+	parser.add_argument('--delete-removed', dest='delete_removed',action='store_true', help='With --delta and --key, delete the rows whose keys are gone since the previous load')
+
+	parser.add_argument('--probe-window', dest='probe_window', type=int, default=None, help='Probe adaptively, reading the head, middle and tail of each file until every column type has been stable for this many rows')
+
+	parser.add_argument('--schema-cache', dest='schema_cache', type=str, default=None, help='Directory to remember the column types of loaded files in, files with the same header are then only checked against the remembered types')
+
+	parser.add_argument('--schema-ttl', dest='schema_ttl', type=int, default=None, help='Seconds before a remembered schema has to be probed again (default never)')
+
+	parser.add_argument('--batch-size', dest='batch_size', type=int, default=1000, help='Number of rows to send to the database in each insert-batch (default 1000)')
+
+	parser.add_argument('--adaptive-batch', dest='adaptive_batch',action='store_true', help='Grow or shrink the batch size depending on how long each batch takes to insert')
+
+	parser.add_argument('--bulk', dest='bulk',action='store_true', help='Use the native bulk load path of the database (COPY, LOAD DATA, raw sqlite3) when there is one')
+
+	parser.add_argument('--checkpoint-rows', dest='checkpoint_rows', type=int, default=None, help='Commit after every this many rows and record how far the load has come, see --resume')
+
+	parser.add_argument('--checkpoint-bytes', dest='checkpoint_bytes', type=int, default=None, help='Commit after every this many bytes of the file and record how far the load has come, see --resume')
+
+	parser.add_argument('--resume', dest='resume',action='store_true', help='Continue checkpointed loads from their last checkpoint instead of starting over, files that are completely loaded are skipped unless they have changed since')
+
+	parser.add_argument('--pipeline', dest='pipelined',action='store_true', help='Read and decode each file in background threads while the rows are written to the database')
+
+	parser.add_argument('--stats', dest='stats', type=str, default=None, help='Write per-stage timings, counters and throughput of each file as JSON to this file, with -v the progress and ETA is printed as well')
+
+	parser.add_argument('-j','--jobs', dest='jobs', type=int, default=1, help='Number of files to load in parallel worker processes (threads with --watch), files mapped to the same table are always loaded one after another')
+
+	parser.add_argument('--watch', dest='watch', type=str, default=None, help='Keep running and load every file that is put in this directory, loaded files are moved to DIR/done and failed ones to DIR/failed')
+
+	parser.add_argument('--poll-interval', dest='poll_interval', type=float, default=1.0, help='Seconds between looking for new files with --watch (default 1)')
+
+	parser.add_argument('--done-dir', dest='done_dir', type=str, default=None, help='Where --watch moves loaded files')
+
+	parser.add_argument('--failed-dir', dest='failed_dir', type=str, default=None, help='Where --watch moves files that failed to load')
+
+	parser.add_argument('--parse-jobs', dest='parse_jobs', type=int, default=None, help='Parse and convert each file in this many worker processes')
+
+	parser.add_argument('--unordered', dest='parse_ordered',action='store_false', help='With --parse-jobs, insert the rows in whatever order the workers finish them instead of file order')
+
 	args= parser.parse_args()
+	if args.watch==None and not args.CSVfiles:
+		parser.error("no files to load")
+	if args.watch!=None and args.CSVfiles:
+		parser.error("--watch loads the files in the watched directory, no other files can be given")
+	if args.watch!=None and (args.parse_jobs or args.stats):
+		parser.error("--watch can not be combined with --parse-jobs or --stats")
+	if args.jobs>1 and args.parse_jobs>1:
+		parser.error("--jobs and --parse-jobs can not be combined")
+
+	if args.resume and not (args.checkpoint_rows or args.checkpoint_bytes):
+		parser.error("--resume needs --checkpoint-rows or --checkpoint-bytes")
+	if (args.checkpoint_rows or args.checkpoint_bytes) and args.parse_jobs:
+		parser.error("checkpoints can not be combined with --parse-jobs")
+	if args.quoting and args.parse_jobs:
+		parser.error("--quoted can not be combined with --parse-jobs")
+	if args.pipelined and args.parse_jobs:
+		parser.error("--pipeline can not be combined with --parse-jobs")
+
+	if args.delta and (args.checkpoint_rows or args.checkpoint_bytes):
+		parser.error("--delta can not be combined with checkpoints")
+	if args.key_columns and not args.delta:
+		parser.error("--key needs --delta")
+	if args.delete_removed and not (args.delta and args.key_columns):
+		parser.error("--delete-removed needs --delta and --key")
+
+	if args.merge_types and args.watch!=None:
+		parser.error("--merge-types can not be combined with --watch")
+
+	if args.encoding and args.encoding!="auto":
+		try:
+			tokenizer.check_encoding(args.encoding)
+		except ValueError as e:
+			parser.error("--encoding: %s"%e)
+
+	if args.enums and not (args.sketch and args.read_full_file):
+		parser.error("--enums needs --tight-types and --full-file")
+
+	error_budget=None
+	if args.max_errors!=None:
+		if not (args.continue_on_error or args.quarantine):
+			parser.error("--max-errors needs --ignore-invalid or --quarantine")
+		try:
+			error_budget=quarantine.parse_budget(args.max_errors,probe=args.probe_errors)
+		except ValueError as e:
+			parser.error("--max-errors: %s"%e)
+	elif args.probe_errors:
+		parser.error("--probe-errors needs --max-errors")
 
 	tablemap={}
 	if args.map!=None:
@@ -33,10 +159,23 @@ def main():
 			except:
 				pass
 
-	dbURL=args.database
-	sep=args.separator
-	verbose=args.verbose
-	continue_on_error=args.continue_on_error
+	if '-' in args.CSVfiles:
+		if '-' not in tablemap:
+			parser.error('reading from stdin needs a table name, use --map=-:TABLENAME')
+		if args.jobs>1 or args.parse_jobs:
+			parser.error("stdin can not be read with --jobs or --parse-jobs")
+		if args.merge_types:
+			parser.error("stdin can not be probed with --merge-types")
+		if args.resume:
+			parser.error("stdin can not be resumed")
+	if args.parse_jobs:
+		for fname in args.CSVfiles:
+			try:
+				kind=compressed.compression(fname)
+			except IOError:
+				continue
+			if kind!=None:
+				parser.error("%s is a %s file, compressed files can not be read with --parse-jobs"%(fname,kind))
 
 	full_file_probe=args.read_full_file
 	if full_file_probe:
@@ -44,26 +183,187 @@ def main():
 	else:
 		maxrows=10000
 
-	for fname in args.CSVfiles:
-		tab=getfuzzy(tablemap,fname)
+	options=dict(
+		sep=args.separator,
+		verbose=args.verbose,
+		continue_on_error=args.continue_on_error or args.quarantine,
+		quarantine=args.quarantine,
+		error_budget=error_budget,
+		full_file_probe=full_file_probe,
+		maxrows=maxrows,
+		probe_window=args.probe_window,
+		schema_cache=schemacache.schemacache(args.schema_cache,ttl=args.schema_ttl) if args.schema_cache else None,
+		batch_size=args.batch_size,
+		adaptive_batch=args.adaptive_batch,
+		bulk=args.bulk,
+		parse_jobs=args.parse_jobs,
+		parse_ordered=args.parse_ordered,
+		checkpoint_rows=args.checkpoint_rows,
+		checkpoint_bytes=args.checkpoint_bytes,
+		resume=args.resume,
+		pipelined=args.pipelined,
+		quoting=args.quoting,
+		encoding=args.encoding,
+		sketch=args.sketch,
+		enums=args.enums,
+		indexes=[_columns(i) for i in args.indexes] if args.indexes else None,
+		primary_key=_columns(args.primary_key) if args.primary_key else None,
+		suggest_keys=args.suggest_keys,
+		delta=args.delta,
+		key_columns=_columns(args.key_columns) if args.key_columns else None,
+		delete_removed=args.delete_removed
+	)
+
+	if args.watch!=None:
+		return _watch(args,tablemap,options)
+
+	groups=_group_by_table([(fname,getfuzzy(tablemap,fname)) for fname in args.CSVfiles])
+	if args.merge_types:
+		probe_options=dict(sep=args.separator,maxrows=maxrows,probe_window=args.probe_window,quoting=args.quoting,encoding=args.encoding,sketch=args.sketch)
+		work=[(group,args.database,_merged_types(group,options,probe_options,args.jobs),args.stats!=None) for group in groups]
+	else:
+		work=[(group,args.database,options,args.stats!=None) for group in groups]
+	if args.jobs>1:
+		pool=multiprocessing.Pool(min(args.jobs,len(work)))
+		results=pool.imap_unordered(_load_group,work)
+	else:
+		pool=None
+		results=itertools.imap(_load_group,work)
+
+	failed=[]
+	reports=collections.OrderedDict()
+	for group in results:
+		for fname,tab,error,report in group:
+			if report!=None:
+				reports[fname]=dict(report,table=tab,failed=error!=None)
+			if error!=None:
+				failed.append(fname)
+				sys.stderr.write("Failed loading file:%s to table:%s\n%s"%(fname,tab,error))
+	if pool:
+		pool.close()
+		pool.join()
+
+	if args.stats:
+		with open(args.stats,"w") as f:
+			json.dump({'files':reports},f,indent=1)
+
+	if len(args.CSVfiles)>1 or failed:
+		print "Loaded %i of %i files"%(len(args.CSVfiles)-len(failed),len(args.CSVfiles))
+		for fname in failed:
+			print "  failed: %s"%fname
+	return 1 if failed else 0
+
+def _watch(args,tablemap,options):
+	"""
+	Load the files put in the watched directory until interrupted, with
+	one engine and the tables that are known to exist shared by all loads.
+	"""
+	engine=gentable._create_engine(args.database)
+	options=dict(options,engine=engine,known_tables=set())
+	def load(fname):
+		_load_file(fname,getfuzzy(tablemap,fname),args.database,options)
+	w=watcher.watcher(args.watch,load,
+		key=lambda fname: getfuzzy(tablemap,fname),
+		jobs=args.jobs,
+		interval=args.poll_interval,
+		done_dir=args.done_dir,
+		failed_dir=args.failed_dir,
+		verbose=args.verbose
+	)
+	if args.verbose:
+		print "Watching %s"%args.watch
+	try:
+		w.run()
+	except KeyboardInterrupt:
+		pass
+	print "Loaded %i files, %i failed"%(w.loaded,w.failed)
+	return 0
+
+def _merged_types(group,options,probe_options,jobs):
+	"""options with the merged types of the files of a group, see gentable.probe_files"""
+	if len(group)<2:
+		return options
+	if options['verbose']:
+		print "Probing %i files for table:%s"%(len(group),group[0][1])
+	return dict(options,probed_types=gentable.probe_files([fname for fname,tab in group],jobs,**probe_options))
+
+def _group_by_table(files):
+	"""
+	Group (filename,table) pairs by table so that all files going to the
+	same table are loaded one after another by the same worker.
+	"""
+	groups=collections.OrderedDict()
+	for fname,tab in files:
+		groups.setdefault(tab,[]).append((fname,tab))
+	return groups.values()
 
-		log_file=None
-		if continue_on_error:
-			import datetime
-			log_file=open(tab+"_errors.log","a")
-			log_file.write(datetime.datetime.now().strftime("----- %Y-%m-%d %H:%M:%S -----\n"))
+def _load_group(work):
+	"""
+	Load a list of files one by one, returns a list of (filename,table,error,report)
+	where error is a formated traceback or None and report the stats report
+	of the file or None if no stats are collected
+	"""
+	group,dbURL,options,with_stats=work
+	results=[]
+	for fname,tab in group:
+		s=None
+		if with_stats:
+			s=stats.stats()
+			if options['verbose']:
+				s.add_hook(_print_progress)
+		try:
+			_load_file(fname,tab,dbURL,options,s)
+			results.append((fname,tab,None,s and s.report()))
+		except Exception:
+			results.append((fname,tab,traceback.format_exc(),s and s.report()))
+	return results
 
+def _print_progress(s,event):
+	if event!="progress":
+		return
+	eta=s.eta()
+	sys.stderr.write("%i rows, %.1f MB, %.0f rows/s%s\n"%(
+		s.rows,s.bytes_read/2.0**20,s.rows/max(s.elapsed(),1e-9),
+		", %.0f%% ETA %s"%(100.0*s.bytes_read/s.bytes_total,datetime.timedelta(seconds=int(eta))) if eta!=None else ""))
+
+def _load_file(fname,tab,dbURL,options,stats=None):
+	log_file=None
+	sink=None
+	if options['quarantine']:
+		path=tab+"_rejected.csv"
+		sink=quarantine.quarantine(open(path,"a"),header=not os.path.exists(path))
+	elif options['continue_on_error']:
+		log_file=open(tab+"_errors.log","a")
+		log_file.write(datetime.datetime.now().strftime("----- %Y-%m-%d %H:%M:%S -----\n"))
+
+	delta=None
+	if options['delta']:
+		if not os.path.isdir(options['delta']):
+			os.makedirs(options['delta'])
+		delta=deltamod.snapshot_path(options['delta'],tab,fname)
+
+	fd=sys.stdin if fname=='-' else open(fname,'r')
+	try:
 		gentable.load_to_table(
-			open(fname,'r'),
+			fd,
 			dbURL,
-			sep=sep,
 			tabname=tab,
-			verbose=verbose,
-			continue_on_error=continue_on_error,
 			log_file=log_file,
-			full_file_probe=full_file_probe,
-			maxrows=maxrows
+			stats=stats,
+			**dict(options,quarantine=sink,delta=delta)
 		)
+	finally:
+		if fd!=sys.stdin:
+			fd.close()
+		if log_file:
+			log_file.close()
+		if sink:
+			sink.close()
+
+def _columns(text):
+	"""the column names of a comma separated --index, --primary-key or --key"""
+	return [c.strip() for c in text.split(",") if c.strip()]
+
 def getfuzzy(map,key):
 	keys=[key, gentable._to_tabname(key),key.rsplit("/",1)[-1]]
 	for i in keys:
@@ -72,4 +372,34 @@ def getfuzzy(map,key):
 			return val
 	return gentable._to_tabname(key)
 
-main()
+def _test_arguments():
+	"""
+	>>> import subprocess,tempfile
+	>>> tmp=tempfile.mkdtemp()
+	>>> for name,data in [("a.csv","a,b\\n1,x\\n"),("b.csv","a,b\\n2,y\\n")]:
+	...	with open(os.path.join(tmp,name),"w") as f: f.write(data)
+	>>> def run(*args):
+	...	p=subprocess.Popen([sys.executable,os.path.abspath(__file__),"--database","sqlite:///"+os.path.join(tmp,"db.sqlite")]+list(args),
+	...		cwd=tmp,stdin=subprocess.PIPE,stdout=subprocess.PIPE,stderr=subprocess.PIPE)
+	...	out,err=p.communicate("a,b\\n3,z\\n")
+	...	return p.returncode,(err.strip().split("\\n")[-1] if err else out.strip().split("\\n")[-1])
+	>>> run("--parse-jobs","2","--merge-types","--map","a.csv:t","--map","b.csv:t","a.csv","b.csv")
+	(0, 'Loaded 2 of 2 files')
+	>>> run("--merge-types","--map=-:t","--map","a.csv:t","-","a.csv")
+	(2, 'filetodb.py: error: stdin can not be probed with --merge-types')
+	>>> run("--resume","--checkpoint-rows","10","--map=-:t","-")
+	(2, 'filetodb.py: error: stdin can not be resumed')
+	>>> run("--parse-jobs","2","--map=-:t","-")
+	(2, 'filetodb.py: error: stdin can not be read with --jobs or --parse-jobs')
+	>>> _=subprocess.check_call(["gzip",os.path.join(tmp,"b.csv")])
+	>>> run("--parse-jobs","2","a.csv","b.csv.gz")
+	(2, 'filetodb.py: error: b.csv.gz is a gzip file, compressed files can not be read with --parse-jobs')
+	>>> import shutil; shutil.rmtree(tmp)
+	"""
+
+if __name__ == "__main__":
+	if sys.argv[1:]==["--doctest"]:
+		import doctest
+		doctest.testmod(optionflags=doctest.ELLIPSIS)
+	else:
+		sys.exit(main())
@@ -1,16 +1,27 @@
 #!/usr/bin/env python2
 from datetime import datetime
+import itertools
+import multiprocessing
 import os.path
+import sys
+import time
 import fileprober
 import failtype
 import csvparse
+import bulkload
+import delta as deltamod
+import stats as statsmod
 
 from sqlalchemy import *
+from sqlalchemy import exc, event
 
 
-def load_to_table(fd,dbURL,sep=',', tabname=None,verbose=False, continue_on_error=False, log_file=None, full_file_probe=False, maxrows=10000):
+def load_to_table(fd,dbURL,sep=',', tabname=None,verbose=False, continue_on_error=False, log_file=None, full_file_probe=False, maxrows=10000, batch_size=1000, adaptive_batch=False, bulk=False, parse_jobs=None, parse_ordered=True, probe_window=None, schema_cache=None, confirm_rows=100, checkpoint_rows=None, checkpoint_bytes=None, resume=False, stats=None, pipelined=False, engine=None, known_tables=None, quoting=False, quarantine=None, error_budget=None, sketch=False, enums=False, indexes=None, primary_key=None, suggest_keys=False, delta=None, key_columns=None, delete_removed=False, probed_types=None, encoding=None):
 	"""
-	fd: a file descriptor pointing to the desired csv-file
+	fd: a file descriptor pointing to the desired csv-file, if it is not
+		seekable the column types are probed from the first maxrows rows
+		and the rest is streamed (see csvparse), full_file_probe and enums
+		are then ignored unless the whole stream fitted in those rows
 	dbURL: an url pointing to the desired database,for example "sqlite:///:memory:"
 	sep (default ','): The field sepparator, can not be excaped
 		in any way in the document.
@@ -19,18 +30,159 @@ def load_to_table(fd,dbURL,sep=',', tabname=None,verbose=False, continue_on_erro
 		provided it will be taken from the base-name of the file
 
 	verbose (default False): print more progress info to stdout
+
+	batch_size (default 1000): the number of rows sent to the database
+		in each executemany-call.
+
+	adaptive_batch (default False): let the batch size grow or shrink
+		depending on how long each batch takes to insert, batch_size is
+		then only used as the starting point.
+
+	bulk (default False): use the native bulk load path of the database
+		(see bulkload.py) if there is one, rows rejected by the database
+		will then fail the whole load even if continue_on_error is set.
+
+	parse_jobs (default None): parse and convert the file in this many
+		worker processes, see csvparse.iter_parallel. fd must be a real file.
+
+	parse_ordered (default True): keep the rows in file order when parse_jobs is used.
+
+	probe_window (default None): probe adaptively until all columns have
+		been stable for this many rows instead of using maxrows, see csvparse.
+
+	schema_cache (default None): a schemacache.schemacache to reuse the
+		column types of earlier loads of files with the same header, only
+		confirm_rows rows are then probed (all of them with full_file_probe).
+
+	checkpoint_rows, checkpoint_bytes (default None): commit after every
+		this many rows or bytes of the file instead of loading the whole
+		file in one transaction. Each commit records how far the load
+		has come in the filetodb_checkpoints table of the same database.
+
+	resume (default False): continue a checkpointed load of the same file
+		to the same table from its last checkpoint, fd must be seekable.
+		The checkpoint records the size and mtime of the file, a loaded
+		file that has changed since is loaded again and a half loaded one
+		raises ValueError.
+
+	stats (default None): a stats.stats that gets the timings of the
+		probe, decode, create, insert (or bulk_load, which includes
+		decode) and checkpoint stages, error counts and progress. It is
+		finished when the load is done.
+
+	pipelined (default False): read and decode the file in two background
+		threads while the rows are written to the database, see
+		csvparse.iter_pipelined. Can not be combined with parse_jobs.
+
+	engine (default None): a sqlalchemy engine to use instead of creating
+		one for dbURL, long running callers keep one per database so that
+		its connection pool is reused between files.
+
+	known_tables (default None): a set of the names of tables that are
+		known to exist in the database, they are not checked for or created
+		again. Tables created by the load are added to it.
+
+	quoting (default False): fields may be quoted with " as in RFC4180,
+		see csvparse.
+
+	encoding (default None): the encoding of fd or "auto" to detect it,
+		see csvparse. Without it only files with a UTF-8 BOM are decoded.
+
+	quarantine (default None): a quarantine.quarantine that gets the
+		skipped lines with their line number, offset and reason when
+		continue_on_error is set, instead of or as well as log_file. Rows
+		rejected by the database are written to it as well, with their
+		values joined by sep. It is flushed when the load is done.
+
+	error_budget (default None): a quarantine.budget, the load is aborted
+		with quarantine.ErrorBudgetExceeded and rolled back as soon as
+		more rows than it allows have been skipped or rejected. With
+		checkpoints only the rows since the last checkpoint are rolled back.
+
+	sketch (default False): keep statistics of the probed values (see
+		sketch.columnsketch) and use them for tighter column types:
+		SmallInteger or Integer instead of BigInteger when the values fit,
+		Numeric instead of Float for plain decimals and VARCHARs up to 255
+		instead of Text, see _column_type. With verbose columns with few
+		distinct values are listed as Enum candidates.
+
+	enums (default False): with sketch and full_file_probe, make the
+		Enum candidates Enum columns.
+
+	indexes (default None): a list of indexes to create once the rows are
+		loaded, each a list of column names. Indexes the table already has
+		are left alone.
+
+	primary_key (default None): a list of column names to add a primary
+		key on once the rows are loaded, unless the table already has one.
+		sqlite can not add one to an existing table, it gets a unique index
+		named pk_TABNAME instead. On MySQL the keys of the table are
+		disabled during the load when indexes or primary_key are given.
+
+	suggest_keys (default False): print the columns that look unique in
+		the probed rows, see candidate_keys.
+
+	delta (default None): a path prefix of a snapshot of the previous load
+		of the same file in to the table (see delta.differ and
+		delta.snapshot_path), only the rows that are new since then are
+		inserted and the snapshot is replaced by one of this load once it
+		is commited. Rows the database rejects are left out of the
+		snapshot. Can not be combined with checkpoints.
+
+	key_columns (default None): with delta, the columns identifying a row.
+		Rows with a known key but other values replace the old row (it is
+		deleted and the new one inserted), without key_columns whole rows
+		are compared and changed rows are only inserted. The key columns
+		should be indexed, see indexes and primary_key.
+
+	delete_removed (default False): with delta and key_columns, delete the
+		rows whose keys were in the previous load but not in this one.
+
+	probed_types (default None): {column name: failtype state} to use
+		instead of probing fd, see probe_files.
 	"""
-	engine = create_engine(dbURL)
+	if engine==None:
+		engine=_create_engine(dbURL)
 	metadata = MetaData()
 	
-	assert hasattr(fd,'seek'), "fd has to be seekable"
 	assert tabname or hasattr(fd,'name'), "fd needs to have a .name attribute"
 
-	assert (continue_on_error and log_file) or (not continue_on_error), "You must specify a log file if continuing on errors"
+	assert (continue_on_error and (log_file or quarantine)) or (not continue_on_error), "You must specify a log file if continuing on errors"
 
 	if (tabname ==None):
 		tabname=_to_tabname(fd.name)
 
+	checkpointed=checkpoint_rows or checkpoint_bytes
+	assert checkpointed or not resume, "resuming needs checkpoint_rows or checkpoint_bytes"
+	assert not (checkpointed and parse_jobs), "checkpoints can not be combined with parse_jobs"
+	assert not (pipelined and parse_jobs), "pipelined can not be combined with parse_jobs"
+	assert not enums or (sketch and full_file_probe), "enums needs sketch and full_file_probe"
+	assert not (delta and checkpointed), "delta can not be combined with checkpoints"
+	assert not delete_removed or (delta and key_columns), "delete_removed needs delta and key_columns"
+	if checkpointed:
+		checkpoints=_checkpoint_table(metadata)
+		_create_tables(engine,metadata,known_tables)
+		source=getattr(fd,'name',tabname)
+		signature=_file_signature(fd)
+		state=None
+		if resume:
+			state=engine.execute(checkpoints.select().where(checkpoints.c.tabname==tabname)).fetchone()
+		if state and state.source!=source:
+			raise ValueError("the checkpoint of table %s is for the file %s, not %s"%(tabname,state.source,source))
+		if state and state.signature!=signature:
+			#another file with the same name, its offsets mean nothing
+			if not state.done:
+				raise ValueError("the file %s has changed since the checkpoint of table %s, it can not be resumed"%(source,tabname))
+			if verbose:
+				print "The file:%s has changed since it was loaded to table:%s, loading it again"%(source,tabname)
+			state=None
+		if state and state.done:
+			if verbose:
+				print "Table:%s is already loaded from file:%s"%(tabname,source)
+			return
+		if not state:
+			engine.execute(checkpoints.delete().where(checkpoints.c.tabname==tabname))
+
 	if verbose:
 		print "Loading file:%s to table:%s"%(fd.name,tabname)
 	csv=csvparse.csvparse(
@@ -39,9 +191,34 @@ def load_to_table(fd,dbURL,sep=',', tabname=None,verbose=False, continue_on_erro
 		maxrows=maxrows,
 		verbose=verbose,
 		continue_on_error=continue_on_error,
-		log_file=log_file
+		log_file=log_file,
+		probe_window=probe_window,
+		schema_cache=schema_cache,
+		confirm_rows=maxrows if full_file_probe else confirm_rows,
+		stats=stats,
+		quoting=quoting,
+		quarantine=quarantine,
+		error_budget=error_budget,
+		sketch=sketch or suggest_keys,
+		probed=probed_types,
+		encoding=encoding
 	)
-	typemap={datetime:DateTime, int:BigInteger, float:Float, unicode:String}
+	if full_file_probe and isinstance(csv.fd,fileprober.spooledfile) and not csv.fd.complete:
+		#only the spooled rows of a stream have been probed, size the columns as for a sparse probe
+		if verbose:
+			print "Only the first %i rows of the stream were probed, not the entire file"%(maxrows or 10000)
+		full_file_probe=False
+		enums=False
+	for c in set(sum(indexes or [],[])+(primary_key or [])+(key_columns or [])):
+		if c not in csv.headers:
+			raise ValueError("no column %s to create a key on in the file %s"%(c,getattr(fd,'name',tabname)))
+	if suggest_keys:
+		keys=candidate_keys(csv)
+		print "Candidate keys for table %s: %s"%(tabname,", ".join("%s (~%.0f%% distinct)"%(name,ratio*100) for name,ratio in keys) or "none")
+	if checkpointed and state:
+		if verbose:
+			print "Resuming at row %i (byte %i)"%(state.rows,state.offset)
+		csv.resume(state.offset,state.rows)
 	cols=[]
 
 	for name,t in zip(csv.headers,csv.types):
@@ -49,7 +226,8 @@ def load_to_table(fd,dbURL,sep=',', tabname=None,verbose=False, continue_on_erro
 			t.type
 		except LookupError as e:
 			#If we have read all the file, and received no data, assume it is a short string.. augh..
-			if full_file_probe:
+			#(an adaptive probe never settles on a column without data, so it has read it all too)
+			if full_file_probe or probe_window:
 				if verbose:
 					print "typer %s has not found any data in the entire file, feeding string"%name
 				t.test(u"StR  ")	
@@ -58,47 +236,437 @@ def load_to_table(fd,dbURL,sep=',', tabname=None,verbose=False, continue_on_erro
 				raise LookupError("typer %s threw exception"%name,e)
 
 	for name,t in zip(csv.headers,csv.types):
-		if t.type==str or t.type==unicode:
-			if (t.get_extras()['strsize']> 50):
-				newcol=Column(name, Text)
-			else:
-				#lets be paranoid..
-				if full_file_probe:
-					newcol=Column(name, String(t.get_extras()['strsize']+2))
-				else:
-					newcol=Column(name, String(t.get_extras()['strsize']*2+1))
-		else:
-			newcol=Column(name, typemap[t.type])
-		cols.append(newcol)
+		cols.append(Column(name, _column_type(t,full_file_probe,enums,tight=sketch,enum_name="%s_%s_enum"%(tabname,name))))
+		if verbose and sketch and _enum_candidate(t.sketch):
+			print "column %s has only %i distinct values %s, an Enum candidate"%(name,len(t.sketch.values),sorted(t.sketch.values))
 	table = Table(tabname, metadata, *cols, mysql_charset='utf8')
-	metadata.create_all(engine)
+	if stats:
+		with stats.stage("create"):
+			_create_tables(engine,metadata,known_tables)
+	else:
+		_create_tables(engine,metadata,known_tables)
 
 	if verbose:
 		from pprint import pprint
-		import sys
 		print 'generating:', table
 		pprint(cols)
 	conn=engine.connect()
-	trans=conn.begin()
-	n=0
-	for l in csv:	
-		conn.execute(table.insert(), dict(zip(csv.headers,l)))
-
+	loader=None
+	if bulk:
+		loader=bulkload.get_loader(engine.dialect.name)
 		if verbose:
-			if n>10000:
-				sys.stdout.write('.')
-				sys.stdout.flush()
-				n=0
-			n+=1
-	trans.commit()
+			print "Using %s"%(loader.__class__.__name__ if loader else "generic inserts, no bulk loader for "+engine.dialect.name)
+	if loader:
+		loader.prepare(conn.connection)
+	if parse_jobs:
+		rows=csv.iter_parallel(parse_jobs,ordered=parse_ordered)
+	elif pipelined:
+		rows=csv.iter_pipelined()
+	else:
+		rows=iter(csv)
+	decoded=rows
+	differ=None
+	if delta:
+		differ=deltamod.differ(delta,[csv.headers.index(c) for c in key_columns] if key_columns else None)
+		rows=differ.filter(rows,lambda keys: _delete_keys(conn,table,key_columns,keys))
+	def reject(e,row):
+		values=[row[h] for h in csv.headers]
+		if differ:
+			differ.reject(values)
+		csv.reject(repr(e),
+			sep.join("" if v==None else unicode(v).encode(csv.encoding) if csv.encoding else str(v) for v in values),
+			reason="%s: %s"%(e.orig.__class__.__name__,e.orig),
+			counter="rejected"
+		)
+	def load(rows):
+		if loader:
+			quote=engine.dialect.identifier_preparer
+			start,cpu=time.time(),stats and statsmod.cputime()
+			loader.load(
+				conn.connection,
+				quote.format_table(table),
+				[quote.quote(c.name) for c in cols],
+				[t.type for t in csv.types],
+				rows
+			)
+			if stats:
+				stats.add_time("bulk_load",time.time()-start,statsmod.cputime()-cpu)
+		else:
+			_insert_rows(conn,table,csv.headers,rows,batch_size,adaptive_batch,continue_on_error,reject,verbose,stats)
+	toggle_keys=(indexes or primary_key) and _toggle_keys.get(engine.dialect.name)
+	if toggle_keys:
+		conn.execute(toggle_keys[0]%engine.dialect.identifier_preparer.format_table(table))
+	try:
+		if checkpointed:
+			segments=_segments(rows,csv,checkpoint_rows,checkpoint_bytes)
+			for segment in segments:
+				trans=conn.begin()
+				load(segment)
+				if stats:
+					with stats.stage("checkpoint"):
+						_save_checkpoint(conn,checkpoints,tabname,source,signature,csv,segments.done)
+						trans.commit()
+				else:
+					_save_checkpoint(conn,checkpoints,tabname,source,signature,csv,segments.done)
+					trans.commit()
+				if verbose:
+					print "Checkpoint at row %i (byte %i)"%(csv.rows_read,csv.offset)
+		else:
+			trans=conn.begin()
+			load(rows)
+			if delete_removed:
+				_delete_keys(conn,table,key_columns,differ.removed())
+			trans.commit()
+		if differ:
+			differ.commit()
+	except:
+		if differ:
+			differ.abort()
+		raise
+	finally:
+		if pipelined:
+			decoded.close() #stop the reader and decoder threads
+		if loader:
+			loader.finish(conn.connection)
+		conn.close() #rolls back whatever was not commited
+		if toggle_keys:
+			engine.execute(toggle_keys[1]%engine.dialect.identifier_preparer.format_table(table))
+		if quarantine:
+			quarantine.flush()
+	if indexes or primary_key:
+		if verbose:
+			print "Creating keys on table:%s"%tabname
+		if stats:
+			with stats.stage("index"):
+				_create_keys(engine,table,indexes,primary_key)
+		else:
+			_create_keys(engine,table,indexes,primary_key)
+	if differ:
+		counts=[("new",differ.new),("changed",differ.changed),("unchanged",differ.unchanged),("deleted",differ.deleted),("rejected",differ.rejected)]
+		if stats:
+			for name,n in counts:
+				stats.count("delta_"+name,n)
+		if verbose:
+			print "Delta: "+", ".join("%i %s"%(n,name) for name,n in counts)
+	if stats:
+		stats.finish()
 	if verbose:
 		sys.stdout.write('\n')
 		sys.stdout.flush()
 		print "Done loading table:%s"%(tabname)
 
+_typemap={datetime:DateTime, int:BigInteger, float:Float, unicode:String}
+
+def _column_type(t,full_file_probe=False,enums=False,tight=True,enum_name=None):
+	"""
+	The column type for a failtype. Without a sketch ints are BigInteger,
+	floats Float and strings are sized from strsize, Text if longer than 50.
+
+	With a sketch ints get the smallest integer type holding their range,
+	plain decimals of up to 15 digits are Numeric if the whole file was
+	probed (values with more decimals would be rounded otherwise) and
+	strings are VARCHARs of the longest value, Text only if longer than
+	255. Unless the whole file was probed the ranges are doubled and the
+	lengths as well unless all values had the same length. Enum
+	candidates become Enums named enum_name if enums (PostgreSQL needs
+	a name for the type). The sketch is ignored unless tight.
+	"""
+	s=t.sketch if tight else None
+	if not (s and s.count):
+		if t.type==str or t.type==unicode:
+			if (t.get_extras()['strsize']> 50):
+				return Text
+			#lets be paranoid..
+			if full_file_probe:
+				return String(t.get_extras()['strsize']+2)
+			return String(t.get_extras()['strsize']*2+1)
+		return _typemap[t.type]
+	if t.type==str or t.type==unicode:
+		if enums and _enum_candidate(s):
+			return Enum(*sorted(s.values),name=enum_name)
+		size=s.max_length
+		if not full_file_probe and min(s.lengths)!=size:
+			size=size*2+1
+		return String(size) if size<=255 else Text
+	if t.type==int and s.min!=None:
+		margin=1 if full_file_probe else 2
+		for typ,limit in [(SmallInteger,2**15),(Integer,2**31)]:
+			if -limit<=s.min*margin and s.max*margin<limit:
+				return typ
+		return BigInteger
+	if t.type==float and s.precision!=None and full_file_probe:
+		if s.precision<=15:
+			return Numeric(max(s.precision,1),s.scale,asdecimal=False)
+	return _typemap[t.type]
+
+def _enum_candidate(s,min_repeats=10):
+	"""True if the column has only a few distinct values, each seen min_repeats times on average"""
+	return s.values!=None and len(s.values)>0 and s.count>=min_repeats*len(s.values)
+
+def candidate_keys(csv,min_ratio=0.95):
+	"""
+	The columns of a csvparse probed with sketch that have no NULLs and
+	about as many distinct values as probed values, as a list of (name,
+	estimated fraction of distinct values). The distinct values are
+	estimated with a hyperloglog, within a few percent, and only from the
+	probed rows, so they are candidates and not guarantees.
+	"""
+	keys=[]
+	for name,t in zip(csv.headers,csv.types):
+		s=t.sketch
+		if not s or not s.count or s.nulls or t.type==float:
+			continue
+		ratio=min(1.0,float(s.distinct())/s.count)
+		if ratio>=min_ratio:
+			keys.append((name,ratio))
+	return keys
+
+#statements turning the keys of a table off and on again during a load
+_toggle_keys={
+	'mysql':("ALTER TABLE %s DISABLE KEYS","ALTER TABLE %s ENABLE KEYS"),
+}
+
+def probe_files(fnames,jobs=None,**options):
+	"""
+	Probe several files going to the same table in a pool of jobs
+	processes (default one per cpu, 1 probes them one after another) and
+	merge their column types, so that one table fits all of them. options
+	are passed on to csvparse (sep, maxrows, probe_window, quoting,
+	sketch...).
+
+	returns {column name: failtype state}, to pass as probed_types to
+	load_to_table for each of the files.
+	"""
+	work=[(fname,options) for fname in fnames]
+	if jobs==1 or len(work)<2:
+		return merge_types(itertools.imap(_probe_file,work))
+	pool=multiprocessing.Pool(min(jobs or multiprocessing.cpu_count(),len(work)))
+	try:
+		return merge_types(pool.imap_unordered(_probe_file,work))
+	finally:
+		pool.close()
+		pool.join()
+
+def _probe_file(work):
+	"""Worker for probe_files, the [(column name,failtype state)] of a file"""
+	fname,options=work
+	with open(fname,'rb') as fd:
+		csv=csvparse.csvparse(fd,**options)
+		return [(name,t.get_state()) for name,t in zip(csv.headers,csv.types)]
+
+def merge_types(probes):
+	"""
+	Merge the [(column name,failtype state)] of several probes (in any
+	order) to {column name: failtype state}, see failtype.merge
+	"""
+	typers={}
+	for columns in probes:
+		for name,state in columns:
+			t=failtype.failtype(sketch=state.get('sketch')!=None)
+			t.set_state(state)
+			if name in typers:
+				typers[name].merge(t)
+			else:
+				typers[name]=t
+	return dict((name,t.get_state()) for name,t in typers.items())
+
+def _create_keys(engine,table,indexes=None,primary_key=None):
+	"""
+	Create the indexes and the primary key of load_to_table once the rows
+	are in, skipping those the table already has.
+	"""
+	insp=inspect(engine)
+	existing=[i['column_names'] for i in insp.get_indexes(table.name)]
+	if primary_key:
+		if engine.dialect.name=='sqlite':
+			if primary_key not in existing:
+				Index("pk_%s"%table.name,*[table.c[c] for c in primary_key],unique=True).create(engine)
+		elif not insp.get_pk_constraint(table.name)['constrained_columns']:
+			quote=engine.dialect.identifier_preparer
+			engine.execute("ALTER TABLE %s ADD PRIMARY KEY (%s)"%(quote.format_table(table),", ".join(quote.quote(c) for c in primary_key)))
+	for cols in indexes or []:
+		if cols not in existing:
+			Index("ix_%s_%s"%(table.name,"_".join(cols)),*[table.c[c] for c in cols]).create(engine)
+			existing.append(cols)
+
+def _delete_keys(conn,table,key_columns,keys,batch_size=1000):
+	"""delete the rows with the given key_columns values (tuples), batch_size at a time"""
+	stmt=table.delete().where(and_(*[table.c[c]==bindparam("key_%i"%n) for n,c in enumerate(key_columns)]))
+	batch=[]
+	for key in keys:
+		batch.append(dict(("key_%i"%n,v) for n,v in enumerate(key)))
+		if len(batch)>=batch_size:
+			conn.execute(stmt,batch)
+			batch=[]
+	if batch:
+		conn.execute(stmt,batch)
+
+def _insert_rows(conn,table,headers,rows,batch_size,adaptive_batch=False,continue_on_error=False,reject=None,verbose=False,stats=None):
+	"""
+	The generic, dialect independent, way of inserting the rows of a csvparse
+	"""
+	sizer=_batchsizer(batch_size,adaptive=adaptive_batch)
+	insert=table.insert()
+	n=0
+	batch=[]
+	for l in rows:
+		batch.append(dict(zip(headers,l)))
+		if len(batch)>=sizer.size:
+			n+=_insert_batch(conn,insert,batch,sizer,continue_on_error,reject,stats)
+			batch=[]
+			if verbose and n>10000:
+				sys.stdout.write('.')
+				sys.stdout.flush()
+				n=0
+	if batch:
+		_insert_batch(conn,insert,batch,sizer,continue_on_error,reject,stats)
+
+def _create_tables(engine,metadata,known_tables=None):
+	"""create_all, unless all the tables are in known_tables"""
+	if known_tables!=None and all(name in known_tables for name in metadata.tables):
+		return
+	metadata.create_all(engine)
+	if known_tables!=None:
+		known_tables.update(metadata.tables)
+
+def _checkpoint_table(metadata):
+	"""the table keeping track of how far each checkpointed load has come"""
+	return Table('filetodb_checkpoints', metadata,
+		Column('tabname', String(255), primary_key=True),
+		Column('source', String(1024)),
+		Column('signature', String(64)),
+		Column('offset', BigInteger),
+		Column('rows', BigInteger),
+		Column('done', Boolean),
+		Column('updated', DateTime)
+	)
+
+def _file_signature(fd):
+	"""the size and mtime of the file fd as a string, None if it is not a file"""
+	try:
+		st=os.fstat(fd.fileno())
+	except (AttributeError,EnvironmentError,ValueError):
+		return None
+	return "%i:%.6f"%(st.st_size,st.st_mtime)
+
+def _save_checkpoint(conn,checkpoints,tabname,source,signature,csv,done):
+	"""record the position of csv, in the callers transaction"""
+	conn.execute(checkpoints.delete().where(checkpoints.c.tabname==tabname))
+	conn.execute(checkpoints.insert(),
+		tabname=tabname,
+		source=source,
+		signature=signature,
+		offset=csv.offset,
+		rows=csv.rows_read,
+		done=done,
+		updated=datetime.now()
+	)
+
+class _segments(object):
+	"""
+	Split the rows of a csvparse in to consecutive segments that ends after
+	checkpoint_rows rows or checkpoint_bytes bytes, whichever comes first.
+	done is set once the rows are exhausted, there is always at least one
+	segment so that an empty file is marked as done as well.
+	"""
+	def __init__(self,rows,csv,checkpoint_rows=None,checkpoint_bytes=None):
+		self._rows=iter(rows)
+		self._csv=csv
+		self.checkpoint_rows=checkpoint_rows
+		self.checkpoint_bytes=checkpoint_bytes
+		self.done=False
+
+	def __iter__(self):
+		while not self.done:
+			yield self._segment()
+
+	def _segment(self):
+		start_rows,start_offset=self._csv.rows_read,self._csv.offset
+		for r in self._rows:
+			yield r
+			if self.checkpoint_rows and self._csv.rows_read-start_rows>=self.checkpoint_rows:
+				return
+			if self.checkpoint_bytes and self._csv.offset-start_offset>=self.checkpoint_bytes:
+				return
+		self.done=True
+
+class _batchsizer(object):
+	"""
+	Keeps track of how many rows to send in each batch.
+
+	If adaptive the size is doubled while batches are faster than
+	target_time/2 and halved when they are slower than target_time*2.
+	"""
+	def __init__(self,size,adaptive=False,target_time=0.5,minsize=50,maxsize=100000):
+		assert size>0, "batch size must be positive"
+		self.size=size
+		self.adaptive=adaptive
+		self.target_time=target_time
+		self.minsize=minsize
+		self.maxsize=maxsize
+
+	def update(self,rows,elapsed):
+		if not self.adaptive or rows<self.size:
+			return
+		if elapsed<self.target_time/2:
+			self.size=min(self.size*2,self.maxsize)
+		elif elapsed>self.target_time*2:
+			self.size=max(self.size/2,self.minsize)
+
+def _insert_batch(conn,insert,batch,sizer,continue_on_error=False,reject=None,stats=None):
+	"""
+	Insert a list of row-dicts with a single executemany.
+
+	If continue_on_error is set a failing batch is rolled back and retried
+	row by row so that only the offending rows are dropped, and passed to
+	reject(exception,row).
+	returns the number of rows in the batch
+	"""
+	start,cpu=time.time(),stats and statsmod.cputime()
+	if not continue_on_error:
+		conn.execute(insert,batch)
+	else:
+		savepoint=conn.begin_nested()
+		try:
+			conn.execute(insert,batch)
+			savepoint.commit()
+		except exc.DBAPIError:
+			savepoint.rollback()
+			for row in batch:
+				savepoint=conn.begin_nested()
+				try:
+					conn.execute(insert,row)
+					savepoint.commit()
+				except exc.DBAPIError as e:
+					savepoint.rollback()
+					reject(e,row)
+	sizer.update(len(batch),time.time()-start)
+	if stats:
+		stats.add_time("insert",time.time()-start,statsmod.cputime()-cpu)
+	return len(batch)
+
+def _create_engine(dbURL):
+	"""
+	create_engine wrapper, for sqlite the pysqlite driver is told to keep
+	its hands off the transactions as it otherwise breaks SAVEPOINTs.
+	"""
+	engine=create_engine(dbURL)
+	if engine.dialect.name=='sqlite':
+		@event.listens_for(engine,"connect")
+		def _no_pysqlite_begin(dbapi_connection,connection_record):
+			dbapi_connection.isolation_level=None
+
+		@event.listens_for(engine,"begin")
+		def _explicit_begin(conn):
+			conn.execute("BEGIN")
+	return engine
+
 def _to_tabname(s):
-	"strip direcotry and ext-part of a file name"
-	return os.path.splitext(os.path.basename(s))[0]
+	"strip direcotry and ext-part of a file name, foo/bar.csv.gz becomes bar"
+	name,ext=os.path.splitext(os.path.basename(s))
+	if ext in ('.gz','.bz2','.xz'):
+		name=os.path.splitext(name)[0]
+	return name
 
 def _test_singlecol():
    '''
@@ -159,6 +727,429 @@ def _test_UTF():
 	>>> fd.name="utf_string_io"
 	>>> load_to_table(fd,"sqlite:////tmp/gentable_testtable.sqlite")
    '''
+def _test_encoding():
+   '''
+   >>> from StringIO import StringIO as sIO
+	>>> text=u"id,name"+chr(10)+chr(10).join(u"%i,\\xe5\\u20ac%i"%(i,i) for i in range(50))
+	>>> engine=create_engine("sqlite:////tmp/gentable_testtable.sqlite")
+	>>> _=engine.execute('DROP TABLE IF EXISTS cp1252_feed;')
+	>>> fd=sIO(text.encode("cp1252"))
+	>>> fd.name="cp1252_feed"
+	>>> load_to_table(fd,None,engine=engine,encoding="auto")
+	>>> engine.execute("select name from cp1252_feed where id=7;").fetchall()
+	[(u'\\xe5\\u20ac7',)]
+	>>> _=engine.execute('DROP TABLE cp1252_feed;')
+   '''
+
+def _test_sketch():
+   '''
+   >>> from StringIO import StringIO as sIO
+	>>> heads="small,medium,price,code,note,kind"
+	>>> kinds=["red","green","blue"]
+	>>> lines=["%i,%i,%i.%02i,AB%03i,%s,%s"%(i,i*1000,i,i%100,i,"x"*(i%7+1),kinds[i%3]) for i in range(200)]
+	>>> engine=create_engine("sqlite:////tmp/gentable_testtable.sqlite")
+	>>> _=engine.execute('DROP TABLE IF EXISTS sketched;')
+	>>> fd=sIO(heads+chr(10)+chr(10).join(lines))
+	>>> fd.name="sketched"
+	>>> load_to_table(fd,"sqlite:////tmp/gentable_testtable.sqlite",sketch=True,maxrows=50)
+	>>> [str(c.type) for c in Table("sketched",MetaData(),autoload=True,autoload_with=engine).columns]
+	['SMALLINT', 'INTEGER', 'FLOAT', 'VARCHAR(5)', 'VARCHAR(15)', 'VARCHAR(11)']
+	>>> _=engine.execute('DROP TABLE sketched;')
+	>>> fd.seek(0)
+	>>> load_to_table(fd,"sqlite:////tmp/gentable_testtable.sqlite",sketch=True,full_file_probe=True,enums=True)
+	>>> t=Table("sketched",MetaData(),autoload=True,autoload_with=engine)
+	>>> [str(c.type) for c in t.columns]
+	['SMALLINT', 'INTEGER', 'NUMERIC(5, 2)', 'VARCHAR(5)', 'VARCHAR(7)', 'VARCHAR(5)']
+	>>> engine.execute("insert into sketched (kind) values ('pink')")
+	Traceback (most recent call last):
+	...
+	IntegrityError: (sqlite3.IntegrityError) CHECK constraint failed: ...
+	>>> engine.execute("select * from sketched;").fetchall()[-1]
+	(199, 199000, 199.99, u'AB199', u'xxxx', u'green')
+	>>> _=engine.execute('DROP TABLE sketched;')
+
+	Only the spooled rows of a stream are probed, so it is sized as a sparse probe
+	>>> r,w=os.pipe()
+	>>> _=os.write(w,heads+chr(10)+chr(10).join(lines)+chr(10))
+	>>> os.close(w)
+	>>> load_to_table(os.fdopen(r),"sqlite:////tmp/gentable_testtable.sqlite",tabname="sketched",sketch=True,full_file_probe=True,enums=True,maxrows=50)
+	>>> [str(c.type) for c in Table("sketched",MetaData(),autoload=True,autoload_with=engine).columns]
+	['SMALLINT', 'INTEGER', 'FLOAT', 'VARCHAR(5)', 'VARCHAR(15)', 'VARCHAR(11)']
+	>>> engine.execute("select count(*) from sketched;").scalar()
+	200
+
+	The enum gets a name, PostgreSQL can not create it without one
+	>>> from sqlalchemy.schema import CreateTable
+	>>> from sqlalchemy.dialects import postgresql
+	>>> fd.seek(0)
+	>>> kind=csvparse.csvparse(fd,maxrows=False,sketch=True).types[5]
+	>>> table=Table("sketched",MetaData(),Column("kind",_column_type(kind,True,True,enum_name="sketched_kind_enum")))
+	>>> str(CreateTable(table).compile(dialect=postgresql.dialect())).split()
+	['CREATE', 'TABLE', 'sketched', '(', 'kind', 'sketched_kind_enum', ')']
+	>>> _=engine.execute('DROP TABLE sketched;')
+   '''
+
+def _test_keys():
+   '''
+   >>> from StringIO import StringIO as sIO
+	>>> engine=create_engine("sqlite:////tmp/gentable_testtable.sqlite")
+	>>> _=engine.execute('DROP TABLE IF EXISTS keyed;')
+	>>> def keyed(n):
+	...	fd=sIO("id,grp,name"+chr(10)+chr(10).join("%i,%i,n%i"%(i,i%10,i) for i in range(n,n+500)))
+	...	fd.name="keyed"
+	...	return fd
+	>>> statements=[]
+	>>> event.listen(engine,"before_cursor_execute",lambda conn,cursor,stmt,*args: statements.append(str(stmt.split()[0])))
+	>>> load_to_table(keyed(0),None,engine=engine,indexes=[["grp"],["grp","name"]],primary_key=["id"],suggest_keys=True)
+	Candidate keys for table keyed: id (~...% distinct), name (~...% distinct)
+	>>> statements[statements.index("INSERT"):]
+	['INSERT', 'PRAGMA', 'PRAGMA', 'CREATE', 'CREATE', 'CREATE']
+	>>> sorted((i['name'],i['column_names'],i['unique']) for i in inspect(engine).get_indexes("keyed"))
+	[(u'ix_keyed_grp', [u'grp'], 0), (u'ix_keyed_grp_name', [u'grp', u'name'], 0), (u'pk_keyed', [u'id'], 1)]
+
+	A second load only adds the rows, the keys are already there
+	>>> del statements[:]
+	>>> load_to_table(keyed(500),None,engine=engine,indexes=[["grp"]],primary_key=["id"])
+	>>> "CREATE" in statements, engine.execute("select count(*) from keyed;").fetchall()
+	(False, [(1000,)])
+	>>> load_to_table(keyed(0),None,engine=engine,primary_key=["id"])
+	Traceback (most recent call last):
+	...
+	IntegrityError: (sqlite3.IntegrityError) UNIQUE constraint failed: keyed.id...
+	>>> load_to_table(keyed(0),None,engine=engine,indexes=[["nope"]])
+	Traceback (most recent call last):
+	...
+	ValueError: no column nope to create a key on in the file keyed
+	>>> _=engine.execute('DROP TABLE keyed;')
+   '''
+
+def _test_delta():
+   '''
+   >>> from StringIO import StringIO as sIO
+	>>> import tempfile, shutil
+	>>> tmp=tempfile.mkdtemp()
+	>>> engine=_create_engine("sqlite:////tmp/gentable_testtable.sqlite")
+	>>> _=engine.execute('DROP TABLE IF EXISTS delta_feed;')
+	>>> def feed(rows,source="feed.csv",**options):
+	...	fd=sIO("id,name,price"+chr(10)+chr(10).join("%i,%s,%s"%r for r in rows))
+	...	fd.name=source
+	...	s=statsmod.stats()
+	...	load_to_table(fd,None,engine=engine,tabname="delta_feed",delta=deltamod.snapshot_path(tmp,"delta_feed",source),stats=s,**options)
+	...	return [s.counters["delta_"+c] for c in ["new","changed","unchanged","deleted","rejected"]]
+	>>> day1=[(i,"n%i"%i,"%i.5"%i) for i in range(1000)]
+	>>> feed(day1,key_columns=["id"],primary_key=["id"])
+	[1000, 0, 0, 0, 0]
+
+	The next day two rows are changed, one added and one removed
+	>>> day2=day1[1:]+[(1000,"new","1.5")]
+	>>> day2[10]=(11,"changed","11.5")
+	>>> day2[500]=(501,"n501","0.25")
+	>>> feed(day2,key_columns=["id"],delete_removed=True)
+	[1, 2, 997, 1, 0]
+	>>> engine.execute("select count(*),sum(id) from delta_feed;").fetchall()
+	[(1000, 500500)]
+	>>> engine.execute("select * from delta_feed where id in (11,501,1000) order by id;").fetchall()
+	[(11, u'changed', 11.5), (501, u'n501', 0.25), (1000, u'new', 1.5)]
+
+	A failed load keeps the previous snapshot
+	>>> feed(day2[:500]+[(2000,"x","abc")]+day2[500:],key_columns=["id"],maxrows=100)
+	Traceback (most recent call last):
+	...
+	ValueError: ...abc...
+	>>> feed(day2,key_columns=["id"])
+	[0, 0, 1000, 0, 0]
+
+	Another file loaded in to the same table has its own snapshot, a row
+	the database rejects is left out of it and tried again the next time
+	>>> extra=[(2000,"x","1.5"),(5,"dup","1.5")]
+	>>> feed(extra,"extra.csv",key_columns=["id"],delete_removed=True,continue_on_error=True,log_file=sIO())
+	[2, 0, 0, 0, 1]
+	>>> feed(extra,"extra.csv",key_columns=["id"],delete_removed=True,continue_on_error=True,log_file=sIO())
+	[1, 0, 1, 0, 1]
+	>>> feed(day2,key_columns=["id"],delete_removed=True)
+	[0, 0, 1000, 0, 0]
+	>>> engine.execute("select count(*) from delta_feed;").fetchall()
+	[(1001,)]
+	>>> len(os.listdir(tmp))
+	4
+
+	Without keys whole rows are compared, loading both files again adds nothing
+	>>> _=engine.execute('DROP TABLE delta_feed;')
+	>>> shutil.rmtree(tmp); tmp=tempfile.mkdtemp()
+	>>> for i in range(2):
+	...	feed(day1[:10],"a.csv"), feed(day1[10:20],"b.csv")
+	([10, 0, 0, 0, 0], [10, 0, 0, 0, 0])
+	([0, 0, 10, 0, 0], [0, 0, 10, 0, 0])
+	>>> engine.execute("select count(*) from delta_feed;").fetchall()
+	[(20,)]
+	>>> _=engine.execute('DROP TABLE delta_feed;')
+	>>> shutil.rmtree(tmp)
+   '''
+
+def _test_probe_files():
+   '''
+	A week of files where the price is an int on some days, where one day
+	has a longer name and one has a name that looks like a number
+	>>> import tempfile, shutil
+	>>> tmp=tempfile.mkdtemp()
+	>>> days=[[(i,"n%i"%i,"%i"%i) for i in range(100)] for d in range(7)]
+	>>> days[2][5]=(5,"a longer name","5.25")
+	>>> days[4][7]=(7,"12345678901234","7.5")
+	>>> days[6]=[(i,"1%i"%i,"%i"%i) for i in range(100)]
+	>>> fnames=[]
+	>>> for d,rows in enumerate(days):
+	...	fnames.append(os.path.join(tmp,"week_%i.csv"%d))
+	...	with open(fnames[-1],"w") as f:
+	...		f.write("id,name,price"+chr(10)+"".join("%i,%s,%s"%r+chr(10) for r in rows))
+	>>> types=probe_files(fnames,jobs=3,sketch=True)
+	>>> t=failtype.failtype(sketch=True)
+	>>> t.set_state(types["price"])
+	>>> t.type, t.sketch.count, t.sketch.max
+	(<type 'float'>, 700, 99)
+	>>> t.set_state(types["name"])
+	>>> t.type, t.extras["strsize"]
+	(<type 'str'>, 14)
+	>>> probe_files(fnames[:1])["price"]["candidates"]
+	['float', 'int']
+
+	The files are loaded in to one table with the merged types
+	>>> engine=create_engine("sqlite:////tmp/gentable_testtable.sqlite")
+	>>> _=engine.execute('DROP TABLE IF EXISTS week;')
+	>>> for fname in fnames:
+	...	with open(fname) as fd:
+	...		load_to_table(fd,None,engine=engine,tabname="week",probed_types=types)
+	>>> [(c.name,str(c.type)) for c in Table("week",MetaData(),autoload=True,autoload_with=engine).columns]
+	[('id', 'BIGINT'), ('name', 'VARCHAR(29)'), ('price', 'FLOAT')]
+	>>> engine.execute("select count(*),sum(price) from week;").fetchall()
+	[(700, 34650.75)]
+	>>> _=engine.execute('DROP TABLE week;')
+	>>> shutil.rmtree(tmp)
+   '''
+
+def _test_batched():
+   '''
+   >>> from StringIO import StringIO as sIO
+   >>> fd=sIO("colA,colB"+chr(10)+chr(10).join("%i,x%i"%(i,i) for i in range(1000)))
+	>>> fd.name="batched_stringio"
+	>>> load_to_table(fd,"sqlite:////tmp/gentable_testtable.sqlite",batch_size=7,adaptive_batch=True)
+	>>> import sqlite3
+	>>> db=sqlite3.connect("/tmp/gentable_testtable.sqlite")
+	>>> db.execute('select count(*),sum(colA) from batched_stringio;').fetchall()
+	[(1000, 499500)]
+	>>> _=db.execute('DROP table batched_stringio;')
+   '''
+
+def _test_batch_rowfail():
+   '''
+   >>> from StringIO import StringIO as sIO
+	>>> import sqlite3
+	>>> db=sqlite3.connect("/tmp/gentable_testtable.sqlite")
+	>>> _=db.execute('DROP TABLE IF EXISTS rowfail;')
+	>>> _=db.execute('CREATE TABLE rowfail (colA BIGINT);')
+	>>> _=db.execute("CREATE TRIGGER rowfail_seven BEFORE INSERT ON rowfail WHEN new.colA=7 BEGIN SELECT RAISE(ABORT,'seven'); END;")
+	>>> db.commit()
+   >>> fd=sIO("colA"+chr(10)+chr(10).join(str(i) for i in range(20)))
+	>>> fd.name="rowfail"
+	>>> elog=sIO()
+	>>> load_to_table(fd,"sqlite:////tmp/gentable_testtable.sqlite",batch_size=5,continue_on_error=True,log_file=elog)
+	>>> db.execute('select count(*) from rowfail;').fetchall()[0][0]
+	19
+	>>> print elog.getvalue()
+	IntegrityError('(sqlite3.IntegrityError) seven',)
+	----------
+	<BLANKLINE>
+   '''
+
+def _test_quarantine():
+   '''
+   >>> from StringIO import StringIO as sIO
+	>>> import quarantine
+	>>> engine=create_engine("sqlite:////tmp/gentable_testtable.sqlite")
+	>>> _=engine.execute('DROP TABLE IF EXISTS quarantined;')
+	>>> _=engine.execute('CREATE TABLE quarantined (colA BIGINT, colB VARCHAR(10));')
+	>>> _=engine.execute("CREATE TRIGGER quarantined_seven BEFORE INSERT ON quarantined WHEN new.colA=7 BEGIN SELECT RAISE(ABORT,'seven'); END;")
+	>>> lines=["%i,x%i"%(i,i) for i in range(300)]
+	>>> lines[2]="2,x,y"
+	>>> fd=sIO("colA,colB"+chr(10)+chr(10).join(lines))
+	>>> fd.name="quarantined"
+	>>> out=sIO()
+	>>> load_to_table(fd,"sqlite:////tmp/gentable_testtable.sqlite",batch_size=5,continue_on_error=True,quarantine=quarantine.quarantine(out))
+	>>> engine.execute('select count(*) from quarantined;').fetchall()
+	[(298,)]
+	>>> print out.getvalue()
+	line,offset,reason,raw
+	4,20,"3 columns, expected 2","2,x,y"
+	,,IntegrityError: seven,"7,x7"
+	<BLANKLINE>
+
+	Going over the error budget rolls back the whole load
+	>>> lines=[l if i%20 else "%i;x"%i for i,l in enumerate(lines)]
+	>>> fd=sIO("colA,colB"+chr(10)+chr(10).join(lines))
+	>>> fd.name="quarantined"
+	>>> load_to_table(fd,"sqlite:////tmp/gentable_testtable.sqlite",continue_on_error=True,quarantine=quarantine.quarantine(sIO()),error_budget=quarantine.parse_budget("5%"))
+	Traceback (most recent call last):
+	...
+	ErrorBudgetExceeded: 7 of 101 rows were bad, the error budget is 5%
+	>>> engine.execute('select count(*) from quarantined;').fetchall()
+	[(298,)]
+	>>> _=engine.execute('DROP table quarantined;')
+   '''
+
+def _test_bulk():
+   '''
+   >>> from StringIO import StringIO as sIO
+	>>> heads="isint,isfloat,isstr,isdate"
+	>>> lines=["%i,%i.%i,foobar,2015-01-%i 10:10:10"%(i,i,i,i+1) for i in range(29)]
+   >>> fd=sIO(heads+chr(10)+chr(10).join(lines))
+	>>> fd.name="bulk_stringio"
+	>>> load_to_table(fd,"sqlite:////tmp/gentable_testtable.sqlite",bulk=True)
+	>>> engine=create_engine("sqlite:////tmp/gentable_testtable.sqlite")
+	>>> t=Table("bulk_stringio",MetaData(),autoload=True,autoload_with=engine)
+	>>> engine.execute(t.select()).fetchall()[-1]
+	(28, 28.28, u'foobar', datetime.datetime(2015, 1, 29, 10, 10, 10))
+	>>> _=engine.execute('DROP table bulk_stringio;')
+   '''
+
+def _test_parse_jobs():
+   '''
+	>>> testfile="/tmp/gentable_parse_jobs.csv"
+	>>> f=open(testfile,"w")
+	>>> f.write("isint,isstr"+chr(10)+chr(10).join("%i,foo%i"%(i,i) for i in range(3000)))
+	>>> f.close()
+	>>> load_to_table(open(testfile),"sqlite:////tmp/gentable_testtable.sqlite",parse_jobs=2,parse_ordered=False)
+	>>> import sqlite3
+	>>> db=sqlite3.connect("/tmp/gentable_testtable.sqlite")
+	>>> db.execute('select count(*),sum(isint) from gentable_parse_jobs;').fetchall()
+	[(3000, 4498500)]
+	>>> _=db.execute('DROP table gentable_parse_jobs;')
+	>>> os.remove(testfile)
+   '''
+
+def _test_stats():
+   '''
+   >>> from StringIO import StringIO as sIO
+	>>> import stats as statsmod
+   >>> fd=sIO("colA,colB"+chr(10)+chr(10).join("%i,x%i"%(i,i) for i in range(3000))+chr(10)+"x,y,z"+chr(10)+"1,x")
+	>>> fd.name="stats_stringio"
+	>>> s=statsmod.stats()
+	>>> done=[]
+	>>> s.add_hook(lambda st,event: event=="done" and done.append(st.rows))
+	>>> load_to_table(fd,"sqlite:////tmp/gentable_testtable.sqlite",batch_size=500,continue_on_error=True,log_file=sIO(),stats=s)
+	>>> r=s.report()
+	>>> sorted(r["stages"]), r["stages"]["insert"]["calls"], sorted(r["counters"].items()), done
+	(['create', 'decode', 'insert', 'probe'], 7, [('errors', 1), ('mismatches', 1)], [3001])
+	>>> _=create_engine("sqlite:////tmp/gentable_testtable.sqlite").execute('DROP table stats_stringio;')
+   '''
+
+def _test_pipelined():
+   '''
+	>>> testfile="/tmp/gentable_pipelined.csv"
+	>>> f=open(testfile,"w")
+	>>> f.write("colA,colB"+chr(10)+chr(10).join("%i,x%i"%(i,i) for i in range(5000)))
+	>>> f.close()
+	>>> db="sqlite:////tmp/gentable_testtable.sqlite"
+	>>> engine=create_engine(db)
+	>>> _=engine.execute('DROP TABLE IF EXISTS gentable_pipelined;')
+	>>> load_to_table(open(testfile),db,pipelined=True,checkpoint_rows=1500)
+	>>> engine.execute('select count(*),sum(colA) from gentable_pipelined;').fetchall()
+	[(5000, 12497500)]
+	>>> engine.execute("select offset,rows from filetodb_checkpoints where tabname='gentable_pipelined';").fetchall()==[(os.path.getsize(testfile),5000)]
+	True
+
+	Errors in the writer stop the pipeline and are raised as usual
+	>>> _=engine.execute("CREATE TRIGGER pipelined_fail BEFORE INSERT ON gentable_pipelined WHEN new.colA=4321 BEGIN SELECT RAISE(ABORT,'no'); END;")
+	>>> load_to_table(open(testfile),db,pipelined=True)
+	Traceback (most recent call last):
+	...
+	IntegrityError: (sqlite3.IntegrityError) no...
+	>>> engine.execute('select count(*) from gentable_pipelined;').fetchall()
+	[(5000,)]
+	>>> _=engine.execute('DROP table gentable_pipelined;')
+	>>> os.remove(testfile)
+   '''
+
+def _test_known_tables():
+   '''
+   >>> from StringIO import StringIO as sIO
+	>>> engine=_create_engine("sqlite:////tmp/gentable_testtable.sqlite")
+	>>> _=engine.execute('DROP TABLE IF EXISTS known_stringio;')
+	>>> known=set()
+	>>> statements=[]
+	>>> event.listen(engine,"before_cursor_execute",lambda conn,cursor,stmt,*args: statements.append(str(stmt.split()[0])))
+	>>> for i in range(2):
+	...	fd=sIO("colA"+chr(10)+chr(10).join(str(i) for i in range(10)))
+	...	fd.name="known_stringio"
+	...	load_to_table(fd,None,engine=engine,known_tables=known)
+	>>> known
+	set(['known_stringio'])
+	>>> statements
+	['PRAGMA', 'PRAGMA', 'CREATE', 'BEGIN', 'INSERT', 'BEGIN', 'INSERT']
+	>>> engine.execute('select count(*) from known_stringio;').fetchall()
+	[(20,)]
+	>>> _=engine.execute('DROP table known_stringio;')
+   '''
+
+def _test_checkpoints():
+   '''
+	>>> testfile="/tmp/gentable_checkpoints.csv"
+	>>> f=open(testfile,"w")
+	>>> f.write("colA,colB"+chr(10)+chr(10).join("%i,x%i"%(i,i) for i in range(100)))
+	>>> f.close()
+	>>> db="sqlite:////tmp/gentable_testtable.sqlite"
+	>>> engine=create_engine(db)
+	>>> _=engine.execute('DROP TABLE IF EXISTS gentable_checkpoints;')
+	>>> _=engine.execute('DROP TABLE IF EXISTS filetodb_checkpoints;')
+
+	A load that dies after 35 rows has committed the first 30 of them
+	>>> def dying(rows):
+	...	for n,r in enumerate(rows):
+	...		if n==35:
+	...			raise IOError("crash")
+	...		yield r
+	>>> real_iter=csvparse.csvparse.__iter__
+	>>> csvparse.csvparse.__iter__=lambda self: dying(real_iter(self))
+	>>> load_to_table(open(testfile),db,checkpoint_rows=10)
+	Traceback (most recent call last):
+	...
+	IOError: crash
+	>>> csvparse.csvparse.__iter__=real_iter
+	>>> engine.execute('select count(*) from gentable_checkpoints;').fetchall()
+	[(30,)]
+	>>> engine.execute("select rows,done from filetodb_checkpoints where tabname='gentable_checkpoints';").fetchall()
+	[(30, 0)]
+
+	Resuming continues from there, and a second resume has nothing to do
+	>>> load_to_table(open(testfile),db,checkpoint_bytes=100,resume=True)
+	>>> engine.execute('select count(*),sum(colA) from gentable_checkpoints;').fetchall()
+	[(100, 4950)]
+	>>> engine.execute("select rows,done from filetodb_checkpoints where tabname='gentable_checkpoints';").fetchall()
+	[(100, 1)]
+	>>> load_to_table(open(testfile),db,checkpoint_rows=10,resume=True)
+	>>> engine.execute('select count(*) from gentable_checkpoints;').fetchall()
+	[(100,)]
+
+	The next file with the same name is loaded, not skipped, and a
+	changed file is not resumed at the offset of the old one
+	>>> f=open(testfile,"w")
+	>>> f.write("colA,colB"+chr(10)+chr(10).join("%i,y%i"%(i,i) for i in range(1000,1050)))
+	>>> f.close()
+	>>> load_to_table(open(testfile),db,checkpoint_rows=10,resume=True,verbose=True)
+	The file:/tmp/gentable_checkpoints.csv has changed since it was loaded to table:gentable_checkpoints, loading it again
+	...
+	>>> engine.execute('select count(*),sum(colA) from gentable_checkpoints;').fetchall()
+	[(150, 56175)]
+	>>> _=engine.execute("update filetodb_checkpoints set done=0 where tabname='gentable_checkpoints';")
+	>>> f=open(testfile,"a")
+	>>> f.write(chr(10)+"2000,z")
+	>>> f.close()
+	>>> load_to_table(open(testfile),db,checkpoint_rows=10,resume=True)
+	Traceback (most recent call last):
+	...
+	ValueError: the file /tmp/gentable_checkpoints.csv has changed since the checkpoint of table gentable_checkpoints, it can not be resumed
+	>>> _=engine.execute('DROP table gentable_checkpoints;')
+	>>> os.remove(testfile)
+   '''
+
 if __name__ == "__main__":
 	import doctest
 	doctest.testmod(optionflags=doctest.ELLIPSIS)
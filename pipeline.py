@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+import doctest
+import sys
+import threading
+import Queue
+
+class _failure(object):
+	"""An exception raised in a stage, re-raised with its traceback in the consumer"""
+	def __init__(self,exc_info):
+		self.exc_info=exc_info
+
+_done=object()
+
+def threaded(source,queue_size=8,name=None):
+	"""
+	Itterate over source in a background thread and yield its items through
+	a queue of at most queue_size items, so the producer never runs more
+	than queue_size items ahead of the consumer.
+
+	Exceptions in the producer are raised in the consumer. If the consumer
+	stops early (the generator is closed or an exception is raised while
+	consuming it) the producer is stopped as well, and source is closed.
+	Stages are chained by giving one threaded() generator as the source of
+	the next.
+	"""
+	queue=Queue.Queue(queue_size)
+	stop=threading.Event()
+
+	def put(item):
+		while not stop.is_set():
+			try:
+				queue.put(item,timeout=0.1)
+				return True
+			except Queue.Full:
+				pass
+		return False
+
+	def produce():
+		try:
+			try:
+				for item in source:
+					if not put(item):
+						return
+			except Exception:
+				put(_failure(sys.exc_info()))
+			else:
+				put(_done)
+		finally:
+			if hasattr(source,'close'):
+				source.close()
+
+	thread=threading.Thread(target=produce,name=name)
+	thread.daemon=True
+	thread.start()
+	try:
+		while True:
+			item=queue.get()
+			if item is _done:
+				break
+			if isinstance(item,_failure):
+				t,v,tb=item.exc_info
+				raise t,v,tb
+			yield item
+	finally:
+		stop.set()
+
+def chunked(iterable,n):
+	"""lists of up to n consecutive items of iterable"""
+	chunk=[]
+	for item in iterable:
+		chunk.append(item)
+		if len(chunk)>=n:
+			yield chunk
+			chunk=[]
+	if chunk:
+		yield chunk
+
+def _test_threaded():
+	"""
+	>>> list(threaded(iter(range(5)),queue_size=2))
+	[0, 1, 2, 3, 4]
+	>>> def sums(chunks):
+	...	for c in chunks:
+	...		yield sum(c)
+	>>> list(threaded(sums(threaded(chunked(range(7),3))),queue_size=1))
+	[3, 12, 6]
+	>>> def failing():
+	...	yield 1
+	...	raise IOError("disk gone")
+	>>> list(threaded(sums(threaded(chunked(failing(),1)))))
+	Traceback (most recent call last):
+	...
+	IOError: disk gone
+
+	A consumer stopping early stops the producer
+	>>> import time
+	>>> produced=[]
+	>>> def endless():
+	...	i=0
+	...	while True:
+	...		produced.append(i)
+	...		yield i
+	...		i+=1
+	>>> rows=threaded(endless(),queue_size=2)
+	>>> rows.next(), rows.next()
+	(0, 1)
+	>>> rows.close()
+	>>> time.sleep(0.3)
+	>>> n=len(produced); time.sleep(0.3); len(produced)==n, n<10
+	(True, True)
+	"""
+
+if __name__ == "__main__":
+	import doctest
+	doctest.testmod(optionflags=doctest.ELLIPSIS)
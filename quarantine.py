@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+import doctest
+import csv
+import threading
+
+class ErrorBudgetExceeded(ValueError):
+	"""raised when a load has more bad rows than its error budget allows"""
+
+class budget(object):
+	"""
+	How many bad rows a load may have before it is given up on, as a
+	number of rows (max_errors) and/or a fraction of the rows read so far
+	(max_fraction). The fraction is only checked once min_rows rows have
+	been read, or at the end of the file.
+
+	probe (default False): check the budget against the sample read when
+		probing the file as well, so that a broken file is rejected before
+		anything has been loaded. Only lines with the wrong number of
+		columns are noticed when probing.
+	"""
+	def __init__(self,max_errors=None,max_fraction=None,min_rows=100,probe=False):
+		assert max_errors!=None or max_fraction!=None, "an error budget needs max_errors or max_fraction"
+		self.max_errors=max_errors
+		self.max_fraction=max_fraction
+		self.min_rows=min_rows
+		self.probe=probe
+
+	def check(self,errors,rows,final=False,what="rows"):
+		"""raise ErrorBudgetExceeded if errors bad rows besides rows good ones are too many"""
+		total=errors+rows
+		if self.max_errors!=None and errors>self.max_errors:
+			raise ErrorBudgetExceeded("%i of %i %s were bad, the error budget is %i"%(errors,total,what,self.max_errors))
+		if self.max_fraction!=None and total and (final or total>=self.min_rows) and errors>self.max_fraction*total:
+			raise ErrorBudgetExceeded("%i of %i %s were bad, the error budget is %g%%"%(errors,total,what,self.max_fraction*100))
+
+	def __str__(self):
+		return " or ".join(s for s in [
+			"%i rows"%self.max_errors if self.max_errors!=None else None,
+			"%g%%"%(self.max_fraction*100) if self.max_fraction!=None else None
+		] if s)
+
+def parse_budget(text,probe=False):
+	"""a budget from "100" (rows) or "2.5%" (of the rows)"""
+	text=text.strip()
+	if text.endswith("%"):
+		fraction=float(text[:-1])/100
+		if not 0<=fraction<=1:
+			raise ValueError("the error budget %s is not between 0%% and 100%%"%text)
+		return budget(max_fraction=fraction,probe=probe)
+	errors=int(text)
+	if errors<0:
+		raise ValueError("the error budget can not be negative")
+	return budget(max_errors=errors,probe=probe)
+
+class quarantine(object):
+	"""
+	A CSV file of rejected lines, with the columns line (the line number
+	in the file, or None if it is not known), offset (the byte offset of
+	the line, or None), reason and raw (the line as it was in the file,
+	without the newline). Lines are written buffer_rows at a time, call
+	flush() or close() when done.
+	"""
+	columns=["line","offset","reason","raw"]
+
+	def __init__(self,fd,header=True,buffer_rows=1000):
+		"""
+		fd: a file-like object to write to
+		header (default True): start with a line with the column names,
+			leave it out when appending to an existing file
+		"""
+		self.fd=fd
+		self.buffer_rows=buffer_rows
+		self.rejected=0
+		self._writer=csv.writer(fd,lineterminator="\n")
+		self._buffer=[]
+		self._lock=threading.Lock()
+		if header:
+			self._writer.writerow(self.columns)
+
+	def reject(self,raw,line=None,offset=None,reason=""):
+		with self._lock:
+			self._buffer.append(("" if line==None else line,"" if offset==None else offset,reason,raw))
+			self.rejected+=1
+			if len(self._buffer)>=self.buffer_rows:
+				self._flush()
+
+	def flush(self):
+		with self._lock:
+			self._flush()
+
+	def _flush(self):
+		if self._buffer:
+			self._writer.writerows(self._buffer)
+			self._buffer=[]
+		self.fd.flush()
+
+	def close(self):
+		self.flush()
+		self.fd.close()
+
+def _test_budget():
+	"""
+	>>> b=parse_budget("10")
+	>>> b.check(10,5)
+	>>> b.check(11,5)
+	Traceback (most recent call last):
+	...
+	ErrorBudgetExceeded: 11 of 16 rows were bad, the error budget is 10
+	>>> b=parse_budget("5%")
+	>>> print b
+	5%
+	>>> b.check(10,50)
+	>>> b.check(10,50,final=True)
+	Traceback (most recent call last):
+	...
+	ErrorBudgetExceeded: 10 of 60 rows were bad, the error budget is 5%
+	>>> b.check(10,190)
+	>>> parse_budget("150%")
+	Traceback (most recent call last):
+	...
+	ValueError: the error budget 150% is not between 0% and 100%
+	"""
+
+def _test_quarantine():
+	'''
+	>>> from StringIO import StringIO as sIO
+	>>> out=sIO()
+	>>> q=quarantine(out,buffer_rows=2)
+	>>> q.reject("1,2,3",line=5,offset=40,reason="3 columns, expected 2")
+	>>> out.getvalue()
+	'line,offset,reason,raw\\n'
+	>>> q.reject('x,"a'+chr(10)+'b"',reason="bad")
+	>>> print out.getvalue()
+	line,offset,reason,raw
+	5,40,"3 columns, expected 2","1,2,3"
+	,,bad,"x,""a
+	b"""
+	<BLANKLINE>
+	>>> [r for r in csv.reader(sIO(out.getvalue()))][-1]
+	['', '', 'bad', 'x,"a\\nb"']
+	'''
+
+if __name__ == "__main__":
+	import doctest
+	doctest.testmod(optionflags=doctest.ELLIPSIS)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+import doctest
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+class schemacache(object):
+	"""
+	Directory of inferred column types, keyed on the header line.
+
+	Files that are loaded again and again (daily exports and the like)
+	mostly have the same columns with the same types every time, with the
+	types from an earlier run csvparse only has to confirm them on a few
+	rows instead of probing the whole file.
+
+	Each entry is a json-file with the failtype states of the columns, see
+	failtype.get_state.
+	"""
+	def __init__(self,path,ttl=None):
+		"""
+		path: the directory to keep the cache in, created if missing
+		ttl (default None): seconds an entry is valid, None is forever
+		"""
+		self.path=path
+		self.ttl=ttl
+		if not os.path.isdir(path):
+			os.makedirs(path)
+
+	def key(self,headers,sep,utf=False):
+		h=hashlib.sha1()
+		h.update(json.dumps([sep,utf,list(headers)]))
+		return h.hexdigest()
+
+	def _file(self,headers,sep,utf):
+		return os.path.join(self.path,self.key(headers,sep,utf)+".json")
+
+	def get(self,headers,sep,utf=False):
+		"""the column states stored for the headers, or None"""
+		try:
+			with open(self._file(headers,sep,utf)) as f:
+				entry=json.load(f)
+		except (IOError,ValueError):
+			return None
+		if entry.get('headers')!=list(headers) or len(entry.get('columns',[]))!=len(headers):
+			return None
+		if self.ttl!=None and time.time()-entry.get('saved',0)>self.ttl:
+			return None
+		return entry['columns']
+
+	def put(self,headers,sep,states,utf=False):
+		"""store the column states, replaces any earlier entry atomically"""
+		entry={'headers':list(headers),'sep':sep,'saved':time.time(),'columns':states}
+		fd,tmp=tempfile.mkstemp(dir=self.path,suffix=".tmp")
+		try:
+			with os.fdopen(fd,"w") as f:
+				json.dump(entry,f)
+			os.rename(tmp,self._file(headers,sep,utf))
+		except:
+			os.remove(tmp)
+			raise
+
+	def invalidate(self,headers,sep,utf=False):
+		"""forget the entry for the headers, if there is one"""
+		try:
+			os.remove(self._file(headers,sep,utf))
+		except OSError:
+			pass
+
+def _test_cache():
+	"""
+	>>> import shutil
+	>>> path=tempfile.mkdtemp()
+	>>> c=schemacache(os.path.join(path,"schemas"))
+	>>> c.get(["a","b"],",") == None
+	True
+	>>> c.put(["a","b"],",",[{"x":1},{"y":2}])
+	>>> c.get(["a","b"],",")
+	[{u'x': 1}, {u'y': 2}]
+	>>> c.get(["a","b"],";") == None, c.get(["a","b"],",",utf=True) == None
+	(True, True)
+	>>> schemacache(c.path,ttl=-1).get(["a","b"],",") == None
+	True
+	>>> c.invalidate(["a","b"],",")
+	>>> c.get(["a","b"],",") == None
+	True
+	>>> os.listdir(c.path)
+	[]
+	>>> shutil.rmtree(path)
+	"""
+
+if __name__ == "__main__":
+	import doctest
+	doctest.testmod(optionflags=doctest.ELLIPSIS)
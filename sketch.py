@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+import doctest
+import hashlib
+import math
+import re
+import struct
+
+_decimal_re=re.compile(r"[+-]?(\d*)(?:\.(\d*))?\Z")
+
+class hyperloglog(object):
+	"""
+	Estimates the number of distinct values added, within a few percent
+	(1.04/sqrt(2**p)) using 2**p bytes. Two of them with the same p are
+	merged by keeping the largest of each register.
+	"""
+	def __init__(self,p=10):
+		self.p=p
+		self.registers=bytearray(1<<p)
+
+	def add(self,value):
+		if isinstance(value,unicode):
+			value=value.encode('utf-8')
+		h=struct.unpack("<Q",hashlib.md5(value).digest()[:8])[0]
+		rest=h&((1<<(64-self.p))-1)
+		rank=64-self.p-rest.bit_length()+1
+		i=h>>(64-self.p)
+		if rank>self.registers[i]:
+			self.registers[i]=rank
+
+	def estimate(self):
+		m=len(self.registers)
+		e=0.7213/(1+1.079/m)*m*m/sum(2.0**-r for r in self.registers)
+		zeros=self.registers.count("\0")
+		if e<=2.5*m and zeros:
+			e=m*math.log(float(m)/zeros) #linear counting for small sets
+		return int(round(e))
+
+	def merge(self,other):
+		assert other.p==self.p, "can only merge hyperloglogs of the same size"
+		self.registers=bytearray(max(a,b) for a,b in zip(self.registers,other.registers))
+
+	def get_state(self):
+		return {'p':self.p,'registers':str(self.registers).encode('hex')}
+
+	def set_state(self,state):
+		self.p=state['p']
+		self.registers=bytearray(state['registers'].decode('hex'))
+
+class columnsketch(object):
+	"""
+	Streaming statistics of the non-null values of a column, all of them
+	can be merged with the statistics of other parts of the same column:
+
+	count, nulls: the number of values and NULLs seen
+	lengths: {byte length: count}, see quantile()
+	min, max: of the values if they are all numbers, else None
+	int_digits, scale: the most digits before and after the decimal point
+		if all values are plain decimal numbers (no exponent), see precision
+	values: the distinct values while there are at most max_values of
+		them, then None, see distinct()
+	"""
+	def __init__(self,max_values=32,p=10):
+		self.max_values=max_values
+		self.count=0
+		self.nulls=0
+		self.lengths={}
+		self.numeric=True
+		self.min=None
+		self.max=None
+		self.decimal=True
+		self.int_digits=0
+		self.scale=0
+		self.values=set()
+		self.hll=hyperloglog(p)
+
+	def add_null(self):
+		self.nulls+=1
+
+	def add(self,s):
+		"""add a stripped non-null value"""
+		self.count+=1
+		n=len(s.encode('utf-8')) if isinstance(s,unicode) else len(s)
+		self.lengths[n]=self.lengths.get(n,0)+1
+		if self.numeric:
+			self._add_number(s)
+		if self.values!=None:
+			self.values.add(s)
+			if len(self.values)>self.max_values:
+				self.values=None
+		self.hll.add(s)
+
+	def _add_number(self,s):
+		m=_decimal_re.match(s) if self.decimal else None
+		if m and (m.group(1) or m.group(2)):
+			whole,frac=m.group(1),m.group(2) or ''
+			v=float(s) if m.group(2)!=None else int(s)
+			self.int_digits=max(self.int_digits,len(whole.lstrip('0')))
+			self.scale=max(self.scale,len(frac.rstrip('0')))
+		else:
+			try:
+				v=float(s)
+			except ValueError:
+				self.numeric=False
+				self.min=self.max=None
+				return
+			self.decimal=False
+			if v!=v: #nan
+				return
+		if self.min==None or v<self.min:
+			self.min=v
+		if self.max==None or v>self.max:
+			self.max=v
+
+	@property
+	def null_fraction(self):
+		total=self.count+self.nulls
+		return float(self.nulls)/total if total else None
+
+	@property
+	def precision(self):
+		"""the digits needed for a decimal type holding all values, or None"""
+		if not (self.numeric and self.decimal and self.count):
+			return None
+		return self.int_digits+self.scale
+
+	def distinct(self):
+		"""the number of distinct values, exact if there are at most max_values of them"""
+		if self.values!=None:
+			return len(self.values)
+		return self.hll.estimate()
+
+	def quantile(self,q):
+		"""the byte length that a fraction q of the values are no longer than"""
+		if not self.count:
+			return None
+		seen=0
+		for n in sorted(self.lengths):
+			seen+=self.lengths[n]
+			if seen>=q*self.count:
+				return n
+		return n
+
+	@property
+	def max_length(self):
+		return max(self.lengths) if self.lengths else None
+
+	def merge(self,other):
+		self.count+=other.count
+		self.nulls+=other.nulls
+		for n,c in other.lengths.items():
+			self.lengths[n]=self.lengths.get(n,0)+c
+		self.numeric=self.numeric and other.numeric
+		self.decimal=self.decimal and other.decimal
+		if self.numeric:
+			mins=[v for v in (self.min,other.min) if v!=None]
+			self.min=min(mins) if mins else None
+			self.max=max(self.max,other.max) #None is smaller than everything
+		else:
+			self.min=self.max=None
+		self.int_digits=max(self.int_digits,other.int_digits)
+		self.scale=max(self.scale,other.scale)
+		if self.values!=None and other.values!=None:
+			self.values|=other.values
+			if len(self.values)>self.max_values:
+				self.values=None
+		else:
+			self.values=None
+		self.hll.merge(other.hll)
+
+	def get_state(self):
+		"""a json-serializable snapshot, see set_state"""
+		return {
+			'count':self.count,
+			'nulls':self.nulls,
+			'lengths':sorted(self.lengths.items()),
+			'numeric':self.numeric,
+			'min':self.min,
+			'max':self.max,
+			'decimal':self.decimal,
+			'int_digits':self.int_digits,
+			'scale':self.scale,
+			'values':sorted(self.values) if self.values!=None else None,
+			'max_values':self.max_values,
+			'hll':self.hll.get_state(),
+		}
+
+	def set_state(self,state):
+		self.count=state['count']
+		self.nulls=state['nulls']
+		self.lengths=dict(state['lengths'])
+		self.numeric=state['numeric']
+		self.min=state['min']
+		self.max=state['max']
+		self.decimal=state['decimal']
+		self.int_digits=state['int_digits']
+		self.scale=state['scale']
+		self.values=set(state['values']) if state['values']!=None else None
+		self.max_values=state['max_values']
+		self.hll.set_state(state['hll'])
+
+def _test_hyperloglog():
+	"""
+	>>> h=hyperloglog()
+	>>> for i in range(20000):
+	...	h.add(str(i%5000))
+	>>> abs(h.estimate()-5000)<5000*0.1
+	True
+	>>> a,b=hyperloglog(),hyperloglog()
+	>>> for i in range(3000):
+	...	(a if i%2 else b).add("x%i"%i)
+	>>> a.merge(b)
+	>>> abs(a.estimate()-3000)<3000*0.1
+	True
+	>>> c=hyperloglog()
+	>>> c.set_state(a.get_state())
+	>>> c.registers==a.registers, hyperloglog().estimate()
+	(True, 0)
+	"""
+
+def _test_columnsketch():
+	"""
+	>>> s=columnsketch(max_values=3)
+	>>> for v in ["12","-3","0.250","7"]:
+	...	s.add(v)
+	>>> s.add_null()
+	>>> s.min, s.max, s.precision, s.int_digits, s.scale, s.null_fraction
+	(-3, 12, 4, 2, 2, 0.2)
+	>>> s.values, s.distinct(), s.quantile(0.5), s.max_length
+	(None, 4, 2, 5)
+	>>> s.add("1e5")
+	>>> s.max, s.precision
+	(100000.0, None)
+	>>> t=columnsketch(max_values=3)
+	>>> for v in ["a","bb","a"]:
+	...	t.add(v)
+	>>> t.numeric, t.min, sorted(t.values), t.distinct()
+	(False, None, ['a', 'bb'], 2)
+	>>> u=columnsketch(max_values=3)
+	>>> u.add("ccc")
+	>>> t.merge(u)
+	>>> sorted(t.values), t.count, t.max_length
+	(['a', 'bb', 'ccc'], 4, 3)
+	>>> import json
+	>>> v=columnsketch()
+	>>> v.set_state(json.loads(json.dumps(s.get_state())))
+	>>> v.min, v.max, v.count, v.distinct()==s.distinct()
+	(-3, 100000.0, 5, True)
+	"""
+
+if __name__ == "__main__":
+	import doctest
+	doctest.testmod(optionflags=doctest.ELLIPSIS)
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+import doctest
+import collections
+import json
+import os
+import time
+
+def cputime():
+	"""user+system cpu seconds of this process"""
+	t=os.times()
+	return t[0]+t[1]
+
+class stats(object):
+	"""
+	Timings, counters and progress of a load.
+
+	Pass an instance as stats= to csvparse and gentable.load_to_table, they
+	only do any book keeping when they get one. Stages are timed with
+
+		with s.stage("probe"):
+			...
+
+	and hooks added with add_hook are called as hook(stats,event) where
+	event is "stage" when a stage has been timed, "progress" at most every
+	progress_interval seconds while rows are read and "done" at the end.
+	"""
+	def __init__(self,progress_interval=1.0):
+		self.stages=collections.OrderedDict()
+		self.counters=collections.defaultdict(int)
+		self.hooks=[]
+		self.progress_interval=progress_interval
+		self.rows=0
+		self.bytes_read=0
+		self.bytes_total=None
+		self.started=time.time()
+		self._cpu_started=cputime()
+		self._last_progress=0
+		self._finished=None
+
+	def add_hook(self,hook):
+		self.hooks.append(hook)
+
+	def _call_hooks(self,event):
+		for hook in self.hooks:
+			hook(self,event)
+
+	def stage(self,name):
+		"""a context manager timing the wall and cpu time of a stage"""
+		return _timer(self,name)
+
+	def add_time(self,name,wall,cpu,calls=1):
+		"""account time to a stage that is not timed with stage()"""
+		s=self.stages.get(name)
+		if s==None:
+			s=self.stages[name]={'wall':0.0,'cpu':0.0,'calls':0}
+		s['wall']+=wall
+		s['cpu']+=cpu
+		s['calls']+=calls
+		self._call_hooks("stage")
+
+	def count(self,name,n=1):
+		self.counters[name]+=n
+
+	def progress(self,rows,bytes_read,bytes_total=None):
+		"""report how far the reading has come, bytes_total is None if unknown"""
+		self.rows=rows
+		self.bytes_read=bytes_read
+		if bytes_total!=None:
+			self.bytes_total=bytes_total
+		now=time.time()
+		if now-self._last_progress>=self.progress_interval:
+			self._last_progress=now
+			self._call_hooks("progress")
+
+	def elapsed(self):
+		return (self._finished or time.time())-self.started
+
+	def eta(self):
+		"""estimated seconds left, from the bytes read so far, or None"""
+		if not self.bytes_total or not self.bytes_read:
+			return None
+		return self.elapsed()*(self.bytes_total-self.bytes_read)/float(self.bytes_read)
+
+	def finish(self):
+		self._finished=time.time()
+		self._cpu=cputime()-self._cpu_started
+		self._call_hooks("done")
+
+	def report(self):
+		"""everything collected as a json-serializable dict"""
+		elapsed=self.elapsed()
+		return {
+			'elapsed':elapsed,
+			'cpu':self._cpu if self._finished else cputime()-self._cpu_started,
+			'stages':self.stages,
+			'counters':dict(self.counters),
+			'rows':self.rows,
+			'bytes_read':self.bytes_read,
+			'bytes_total':self.bytes_total,
+			'rows_per_s':self.rows/elapsed if elapsed else None,
+			'bytes_per_s':self.bytes_read/elapsed if elapsed else None,
+			'eta':self.eta(),
+		}
+
+	def timed_rows(self,rows,name,position,every=1000):
+		"""
+		Wrap an iterator of rows, the time spent producing them is accounted
+		to the stage name and self.progress is called every every rows with
+		position(), a (rows,bytes_read,bytes_total) tuple.
+
+		Only the wall time is measured per row, the cpu time of each block of
+		rows is split between the producer and the consumer by their share of
+		the wall time.
+		"""
+		n=0
+		block_start=time.time()
+		block_cpu=cputime()
+		block_wall=0.0
+		rows=iter(rows)
+		while True:
+			start=time.time()
+			try:
+				row=rows.next()
+			except StopIteration:
+				break
+			finally:
+				block_wall+=time.time()-start
+			n+=1
+			if n%every==0:
+				now=time.time()
+				cpu=cputime()
+				share=block_wall/(now-block_start) if now>block_start else 1.0
+				self.add_time(name,block_wall,(cpu-block_cpu)*share,every)
+				self.progress(*position())
+				block_start,block_cpu,block_wall=now,cpu,0.0
+			yield row
+		now=time.time()
+		share=block_wall/(now-block_start) if now>block_start else 1.0
+		self.add_time(name,block_wall,(cputime()-block_cpu)*share,n%every)
+		self.progress(*position())
+
+	def write(self,fd):
+		json.dump(self.report(),fd,indent=1)
+
+class _timer(object):
+	def __init__(self,stats,name):
+		self.stats=stats
+		self.name=name
+
+	def __enter__(self):
+		self.wall=time.time()
+		self.cpu=cputime()
+		return self
+
+	def __exit__(self,*exc):
+		self.stats.add_time(self.name,time.time()-self.wall,cputime()-self.cpu)
+		return False
+
+def _test_stats():
+	"""
+	>>> s=stats(progress_interval=0)
+	>>> events=[]
+	>>> s.add_hook(lambda st,event: events.append(event))
+	>>> with s.stage("probe"):
+	...	_=sum(range(1000))
+	>>> s.count("errors",2)
+	>>> rows=list(s.timed_rows(range(2500),"decode",lambda: (len(events),100,400)))
+	>>> len(rows), s.stages["decode"]["calls"], s.stages["probe"]["calls"]
+	(2500, 2500, 1)
+	>>> events.count("progress"), events.count("stage")
+	(3, 4)
+	>>> s.eta()>0
+	True
+	>>> s.finish()
+	>>> r=json.loads(json.dumps(s.report()))
+	>>> sorted(r)
+	[u'bytes_per_s', u'bytes_read', u'bytes_total', u'counters', u'cpu', u'elapsed', u'eta', u'rows', u'rows_per_s', u'stages']
+	>>> r["counters"], r["bytes_total"], events[-1]
+	({u'errors': 2}, 400, 'done')
+	"""
+
+if __name__ == "__main__":
+	import doctest
+	doctest.testmod(optionflags=doctest.ELLIPSIS)
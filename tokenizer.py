@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+import doctest
+import codecs
+import csv
+import re
+
+def blocks(fd,block_size=64*1024,quoting=False,sep=",",max_lines=1000):
+	"""
+	Read fd in blocks of about block_size bytes and cut them in to lines,
+	a line that continues in to the next block is carried over to it.
+	Yields (lines,sizes) per block: the lines without their newlines and
+	the number of bytes each of them took in the file.
+
+	quoting (default False): lines that end inside a quoted field are
+		joined with the following lines, so that a quoted value can hold
+		newlines as in RFC4180. sep is the field separator and a quote
+		that is not closed within max_lines lines is not a quote, see
+		_join_quoted.
+	"""
+	carry=''
+	while True:
+		data=fd.read(block_size)
+		if data=='':
+			break
+		if carry:
+			data=carry+data
+		end=data.rfind("\n")
+		if end==-1:
+			carry=data
+			continue
+		carry=data[end+1:]
+		lines=data[:end].split("\n")
+		if quoting and '"' in data:
+			lines,rest=_join_quoted(lines,sep,max_lines)
+			if rest:
+				carry=rest+"\n"+carry
+		if lines:
+			yield lines,[len(l)+1 for l in lines]
+	if carry and quoting and '"' in carry:
+		end=len(carry)-1 if carry.endswith("\n") else len(carry)
+		lines,rest=_join_quoted(carry[:end].split("\n"),sep,max_lines,final=True)
+		sizes=[len(l)+1 for l in lines]
+		sizes[-1]-=1-(len(carry)-end)
+		yield lines,sizes
+	elif carry:
+		yield [carry],[len(carry)]
+
+_detected=["utf-8","cp1252","latin-1"]
+_non_ascii=re.compile("[\x80-\xff]")
+
+def check_encoding(encoding):
+	"""
+	The normalized name of encoding, ValueError if python does not know it
+	or it can not be split on the ASCII separators and newlines before
+	decoding. Only UTF-8 and single byte encodings can, the second byte of
+	a character in UTF-16 or Shift JIS for example may be a comma.
+	"""
+	try:
+		name=codecs.lookup(encoding).name
+	except LookupError:
+		raise ValueError("unknown encoding %s"%encoding)
+	if name=="utf-8-sig": #the BOM is skipped when the file is opened
+		name="utf-8"
+	probe=u"a,;|\t\"0\n"
+	if probe.encode(name)!=str(probe):
+		raise ValueError("%s is not ASCII compatible, it can not be split before it is decoded"%encoding)
+	if name!="utf-8" and not _single_byte(name):
+		raise ValueError("%s is not UTF-8 or a single byte encoding, it can not be split before it is decoded"%encoding)
+	return name
+
+def _single_byte(name):
+	"""True if every byte is a whole character in the encoding name (or undefined)"""
+	decoder=codecs.getincrementaldecoder(name)()
+	for b in range(256):
+		try:
+			if decoder.decode(chr(b))==u"":
+				return False
+		except UnicodeDecodeError:
+			decoder.reset()
+	return True
+
+def detect_encoding(sample):
+	"""
+	The first of UTF-8, CP1252 and Latin-1 that decodes sample (some bytes
+	from the start of a file), Latin-1 decodes anything. The sample is cut
+	at its last newline so that it does not end in half a character.
+	"""
+	end=sample.rfind("\n")
+	if end!=-1:
+		sample=sample[:end]
+	for encoding in _detected:
+		try:
+			sample.decode(encoding)
+		except UnicodeDecodeError:
+			continue
+		return encoding
+	return _detected[-1]
+
+def is_ascii(line):
+	"""True if line (bytes) only holds ASCII, it then reads the same in any ASCII compatible encoding"""
+	return not _non_ascii.search(line)
+
+def decode(lines,encoding):
+	"""
+	Decode the lines of a block with a single decode of the whole block,
+	returns the decoded lines and {line number: UnicodeDecodeError} of the
+	lines that do not decode, those lines are left as they were. Lines
+	are only decoded one by one if something does not decode or a quoted
+	value holds a newline.
+	"""
+	try:
+		decoded="\n".join(lines).decode(encoding).split(u"\n")
+	except UnicodeDecodeError:
+		decoded=None
+	if decoded!=None and len(decoded)==len(lines):
+		return decoded,{}
+	decoded=[]
+	errors={}
+	for n,l in enumerate(lines):
+		try:
+			decoded.append(l.decode(encoding))
+		except UnicodeDecodeError as e:
+			decoded.append(l)
+			errors[n]=e
+	return decoded,errors
+
+def _join_quoted(lines,sep,max_lines=1000,final=False):
+	"""
+	Join lines where a quoted field spans the newline, returns the joined
+	lines and whatever is left of an unterminated quote at the end. A line
+	whose quote is not closed within max_lines lines (or at all if final)
+	is left as it is and the lines after it are looked at again.
+	"""
+	out=[]
+	start=None
+	i=0
+	while True:
+		while i<len(lines):
+			l=lines[i]
+			if start==None:
+				if '"' in l and _ends_quoted(l,sep):
+					start=i
+				else:
+					out.append(l)
+			elif not _ends_quoted(l,sep,True):
+				out.append("\n".join(lines[start:i+1]))
+				start=None
+			elif i-start>=max_lines:
+				out.append(lines[start])
+				i=start
+				start=None
+			i+=1
+		if start==None or not final:
+			break
+		out.append(lines[start])
+		i=start+1
+		start=None
+	return out,"\n".join(lines[start:]) if start!=None else ''
+
+def _ends_quoted(line,sep,quoted=False):
+	"""
+	True if line ends inside a quoted field, quoted if it starts inside
+	one. As in the csv module only a " starting a field opens a quoted
+	field, other quotes are part of the value.
+	"""
+	if not quoted:
+		line=line.lstrip()
+	i=0
+	while True:
+		if quoted:
+			end=line.find('"',i)
+			if end==-1:
+				return True
+			if line[end+1:end+2]=='"':
+				i=end+2
+				continue
+			quoted=False
+			i=end+1
+		elif line[i:i+1]=='"':
+			quoted=True
+			i+=1
+			continue
+		end=line.find(sep,i)
+		if end==-1:
+			return False
+		i=end+1
+
+def split(lines,sep,quoting=False,errors=None):
+	"""
+	Split stripped lines in to lists of fields. With quoting fields can be
+	quoted with ", and "" inside a quoted field is a single ". Lines the
+	csv module can not split raise a ValueError, or if errors is a dict
+	get no fields and their ValueError in errors[line number].
+	"""
+	if not quoting:
+		return [l.strip().split(sep) for l in lines]
+	try:
+		fields=list(csv.reader([l.strip() for l in lines],delimiter=sep))
+		#a quote left open at the end of a line swallows the next one
+		if len(fields)==len(lines):
+			return fields
+	except csv.Error:
+		pass
+	fields=[]
+	for n,l in enumerate(lines):
+		try:
+			fields.append(split_line(l,sep,True))
+		except ValueError as e:
+			if errors==None:
+				raise
+			errors[n]=e
+			fields.append([])
+	return fields
+
+def split_line(line,sep,quoting=False):
+	"""split a single line, see split"""
+	if not quoting:
+		return line.strip().split(sep)
+	try:
+		for row in csv.reader([line.strip()],delimiter=sep):
+			return row
+	except csv.Error as e:
+		raise ValueError("the row %r can not be split: %s"%(line.strip(),e))
+	return []
+
+def _test_blocks():
+	"""
+	>>> from StringIO import StringIO as sIO
+	>>> data="a,b"+chr(10)+"1,x"+chr(10)+"22,yy"+chr(10)+"333,zzz"
+	>>> list(blocks(sIO(data),block_size=5))
+	[(['a,b'], [4]), (['1,x'], [4]), (['22,yy'], [6]), (['333,zzz'], [7])]
+	>>> list(blocks(sIO(data),block_size=100))
+	[(['a,b', '1,x', '22,yy'], [4, 4, 6]), (['333,zzz'], [7])]
+	>>> sum(sum(sizes) for lines,sizes in blocks(sIO(data),block_size=3))==len(data)
+	True
+	"""
+
+def _test_quoting():
+	'''
+	>>> from StringIO import StringIO as sIO
+	>>> data='a,b'+chr(10)+'1,"x,'+chr(10)+'y"'+chr(10)+'2,"say ""hi"""'+chr(10)
+	>>> [lines for lines,sizes in blocks(sIO(data),block_size=7,quoting=True)]
+	[['a,b'], ['1,"x,\\ny"'], ['2,"say ""hi"""']]
+	>>> lines=[l for ls,sizes in blocks(sIO(data),quoting=True) for l in ls]
+	>>> split(lines,",",quoting=True)
+	[['a', 'b'], ['1', 'x,\\ny'], ['2', 'say "hi"']]
+	>>> split(lines,",")[1]
+	['1', '"x', '\\ny"']
+	>>> split_line(' 1,"a,b" ',",",quoting=True), split_line('',",",quoting=True)
+	(['1', 'a,b'], [])
+
+	Only a quote opening a field starts a quoted field, one that is never
+	closed is left as it is after max_lines lines or at the end
+	>>> data='1,12" pipe'+chr(10)+'2,"a"b"c",d'+chr(10)+'3,"x'+chr(10)+'y",z'+chr(10)+'4,"open'+chr(10)+'5,q'+chr(10)+'6,r'
+	>>> [lines for lines,sizes in blocks(sIO(data),block_size=12,quoting=True)]
+	[['1,12" pipe'], ['2,"a"b"c",d'], ['3,"x\\ny",z'], ['4,"open', '5,q', '6,r']]
+	>>> [lines for lines,sizes in blocks(sIO(data+chr(10)),quoting=True,max_lines=1)]
+	[['1,12" pipe', '2,"a"b"c",d', '3,"x\\ny",z', '4,"open', '5,q', '6,r']]
+	>>> sum(sum(sizes) for lines,sizes in blocks(sIO(data),block_size=5,quoting=True))==len(data)
+	True
+	>>> errors={}
+	>>> split(['1,"a"','2,b'+chr(13)+'c','3,d'],",",quoting=True,errors=errors), errors.keys()
+	([['1', 'a'], [], ['3', 'd']], [1])
+	>>> split(['2,b'+chr(13)+'c'],",",quoting=True)
+	Traceback (most recent call last):
+	...
+	ValueError: the row '2,b\\rc' can not be split: new-line character seen in unquoted field...
+	'''
+
+def _test_encodings():
+	'''
+	>>> check_encoding("UTF8"), check_encoding("utf-8-sig"), check_encoding("windows-1252"), check_encoding("l1")
+	('utf-8', 'utf-8', 'cp1252', 'iso8859-1')
+	>>> check_encoding("utf-16")
+	Traceback (most recent call last):
+	...
+	ValueError: utf-16 is not ASCII compatible, it can not be split before it is decoded
+	>>> check_encoding("shift_jis")
+	Traceback (most recent call last):
+	...
+	ValueError: shift_jis is not UTF-8 or a single byte encoding, it can not be split before it is decoded
+	>>> check_encoding("gbk")
+	Traceback (most recent call last):
+	...
+	ValueError: gbk is not UTF-8 or a single byte encoding, it can not be split before it is decoded
+	>>> check_encoding("big5")
+	Traceback (most recent call last):
+	...
+	ValueError: big5 is not UTF-8 or a single byte encoding, it can not be split before it is decoded
+	>>> check_encoding("koi8-r"), check_encoding("cp437")
+	('koi8-r', 'cp437')
+	>>> check_encoding("klingon")
+	Traceback (most recent call last):
+	...
+	ValueError: unknown encoding klingon
+	>>> line=u"1,\\xe5\\u20ac"+chr(10)
+	>>> detect_encoding(line.encode("utf-8")), detect_encoding(line.encode("cp1252")), detect_encoding("1,\\xe5\\x81")
+	('utf-8', 'cp1252', 'latin-1')
+	>>> detect_encoding("ascii"+chr(10)+"\\xc3")
+	'utf-8'
+	>>> is_ascii("a,b"), is_ascii("a,\\xc3\\xa5")
+	(True, False)
+	>>> decode(["a,\\xc3\\xa5","b"],"utf-8")
+	([u'a,\\xe5', u'b'], {})
+	>>> decode(["a,\\xe5","b",'"x'+chr(10)+'y"'],"utf-8")
+	(['a,\\xe5', u'b', u'"x\\ny"'], {0: UnicodeDecodeError('utf8', 'a,\\xe5', 2, 3, 'unexpected end of data')})
+	'''
+
+if __name__ == "__main__":
+	import doctest
+	doctest.testmod(optionflags=doctest.ELLIPSIS)
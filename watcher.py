@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+import doctest
+import os
+import sys
+import threading
+import traceback
+from multiprocessing.pool import ThreadPool
+
+class watcher(object):
+	"""
+	Watch a spool directory and load every file that shows up in it.
+
+	A file is picked up once its size and modification time have been the
+	same for two polls in a row, so files that are still being written are
+	left alone. Hidden files and files ending with .tmp or .part are
+	ignored. Up to jobs files are loaded at the same time in a pool of
+	threads, but never two files with the same key (the target table).
+	Loaded files are moved to done_dir, files that failed to failed_dir
+	together with a FILENAME.error holding the traceback.
+	"""
+	def __init__(self,path,load,key=None,jobs=4,interval=1.0,done_dir=None,failed_dir=None,verbose=False):
+		"""
+		path: the directory to watch
+		load: a function load(filename) loading one file, failing by raising
+		key (default None): a function key(filename), files with the same
+			key are loaded one after another. Default is the file name.
+		jobs (default 4): the number of files to load concurrently
+		interval (default 1.0): seconds between polls of the directory
+		done_dir, failed_dir (default path/done and path/failed): where to
+			move loaded and failed files, created if missing
+		"""
+		self.path=path
+		self.load=load
+		self.key=key or (lambda fname: fname)
+		self.interval=interval
+		self.done_dir=done_dir or os.path.join(path,"done")
+		self.failed_dir=failed_dir or os.path.join(path,"failed")
+		self.verbose=verbose
+		for d in (self.done_dir,self.failed_dir):
+			if not os.path.isdir(d):
+				os.makedirs(d)
+		self.pool=ThreadPool(jobs)
+		self.loaded=0
+		self.failed=0
+		self._seen={} #filename: (size,mtime) at the last poll
+		self._running={} #filename: (key,AsyncResult)
+		self._stop=threading.Event()
+
+	def _candidates(self):
+		for name in sorted(os.listdir(self.path)):
+			if name.startswith(".") or name.endswith((".tmp",".part")):
+				continue
+			fname=os.path.join(self.path,name)
+			if os.path.isfile(fname):
+				yield fname
+
+	def poll(self):
+		"""the files that have not changed since the last poll and are not being loaded"""
+		ready=[]
+		seen={}
+		for fname in self._candidates():
+			try:
+				st=os.stat(fname)
+			except OSError:
+				continue
+			seen[fname]=(st.st_size,st.st_mtime)
+			if self._seen.get(fname)==seen[fname] and fname not in self._running:
+				ready.append(fname)
+		self._seen=seen
+		return ready
+
+	def run_once(self):
+		"""
+		Collect the files that are done and start loading the ready ones,
+		returns the number of files still being loaded.
+		"""
+		for fname,(key,result) in self._running.items():
+			if result.ready():
+				del self._running[fname]
+				self._finish(fname,result.get())
+		busy=set(key for key,result in self._running.values())
+		for fname in self.poll():
+			key=self.key(fname)
+			if key in busy:
+				continue
+			busy.add(key)
+			if self.verbose:
+				print "Loading %s"%fname
+			self._running[fname]=(key,self.pool.apply_async(_run,(self.load,fname)))
+		return len(self._running)
+
+	def _finish(self,fname,error):
+		if error==None:
+			self.loaded+=1
+			_move(fname,self.done_dir)
+			if self.verbose:
+				print "Loaded %s"%fname
+		else:
+			self.failed+=1
+			dest=_move(fname,self.failed_dir)
+			with open(dest+".error","w") as f:
+				f.write(error)
+			sys.stderr.write("Failed loading file:%s\n%s"%(fname,error))
+		self._seen.pop(fname,None)
+
+	def run(self,until_idle=False):
+		"""
+		Poll the directory until stop() is called or, if until_idle, until a
+		poll finds nothing to do.
+		"""
+		try:
+			while not self._stop.is_set():
+				running=self.run_once()
+				if until_idle and running==0 and not self._pending():
+					break
+				self._stop.wait(self.interval)
+		finally:
+			self.pool.close()
+			self.pool.join()
+			for fname,(key,result) in self._running.items():
+				self._finish(fname,result.get())
+			self._running={}
+
+	def _pending(self):
+		"""True if there are files that has not been loaded yet"""
+		return any(True for fname in self._candidates())
+
+	def stop(self):
+		self._stop.set()
+
+def _run(load,fname):
+	"""load a file in a pool thread, returns None or the formated traceback"""
+	try:
+		load(fname)
+		return None
+	except Exception:
+		return traceback.format_exc()
+
+def _move(fname,directory):
+	"""move fname in to directory without overwriting anything, returns the new name"""
+	base=dest=os.path.join(directory,os.path.basename(fname))
+	n=1
+	while os.path.exists(dest):
+		dest="%s.%i"%(base,n)
+		n+=1
+	os.rename(fname,dest)
+	return dest
+
+def _test_watcher():
+	"""
+	>>> import shutil, tempfile
+	>>> spool=tempfile.mkdtemp()
+	>>> loaded=[]
+	>>> def load(fname):
+	...	if "bad" in fname:
+	...		raise ValueError("bad file")
+	...	loaded.append(os.path.basename(fname))
+	>>> for name in ["a.csv","bad.csv","b.csv",".hidden","c.csv.part"]:
+	...	open(os.path.join(spool,name),"w").write("x")
+	>>> w=watcher(spool,load,jobs=2,interval=0.01)
+
+	Nothing is loaded until the files have been seen unchanged twice
+	>>> w.run_once(), loaded
+	(0, [])
+	>>> from StringIO import StringIO
+	>>> sys.stderr,stderr=StringIO(),sys.stderr
+	>>> w.run(until_idle=True)
+	>>> sys.stderr,stderr=stderr,sys.stderr
+	>>> stderr.getvalue().splitlines()[-1]
+	'ValueError: bad file'
+	>>> sorted(loaded), w.loaded, w.failed
+	(['a.csv', 'b.csv'], 2, 1)
+	>>> sorted(os.listdir(w.done_dir)), sorted(os.listdir(w.failed_dir))
+	(['a.csv', 'b.csv'], ['bad.csv', 'bad.csv.error'])
+	>>> sorted(os.listdir(spool))
+	['.hidden', 'c.csv.part', 'done', 'failed']
+	>>> shutil.rmtree(spool)
+	"""
+
+if __name__ == "__main__":
+	import doctest
+	doctest.testmod(optionflags=doctest.ELLIPSIS)